@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Property check for Jump Point Search: on many random synthetic maps, with
+# water, walls and sand patches, every JPS path must be a valid walk with
+# exactly the cost of the A* path for the same (start, goal) pair. Exits
+# non-zero on the first disagreement.
+#
+# Run from the virtz directory:  python -m bench.jps --maps 50
+
+import os
+import io
+import sys
+import random
+import argparse
+import tempfile
+import contextlib
+
+# Render offscreen, the benchmark never opens a window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+
+from game.levels import LevelMap
+from game.util import Pathfinder
+from bench.synthetic import synthetic_map, save_map
+from bench.pathfinding import path_cost, random_pairs, time_pathfinder
+
+this = sys.modules[__name__]
+BASE_PATH = os.getcwd()
+DB_PATH = os.path.join(BASE_PATH, 'data/game_data.db')
+TILE_MAP = os.path.join(BASE_PATH, 'resources/world_tilemap.png')
+
+
+def random_level(rng, map_path):
+    map_dict = synthetic_map(rng.randint(8, 60), rng.randint(8, 40), seed=rng.getrandbits(32),
+            water=rng.uniform(0, 0.4), sand=rng.uniform(0, 0.5))
+    save_map(map_dict, map_path)
+    level_map = LevelMap(TILE_MAP, level_map=map_path, db_path=DB_PATH, storage='grid')
+    with contextlib.redirect_stdout(io.StringIO()):
+        level_map.prepare()
+    return level_map
+
+
+def valid_walk(level_map, path, start, goal):
+    steps = list(reversed(path))
+    if steps[0] != start or steps[-1] != goal:
+        return False
+    for (x1, y1, z1), (x2, y2, z2) in zip(steps, steps[1:]):
+        if max(abs(x1 - x2), abs(y1 - y2)) != 1 or z1 != z2:
+            return False
+        if (x2, y2, z2) not in level_map.adjacency.neighbors((x1, y1, z1)):
+            return False
+    return True
+
+
+def check(maps, pairs, seed):
+    rng = random.Random(seed)
+    handle, map_path = tempfile.mkstemp(suffix='.map')
+    os.close(handle)
+    timings = {'astar': 0, 'jps': 0}
+    failures = 0
+    try:
+        for n in range(maps):
+            level_map = random_level(rng, map_path)
+            queries = random_pairs(level_map, pairs, rng.getrandbits(32))
+            paths = {}
+            for algorithm in timings:
+                pathfinder = Pathfinder(cache_size=0, algorithm=algorithm)
+                pathfinder.graph = level_map
+                elapsed, paths[algorithm] = time_pathfinder(pathfinder, queries)
+                timings[algorithm] += elapsed
+
+            for (start, goal), old, new in zip(queries, paths['astar'], paths['jps']):
+                if bool(old) != bool(new):
+                    reason = 'reachability differs'
+                elif not old:
+                    continue
+                elif not valid_walk(level_map, new, start, goal):
+                    reason = 'invalid path'
+                elif path_cost(level_map, pathfinder, old) != path_cost(level_map, pathfinder, new):
+                    reason = 'cost {} != {}'.format(path_cost(level_map, pathfinder, new),
+                            path_cost(level_map, pathfinder, old))
+                else:
+                    continue
+                failures += 1
+                print('[!] Map {} {} -> {}: {}'.format(n, start, goal, reason))
+    finally:
+        os.remove(map_path)
+    return failures, timings
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--maps', default=30, type=int, help='Number of random maps')
+    parser.add_argument('--pairs', default=40, type=int, help='(start, goal) pairs per map')
+    parser.add_argument('-s', '--seed', default=0, type=int, help='Random seed')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    this.cli_args = cli()
+    pygame.display.init()
+    failures, timings = check(cli_args.maps, cli_args.pairs, cli_args.seed)
+    queries = cli_args.maps * cli_args.pairs
+    print('[*] JPS vs A*: {} maps, {} pairs'.format(cli_args.maps, queries))
+    for label, elapsed in timings.items():
+        print(' -  {:<6} {:8.3f}s total  {:8.3f}ms/path'.format(label, elapsed, 1000 * elapsed / queries))
+    print(' -  disagreements: {}'.format(failures))
+    if failures:
+        sys.exit(1)
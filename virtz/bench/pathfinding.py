@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Compares the heap-based Pathfinder against the original list-scanning
+# A* implementation on the test_map layout.
+#
+# Run from the virtz directory:  python -m bench.pathfinding
+
+import os
+import sys
+import time
+import random
+import argparse
+from collections import defaultdict
+from math import inf as Infinity
+
+# Render offscreen, the benchmark never opens a window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+
+from game.levels import LevelMap
+from game.util import Pathfinder
+
+this = sys.modules[__name__]
+BASE_PATH = os.getcwd()
+
+
+class ListScanPathfinder(Pathfinder):
+
+    ''' The original Pathfinder._a_star, kept as a reference point '''
+
+    def _a_star(self, start, goal):
+        closed_set = []
+        open_set = [start]
+        came_from = {}
+        g_score = defaultdict(lambda: Infinity)
+        g_score[start] = 0
+        f_score = defaultdict(lambda: Infinity)
+        f_score[start] = self._heuristic(start, goal)
+
+        while open_set:
+            current = min({pos: f_score[pos] for pos in f_score if pos in open_set}, key=f_score.get)
+            if current == goal:
+                return self._reconstruct(came_from, goal)
+
+            if current in open_set:
+                open_set.remove(current)
+            closed_set.append(current)
+
+            for point in self.graph.level_map.get_neighbors(current):
+                movement_cost = self.graph.level_map[point].movement_cost
+
+                if point in closed_set:
+                    continue
+                elif point not in open_set:
+                    open_set.append(point)
+
+                temp_score = g_score[current] + self._heuristic(current, point) * movement_cost
+                if temp_score > g_score[point]:
+                    continue
+
+                came_from[point] = current
+                g_score[point] = temp_score
+                f_score[point] = g_score[point] + self._heuristic(point, goal)
+        return False
+
+
+def load_level(map_path, tile_map, db_path):
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    level_map = LevelMap(tile_map, level_map=map_path, db_path=db_path)
+    level_map.prepare()
+    return level_map
+
+
+def path_cost(level_map, pathfinder, path):
+    ''' Total movement cost of a reversed path as returned by the Pathfinder '''
+
+    steps = list(reversed(path))
+    return sum(pathfinder._heuristic(a, b) * level_map[b].movement_cost
+            for a, b in zip(steps, steps[1:]))
+
+
+def random_pairs(level_map, count, seed):
+    rng = random.Random(seed)
+    passable = sorted(p for p in level_map.world_map if level_map[p].passable)
+    return [(rng.choice(passable), rng.choice(passable)) for n in range(count)]
+
+
+def time_pathfinder(pathfinder, pairs):
+    results = []
+    start_time = time.perf_counter()
+    for pair in pairs:
+        results.append(pathfinder[pair])
+    return time.perf_counter() - start_time, results
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--map', help='Path to the level map',
+            default=os.path.join(BASE_PATH, 'data/test_map'))
+    parser.add_argument('-n', '--pairs', help='Number of (start, goal) pairs',
+            default=50, type=int)
+    parser.add_argument('-s', '--seed', help='Random seed for pair selection',
+            default=0, type=int)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    this.cli_args = cli()
+    level_map = load_level(cli_args.map,
+            os.path.join(BASE_PATH, 'resources/world_tilemap.png'),
+            os.path.join(BASE_PATH, 'data/game_data.db'))
+    pairs = random_pairs(level_map, cli_args.pairs, cli_args.seed)
+
+    timings = {}
+    paths = {}
+    for label, cls in (('list-scan', ListScanPathfinder), ('heap', Pathfinder)):
+        pathfinder = cls(cache_size=0)
+        pathfinder.graph = level_map
+        timings[label], paths[label] = time_pathfinder(pathfinder, pairs)
+
+    mismatched = 0
+    for old, new in zip(paths['list-scan'], paths['heap']):
+        if bool(old) != bool(new):
+            mismatched += 1
+        elif old and path_cost(level_map, pathfinder, old) != path_cost(level_map, pathfinder, new):
+            mismatched += 1
+
+    print('[*] A* benchmark: {} pairs on {}'.format(len(pairs), cli_args.map))
+    for label in timings:
+        print(' -  {:<10} {:8.3f}s total  {:8.2f}ms/path'.format(
+            label, timings[label], 1000 * timings[label] / len(pairs)))
+    print(' -  speedup:   {:8.1f}x'.format(timings['list-scan'] / timings['heap']))
+    print(' -  cost mismatches: {}'.format(mismatched))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Walks long routes across a synthetic map while cells just ahead of the
+# walker keep turning blocking, and compares replanning with a fresh A*
+# whenever the remaining path is cut against repairing DStarLite routes.
+#
+# Run from the virtz directory:  python -m bench.replanning --routes 20
+
+import os
+import io
+import sys
+import random
+import argparse
+import tempfile
+import contextlib
+
+# Render offscreen, the benchmark never opens a window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+
+from game.levels import LevelMap
+from game.util import Pathfinder
+from bench.suite import Timer
+from bench.synthetic import synthetic_map, save_map
+
+this = sys.modules[__name__]
+BASE_PATH = os.getcwd()
+DB_PATH = os.path.join(BASE_PATH, 'data/game_data.db')
+TILE_MAP = os.path.join(BASE_PATH, 'resources/world_tilemap.png')
+
+
+def load(map_path):
+    level_map = LevelMap(TILE_MAP, level_map=map_path, db_path=DB_PATH, storage='grid')
+    with contextlib.redirect_stdout(io.StringIO()):
+        level_map.prepare()
+    return level_map
+
+
+def long_pairs(level_map, count, seed):
+    rng = random.Random(seed)
+    width, height, _ = level_map.bounds
+    passable = [p for p in level_map.level_positions(0) if level_map[p].passable]
+    pairs = []
+    while len(pairs) < count:
+        start, goal = rng.sample(passable, 2)
+        if abs(start[0] - goal[0]) + abs(start[1] - goal[1]) > (width + height) // 2:
+            pairs.append((start, goal))
+    return pairs
+
+
+def walk(level_map, pathfinder, start, goal, rng, interval, ahead, max_steps):
+    ''' Walk from start to goal, blocking the cell `ahead` steps along
+        the current plan every `interval` steps. Returns (steps, replans,
+        reached goal).
+    '''
+    route = pathfinder[(start, goal)]
+    if not route:
+        return 0, 0, False
+    incremental = not isinstance(route, list)
+    position = route.pop()
+    steps = replans = 0
+    version = level_map.topology_version
+    while position != goal and steps < max_steps:
+        if steps and steps % interval == 0:
+            plan = route.to_list() if incremental else route
+            if plan and len(plan) > ahead + 1:
+                cell = plan[-ahead]
+                if cell != goal and rng.random() < 0.9:
+                    level_map.set_blocking(cell, True)
+
+        if not incremental and level_map.topology_version != version:
+            version = level_map.topology_version
+            if any(not level_map[p].passable for p in route):
+                replans += 1
+                route = pathfinder[(position, goal)]
+                if not route:
+                    return steps, replans, False
+                route.pop()
+
+        if not route:
+            return steps, replans, False
+        position = route.pop()
+        if not level_map[position].passable:
+            raise AssertionError('Walked into a blocked cell at {}'.format(position))
+        steps += 1
+    return steps, replans, position == goal
+
+
+def run(args):
+    map_dict = synthetic_map(args.width, args.height, seed=args.seed)
+    handle, map_path = tempfile.mkstemp(suffix='.map')
+    os.close(handle)
+    save_map(map_dict, map_path)
+    results = {}
+    try:
+        for algorithm in ('astar', 'dstar'):
+            level_map = load(map_path)
+            pathfinder = Pathfinder(cache_size=0, algorithm=algorithm)
+            pathfinder.graph = level_map
+            rng = random.Random(args.seed)
+            totals = [0, 0, 0]
+            with Timer() as t:
+                for start, goal in long_pairs(level_map, args.routes, args.seed):
+                    steps, replans, reached = walk(level_map, pathfinder, start, goal,
+                            rng, args.interval, args.ahead, 4 * (args.width + args.height))
+                    totals[0] += steps
+                    totals[1] += replans
+                    totals[2] += reached
+            results[algorithm] = t.elapsed, totals
+    finally:
+        os.remove(map_path)
+    return results
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', default=150, type=int, help='Map width in cells')
+    parser.add_argument('--height', default=100, type=int, help='Map height in cells')
+    parser.add_argument('--routes', default=20, type=int, help='Number of routes walked')
+    parser.add_argument('--interval', default=5, type=int,
+            help='Steps between cells turning blocking')
+    parser.add_argument('--ahead', default=3, type=int,
+            help='How far ahead on the plan the blocked cell is')
+    parser.add_argument('-s', '--seed', default=0, type=int, help='Random seed')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    this.cli_args = cli()
+    pygame.display.init()
+    results = run(cli_args)
+    print('[*] Replanning on a {}x{} map, {} routes'.format(
+        cli_args.width, cli_args.height, cli_args.routes))
+    for algorithm, (elapsed, (steps, replans, reached)) in results.items():
+        print(' -  {:<6} {:8.3f}s  {:6} steps  {:4} full replans  {}/{} reached'.format(
+            algorithm, elapsed, steps, replans, reached, cli_args.routes))
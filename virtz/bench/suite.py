@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmark suite timing map translation, pathfinding, rendering, item
+# lookups and simulation ticks on a synthetic map. Runs offline with SDL's
+# dummy video driver and saves the timings as JSON so runs can be compared.
+#
+# Run from the virtz directory:
+#   python -m bench.suite --size 120x80 -o new.json --compare old.json
+
+import os
+import io
+import sys
+import json
+import time
+import pickle
+import random
+import argparse
+import platform
+import tempfile
+import contextlib
+
+# Render offscreen, the benchmark never opens a window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+
+import virtz as virtz_game
+from game.levels import LevelMap, translate_map, translate_grid
+from game.mapfile import MapFile, write_map
+from game.generator import MapGenerator
+from game.util import Pathfinder
+from game.load_tilemap import split_dims
+from bench.synthetic import synthetic_map, save_map
+from bench.pathfinding import random_pairs
+
+this = sys.modules[__name__]
+BASE_PATH = os.getcwd()
+DB_PATH = os.path.join(BASE_PATH, 'data/game_data.db')
+TILE_MAP = os.path.join(BASE_PATH, 'resources/world_tilemap.png')
+
+
+class Timer:
+
+    ''' Context manager recording the elapsed wall time of a block '''
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, _type, value, tb):
+        self.elapsed = time.perf_counter() - self.start
+
+
+@contextlib.contextmanager
+def quiet():
+    # Virtz print as they go; keep that out of the benchmark output
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def bench_translation(map_path, results):
+    with open(map_path, 'rb') as infile:
+        map_dict = pickle.load(infile)
+    char_map = map_dict['tiles']
+    with Timer() as t:
+        translate_map(char_map, DB_PATH)
+    results['translate_dict'] = t.elapsed
+    with Timer() as t:
+        translate_grid(char_map, DB_PATH)
+    results['translate_grid'] = t.elapsed
+
+    for storage in ('dict', 'grid'):
+        level_map = LevelMap(TILE_MAP, level_map=map_path, db_path=DB_PATH, storage=storage)
+        with quiet(), Timer() as t:
+            level_map.prepare()
+        results['prepare_' + storage] = t.elapsed
+
+    # The same map in the binary format
+    file_path = map_path + '.vzm'
+    write_map(file_path, char_map, map_dict['items'])
+    try:
+        with Timer() as t:
+            MapFile(file_path)
+        results['map_file_open'] = t.elapsed
+        level_map = LevelMap(TILE_MAP, level_map=file_path, db_path=DB_PATH, storage='grid')
+        with quiet(), Timer() as t:
+            level_map.prepare()
+        results['prepare_grid_map_file'] = t.elapsed
+        level_map = LevelMap(TILE_MAP, level_map=file_path, db_path=DB_PATH, storage='chunked')
+        with quiet(), Timer() as t:
+            level_map.prepare()
+        results['prepare_chunked_map_file'] = t.elapsed
+    finally:
+        os.remove(file_path)
+
+
+def bench_generation(width, height, depth, seed, results):
+    with Timer() as t:
+        MapGenerator(width, height, depth, seed=seed).generate()
+    results['generate'] = t.elapsed
+    level_map = LevelMap(TILE_MAP, level_map=MapGenerator(width, height, depth, seed=seed),
+            db_path=DB_PATH, storage='grid')
+    with quiet(), Timer() as t:
+        level_map.prepare()
+    results['prepare_grid_generated'] = t.elapsed
+
+
+def bench_pathfinding(level_map, pairs, seed, workers, results):
+    # Uncached, so repeated pairs still measure the search itself
+    pathfinder = Pathfinder(cache_size=0)
+    pathfinder.graph = level_map
+    pairs = random_pairs(level_map, pairs, seed)
+    with Timer() as t:
+        found = sum(1 for pair in pairs if pathfinder[pair])
+    results['astar_per_path'] = t.elapsed / len(pairs)
+    results['astar_found'] = found
+
+    pathfinder = Pathfinder(cache_size=0, algorithm='jps')
+    pathfinder.graph = level_map
+    with Timer() as t:
+        found = sum(1 for pair in pairs if pathfinder[pair])
+    results['jps_per_path'] = t.elapsed / len(pairs)
+    results['jps_found'] = found
+
+    if workers:
+        # One batch over the worker processes, snapshot publishing included
+        pathfinder = Pathfinder(cache_size=0, workers=workers)
+        pathfinder.graph = level_map
+        try:
+            with Timer() as t:
+                found = sum(1 for path in pathfinder.find_many(pairs) if path)
+        finally:
+            pathfinder.close()
+        results['batch_per_path'] = t.elapsed / len(pairs)
+        results['batch_found'] = found
+
+    # Cold runs scan clusters and fill the entrance cost caches, warm runs
+    # reuse them
+    pathfinder = Pathfinder(algorithm='hpa')
+    pathfinder.graph = level_map
+    for phase in ('hpa_cold_per_path', 'hpa_warm_per_path'):
+        with Timer() as t:
+            found = sum(1 for pair in pairs if pathfinder[pair])
+        results[phase] = t.elapsed / len(pairs)
+    results['hpa_found'] = found
+
+
+def bench_items(level_map, lookups, seed, results):
+    rng = random.Random(seed)
+    width, height, depth = level_map.bounds
+    positions = [(rng.randrange(width), rng.randrange(height), rng.randrange(depth))
+            for n in range(lookups)]
+    with Timer() as t:
+        for position in positions:
+            level_map.find_item(position=position)
+    results['items_by_position'] = t.elapsed / lookups
+
+    item_types = ['food', 'drink', 'bed', 'door']
+    with Timer() as t:
+        for n in range(lookups):
+            level_map.find_item(item_type=item_types[n % len(item_types)])
+    results['items_by_type'] = t.elapsed / lookups
+
+    containers = [i for i in level_map.items if i.is_container] or [None]
+    with Timer() as t:
+        for n in range(lookups):
+            container = containers[n % len(containers)]
+            if container is not None:
+                container.contents
+    results['items_contents'] = t.elapsed / lookups
+
+    # Need maps are searched a sector at a time, time one sector field
+    with Timer() as t:
+        for item_type in item_types:
+            level_map.need_maps[item_type].field((width // 2, height // 2, 0)).rebuild()
+    results['need_map_build'] = t.elapsed / len(item_types)
+    with Timer() as t:
+        for n, position in enumerate(positions):
+            level_map.need_maps[item_types[n % len(item_types)]].nearest(position)
+    results['need_map_nearest'] = t.elapsed / lookups
+
+
+def make_game(map_path, virtz, seed):
+    virtz_game.cli_args = argparse.Namespace(test=False, fullscreen=False,
+            seed=seed, headless=False, pathfinder='astar', path_workers=0,
+            storage='grid', generate=None)
+
+    class BenchGame(virtz_game.Game):
+        game_map = map_path
+
+    with quiet():
+        game = BenchGame()
+        game.starting_virtz = virtz
+        level_map = game.level_map
+        level_map.prepare()
+        # Start the virtz on open ground near the middle of the map
+        width, height, _ = level_map.bounds
+        passable = [p for p in level_map.level_positions(0) if level_map[p].passable]
+        game.start_point = min(passable, key=lambda p: abs(p[0] - width // 2) + abs(p[1] - height // 2))
+        level_map.prepare = lambda: None
+        game._prepare()
+        game._start_virtz()
+    game.paused = False
+    return game
+
+
+def bench_render(game, frames, results):
+    with quiet(), Timer() as t:
+        game._compose_view()
+    results['render_layer_build'] = t.elapsed
+
+    with quiet(), Timer() as t:
+        for n in range(frames):
+            # Forget the view on screen so it is composed and copied whole
+            game._view_key = None
+            game._pre_loop()
+    results['render_full_frame'] = t.elapsed / frames
+
+    with quiet(), Timer() as t:
+        for n in range(frames):
+            game._pre_loop()
+    results['render_dirty_frame'] = t.elapsed / frames
+
+    # Pan back and forth a cell a frame, as when scrolling the map
+    camera = game.camera
+    with quiet(), Timer() as t:
+        for n in range(frames):
+            if not camera.pan(1 if n % 2 else -1, 0):
+                camera.pan(-1 if n % 2 else 1, 0)
+            game._pre_loop()
+    results['render_pan_frame'] = t.elapsed / frames
+
+    # A virt selected fills the side panels
+    virt = next(iter(game.virt_pool.values()))
+    game._selected_object = virt
+    game._selected = virt.position
+    with quiet(), Timer() as t:
+        for n in range(frames):
+            game._pre_loop()
+    results['render_panel_frame'] = t.elapsed / frames
+    game._selected_object = game._selected = None
+
+
+def bench_simulation(game, ticks, results):
+    with quiet(), Timer() as t:
+        for n in range(ticks):
+            game.simulation.step()
+            game._print_logs()
+    results['sim_tick'] = t.elapsed / ticks
+
+    info = game.pathfinder.cache_info()
+    lookups = info.hits + info.suffix_hits + info.misses
+    results['path_cache_hit_rate'] = (info.hits + info.suffix_hits) / lookups if lookups else 0
+
+
+def compare(results, baseline, threshold):
+    ''' Print a comparison against a previous run and return the phases
+        which got slower by more than threshold (a fraction)
+    '''
+    regressions = []
+    print('[*] Compared to baseline (threshold {:.0%})'.format(threshold))
+    for phase, seconds in sorted(results.items()):
+        old = baseline.get(phase)
+        if not old or not phase_is_timing(phase):
+            continue
+        ratio = seconds / old
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(phase)
+        print(' -  {:<22} {:>14.6f}ms  x{:.2f}{}'.format(phase, seconds * 1000, ratio, flag))
+    return regressions
+
+
+def phase_is_timing(phase):
+    return not phase.endswith(('_found', '_rate'))
+
+
+def run(args):
+    width, height = split_dims(args.size.lower())
+    map_dict = synthetic_map(width, height, args.levels, args.seed)
+    handle, map_path = tempfile.mkstemp(suffix='.map')
+    os.close(handle)
+    save_map(map_dict, map_path)
+
+    pygame.display.init()
+    results = {}
+    try:
+        bench_translation(map_path, results)
+        bench_generation(width, height, args.levels, args.seed, results)
+        game = make_game(map_path, args.virtz, args.seed)
+        bench_pathfinding(game.level_map, args.pairs, args.seed, args.workers, results)
+        bench_items(game.level_map, args.lookups, args.seed, results)
+        bench_render(game, args.frames, results)
+        bench_simulation(game, args.ticks, results)
+    finally:
+        os.remove(map_path)
+    return {
+        'meta': {
+            'size': [width, height, args.levels],
+            'seed': args.seed,
+            'pairs': args.pairs,
+            'virtz': args.virtz,
+            'ticks': args.ticks,
+            'frames': args.frames,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+        'results': results,
+        }
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', default='120x80',
+            help='Synthetic map size in cells, i.e. 120x80')
+    parser.add_argument('--levels', default=1, type=int, help='Number of z-levels')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed')
+    parser.add_argument('--pairs', default=100, type=int,
+            help='Number of A* (start, goal) pairs')
+    parser.add_argument('--workers', default=0, type=int,
+            help='Worker processes for the batch pathfinding phase (default=0, skipped)')
+    parser.add_argument('--lookups', default=10000, type=int,
+            help='Number of item lookups per kind')
+    parser.add_argument('--frames', default=20, type=int, help='Frames to render')
+    parser.add_argument('--virtz', default=100, type=int, help='Number of virtz to simulate')
+    parser.add_argument('--ticks', default=20, type=int, help='Simulation ticks to run')
+    parser.add_argument('-o', '--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Previous results JSON file to compare against')
+    parser.add_argument('--threshold', default=0.2, type=float,
+            help='Slowdown fraction flagged as a regression (default=0.2)')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    this.cli_args = cli()
+    report = run(cli_args)
+
+    print('[*] Benchmark results for {}x{}x{}'.format(*report['meta']['size']))
+    for phase, value in sorted(report['results'].items()):
+        if phase_is_timing(phase):
+            print(' -  {:<22} {:>14.6f}ms'.format(phase, value * 1000))
+        else:
+            print(' -  {:<22} {:>14}'.format(phase, value))
+
+    if cli_args.output:
+        with open(cli_args.output, 'w') as outfile:
+            json.dump(report, outfile, indent=2, sort_keys=True)
+        print('Results written to {}'.format(cli_args.output))
+
+    if cli_args.compare:
+        with open(cli_args.compare) as infile:
+            baseline = json.load(infile)['results']
+        if compare(report['results'], baseline, cli_args.threshold):
+            sys.exit(1)
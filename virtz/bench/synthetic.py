@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Seeded synthetic maps in the pickled {'tiles': ..., 'items': ...} format
+# read by LevelMap._open_map
+
+import pickle
+import random
+
+
+def synthetic_map(width, height, depth=1, seed=0, water=0.15, buildings=None, stairs=None,
+        sand=0.0):
+    ''' Returns a map dict of the requested size.
+
+        Levels are grass with random water ponds, optional sand patches and
+        walled buildings with a door on one side. Wells, beds, fruit trees and berry bushes are
+        scattered over open ground. Each level is joined to the next by
+        stacked stairs down/up tiles.
+    '''
+    rng = random.Random(seed)
+    if buildings is None:
+        buildings = max(1, (width * height) // 600)
+    if stairs is None:
+        stairs = max(1, (width * height) // 2000)
+
+    levels = []
+    items = {}
+    for z in range(depth):
+        rows = [['.'] * width for y in range(height)]
+
+        # Ponds
+        for n in range(int(width * height * water) // 40):
+            cx, cy = rng.randrange(width), rng.randrange(height)
+            radius = rng.randint(2, 5)
+            for y in range(max(0, cy - radius), min(height, cy + radius + 1)):
+                for x in range(max(0, cx - radius), min(width, cx + radius + 1)):
+                    if (x - cx) ** 2 + (y - cy) ** 2 <= radius ** 2:
+                        rows[y][x] = '~'
+
+        # Sand patches, which cost more to cross
+        for n in range(int(width * height * sand) // 20):
+            cx, cy = rng.randrange(width), rng.randrange(height)
+            for y in range(max(0, cy - 2), min(height, cy + 3)):
+                for x in range(max(0, cx - 2), min(width, cx + 3)):
+                    if rows[y][x] == '.' and rng.random() < 0.8:
+                        rows[y][x] = 's'
+
+        # Walled buildings with clay floors and a door
+        for n in range(buildings):
+            w, h = rng.randint(5, 10), rng.randint(4, 7)
+            if w + 2 >= width or h + 2 >= height:
+                continue
+            x0, y0 = rng.randrange(1, width - w - 1), rng.randrange(1, height - h - 1)
+            for y in range(y0, y0 + h):
+                for x in range(x0, x0 + w):
+                    edge = y in (y0, y0 + h - 1) or x in (x0, x0 + w - 1)
+                    rows[y][x] = '%' if edge else '_'
+            door = x0 + rng.randrange(1, w - 1), y0 + h - 1, z
+            items[door] = '@'
+            items[x0 + 1, y0 + 1, z] = 'b'
+
+        # Scatter items on open grass
+        for char, density in (('w', 0.002), ('T', 0.002), ('f', 0.002), ('<', 0.005)):
+            for n in range(max(1, int(width * height * density))):
+                x, y = rng.randrange(width), rng.randrange(height)
+                if rows[y][x] == '.' and (x, y, z) not in items:
+                    items[x, y, z] = char
+
+        levels.append(rows)
+
+    for z in range(depth - 1):
+        for n in range(stairs):
+            x, y = rng.randrange(width), rng.randrange(height)
+            if levels[z][y][x] == '.' and levels[z + 1][y][x] == '.' and \
+                    (x, y, z) not in items and (x, y, z + 1) not in items:
+                levels[z][y][x] = 'd'
+                levels[z + 1][y][x] = 'u'
+
+    levels = [[''.join(row) for row in rows] for rows in levels]
+    return {'tiles': levels, 'items': items}
+
+
+def save_map(map_dict, path):
+    with open(path, 'wb') as outfile:
+        pickle.dump(map_dict, outfile)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Resolves which edge piece an edged tile (water, grass border, ...) should
+# be drawn with, based on which of its eight neighbours have a different
+# tile_type. The neighbours are packed into an 8-bit mask and the piece is
+# read from a 256 entry lookup table.
+
+import numpy as np
+
+# Bit order of the neighbour mask as (dx, dy) offsets
+TOP, TOP_RIGHT, TOP_LEFT, LEFT, RIGHT, BOT, BOT_RIGHT, BOT_LEFT = range(8)
+EDGE_OFFSETS = ((0, -1), (1, -1), (-1, -1), (-1, 0),
+                (1, 0), (0, 1), (1, 1), (-1, 1))
+
+# Image names produced by LevelMap._kind_images, indexed by piece number
+EDGE_PIECES = ('image', 'top_right_corner', 'top_left_corner', 'bot_right_corner',
+               'bot_left_corner', 'top_right_image', 'bot_right_image',
+               'top_left_image', 'bot_left_image', 'right_image', 'left_image',
+               'top_image', 'bot_image')
+
+
+def edge_piece(mask):
+    ''' Piece number for a neighbour mask, where a set bit means the
+        neighbour in that direction has a different tile_type
+    '''
+    def diff(bit):
+        return bool(mask >> bit & 1)
+
+    if diff(TOP_RIGHT) and not diff(TOP) and not diff(RIGHT):
+        name = 'top_right_corner'
+    elif diff(TOP_LEFT) and not diff(TOP) and not diff(LEFT):
+        name = 'top_left_corner'
+    elif diff(BOT_RIGHT) and not diff(BOT) and not diff(RIGHT):
+        name = 'bot_right_corner'
+    elif diff(BOT_LEFT) and not diff(BOT) and not diff(LEFT):
+        name = 'bot_left_corner'
+    elif diff(RIGHT) and diff(TOP):
+        name = 'top_right_image'
+    elif diff(RIGHT) and diff(BOT):
+        name = 'bot_right_image'
+    elif diff(LEFT) and diff(TOP):
+        name = 'top_left_image'
+    elif diff(LEFT) and diff(BOT):
+        name = 'bot_left_image'
+    elif diff(RIGHT):
+        name = 'right_image'
+    elif diff(LEFT):
+        name = 'left_image'
+    elif diff(TOP):
+        name = 'top_image'
+    elif diff(BOT):
+        name = 'bot_image'
+    else:
+        name = 'image'
+    return EDGE_PIECES.index(name)
+
+
+EDGE_LUT = np.array([edge_piece(mask) for mask in range(256)], np.uint8)
+
+
+def cell_mask(level_map, position):
+    ''' Neighbour mask of a single map position. Neighbours outside the
+        map count as the same tile_type.
+    '''
+    x, y, z = position
+    tile_type = level_map[position].tile_type
+    mask = 0
+    for bit, (dx, dy) in enumerate(EDGE_OFFSETS):
+        neighbor = x + dx, y + dy, z
+        if level_map.in_map(neighbor) and level_map[neighbor].tile_type != tile_type:
+            mask |= 1 << bit
+    return mask
+
+
+def grid_masks(groups, present):
+    ''' Neighbour masks for a whole (z, y, x) array of tile_type group ids '''
+
+    depth, height, width = groups.shape
+    masks = np.zeros(groups.shape, np.uint8)
+    for bit, (dx, dy) in enumerate(EDGE_OFFSETS):
+        # Compare each cell against the neighbour at (x + dx, y + dy)
+        dst_y = slice(max(0, -dy), height - max(0, dy))
+        src_y = slice(max(0, dy), height - max(0, -dy))
+        dst_x = slice(max(0, -dx), width - max(0, dx))
+        src_x = slice(max(0, dx), width - max(0, -dx))
+        differs = present[:, src_y, src_x] & \
+                (groups[:, src_y, src_x] != groups[:, dst_y, dst_x])
+        masks[:, dst_y, dst_x] |= differs.astype(np.uint8) << bit
+    return masks
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# The camera over the map viewport. Maps larger than the screen are seen
+# through a window of whole cells that pans over them, drawn at one of a
+# few zoom levels; everything drawn on the map asks the camera which cells
+# are in view and where on the screen a cell is, and mouse clicks are
+# turned back into cells the same way.
+
+import pygame
+
+# Scale of the drawn tiles against the tile map
+ZOOM_LEVELS = (0.5, 1, 2)
+
+
+class Camera:
+
+    ''' A window of cells of a LevelMap shown in a screen viewport
+
+        left and top are the cell at the top left corner of the viewport,
+        kept so the window never pans past the map. The window holds every
+        cell at least partly inside the viewport; box() is the part of it
+        inside the map. version is bumped whenever the window pans or
+        zooms, so whatever was drawn for it can tell when to redraw.
+
+        viewport:       pygame.Rect of the screen the map is drawn in
+        tile_w, tile_h: size of a cell in pixels at zoom 1
+        bounds:         (width, height) of the map in cells
+    '''
+
+    def __init__(self, viewport, tile_w, tile_h, bounds=(1, 1)):
+        self.viewport = pygame.Rect(viewport)
+        self.tile_w = tile_w
+        self.tile_h = tile_h
+        self.bounds = bounds
+        self.zoom = 1
+        self.left = 0
+        self.top = 0
+        self.version = 0
+        self._scaled = {}       # Surface -> Surface at the current zoom
+
+    @property
+    def cell_w(self):
+        return int(self.tile_w * self.zoom)
+
+    @property
+    def cell_h(self):
+        return int(self.tile_h * self.zoom)
+
+    @property
+    def columns(self):
+        return -(-self.viewport.width // self.cell_w)
+
+    @property
+    def rows(self):
+        return -(-self.viewport.height // self.cell_h)
+
+    def box(self):
+        ''' (x0, y0, x1, y1) cells of the map in view, ends exclusive '''
+
+        width, height = self.bounds
+        return (self.left, self.top,
+                min(width, self.left + self.columns), min(height, self.top + self.rows))
+
+    def contains(self, position):
+        x0, y0, x1, y1 = self.box()
+        return x0 <= position[0] < x1 and y0 <= position[1] < y1
+
+    def cell_to_px(self, position):
+        ''' Screen pixel (x, y, z) of the top left corner of a cell '''
+
+        x, y, z = position
+        return (self.viewport.x + (x - self.left) * self.cell_w,
+                self.viewport.y + (y - self.top) * self.cell_h, z)
+
+    def px_to_cell(self, position):
+        ''' Cell (x, y, z) under a screen pixel (x, y, z) of the viewport,
+            None outside of it
+        '''
+        x, y, z = position
+        if not self.viewport.collidepoint(x, y):
+            return None
+        return (self.left + (x - self.viewport.x) // self.cell_w,
+                self.top + (y - self.viewport.y) // self.cell_h, z)
+
+    def cell_rect(self, position):
+        ''' Screen rect of a cell '''
+
+        x_loc, y_loc, _ = self.cell_to_px(position)
+        return pygame.Rect(x_loc, y_loc, self.cell_w, self.cell_h)
+
+    def move_to(self, left, top):
+        ''' Put cell (left, top) at the top left corner, as near as the map
+            allows; returns True if the camera moved
+        '''
+        width, height = self.bounds
+        left = max(0, min(left, width - self.columns))
+        top = max(0, min(top, height - self.rows))
+        if (left, top) == (self.left, self.top):
+            return False
+        self.left, self.top = left, top
+        self.version += 1
+        return True
+
+    def pan(self, dx, dy):
+        return self.move_to(self.left + dx, self.top + dy)
+
+    def center_on(self, position):
+        return self.move_to(position[0] - self.columns // 2, position[1] - self.rows // 2)
+
+    def set_zoom(self, zoom, anchor=None):
+        ''' Zoom to a level of ZOOM_LEVELS keeping the cell anchor, or the
+            middle of the view, in place; returns True if the zoom changed
+        '''
+        if zoom == self.zoom or zoom not in ZOOM_LEVELS:
+            return False
+        if anchor is None:
+            anchor = self.left + self.columns // 2, self.top + self.rows // 2
+        # Where the anchor is in the view, as a share of it
+        share_x = (anchor[0] - self.left) / self.columns
+        share_y = (anchor[1] - self.top) / self.rows
+        self.zoom = zoom
+        self._scaled = {}
+        self.version += 1
+        self.move_to(anchor[0] - int(share_x * self.columns), anchor[1] - int(share_y * self.rows))
+        return True
+
+    def zoom_in(self, anchor=None):
+        level = ZOOM_LEVELS.index(self.zoom)
+        return self.set_zoom(ZOOM_LEVELS[min(level + 1, len(ZOOM_LEVELS) - 1)], anchor)
+
+    def zoom_out(self, anchor=None):
+        level = ZOOM_LEVELS.index(self.zoom)
+        return self.set_zoom(ZOOM_LEVELS[max(level - 1, 0)], anchor)
+
+    def scaled(self, image):
+        ''' A tile image at the current zoom, scaled once per zoom '''
+
+        if self.zoom == 1:
+            return image
+        try:
+            return self._scaled[image]
+        except KeyError:
+            scaled = self._scaled[image] = pygame.transform.scale(image, (self.cell_w, self.cell_h))
+            return scaled
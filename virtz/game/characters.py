@@ -6,8 +6,7 @@ from sqlalchemy.orm import sessionmaker
 import sys
 import random
 import argparse
-import time
-from threading import Event
+from itertools import count
 
 from .models import Virt, Base
 from .personality import PersonalityFactory, personalities
@@ -56,6 +55,7 @@ class CharacterFactory:
         self.person_factory = PersonalityFactory()
         self.skill_factory = SkillFactory()
         self.queues = queues
+        self._virt_ids = count(1)
 
     def get_virt(self, position=(0, 0, 0)):
         ''' Returns a Virt object of the specified type initialized
@@ -67,7 +67,7 @@ class CharacterFactory:
         fears = randomize_fears()
 
         virt = Virt(random_name(), self.queues, self.pf)
-        virt.id = time.clock()
+        virt.id = next(self._virt_ids)
         sprite_loc = random.choice([(0, 6), (0, 7), (0, 8)])
         virt.sprite = self.sprites[sprite_loc]
         virt.personality = personality_name
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Chunked storage for worlds larger than memory. The map is split into
+# square chunks of each z-level, every chunk a small TileGrid built from the
+# tile id planes of the map (a memory-mapped MapFile, usually) the first
+# time one of its cells is used. Chunks nobody used recently are evicted
+# once the memory budget is reached; those whose cells changed are spilled
+# to disk first and read back from there when they are needed again.
+
+import os
+import tempfile
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from .grid import TileGrid, TileView
+
+CHUNK_SIZE = 32
+
+# The per-cell arrays of a chunk that can change after it is loaded
+STATE_FIELDS = ('type_id', 'explored', 'visited', 'blocking', 'movement_cost', 'light')
+
+ChunkInfo = namedtuple('ChunkInfo',
+        ['resident', 'loads', 'evictions', 'spills', 'max_chunks'])
+
+
+class ChunkView(TileView):
+
+    ''' TileView over a cell of a chunk, reporting its world position
+
+        Like any TileView it reads and writes the arrays of its chunk, so
+        it should not be kept after the chunk may have been evicted.
+    '''
+
+    __slots__ = ('world',)
+
+    def __init__(self, chunk, local, position):
+        super().__init__(chunk, local)
+        self.world = position
+
+    @property
+    def position(self):
+        return self.world
+
+
+class BlockArray:
+
+    ''' Lazy (z, y, x) array of square blocks, for the per-cell state of
+        worlds too large to keep in one array
+
+        A block is allocated the first time one of its cells is written
+        and dropped again once it is all fill, cells of missing blocks read
+        as fill. With make, a function of a block key (z, by, bx) returning
+        its (size, size) array, blocks are made the first time they are
+        read instead and kept. Indexes are (z, y, x) with y and x both ints
+        or both slices; a box read this way is a copy, so changes to it are
+        written back with array[z, y0:y1, x0:x1] = box.
+    '''
+
+    def __init__(self, shape, dtype, fill=0, make=None, block_size=CHUNK_SIZE):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.fill = fill
+        self.block_size = block_size
+        self._make = make
+        self._blocks = {}       # (z, by, bx) -> (size, size) array
+
+    @property
+    def nbytes(self):
+        return sum(block.nbytes for block in self._blocks.values())
+
+    def _block(self, key, create=False):
+        block = self._blocks.get(key)
+        if block is None and self._make is not None:
+            block = self._blocks[key] = self._make(key)
+        elif block is None and create:
+            size = self.block_size
+            block = self._blocks[key] = np.full((size, size), self.fill, self.dtype)
+        return block
+
+    def _spans(self, index):
+        # (z, y0, y1, x0, x1) of an index and whether it is a single cell
+        z, y, x = index
+        if isinstance(y, slice) and isinstance(x, slice):
+            _, height, width = self.shape
+            (y0, y1, _), (x0, x1, _) = y.indices(height), x.indices(width)
+            return z, y0, max(y0, y1), x0, max(x0, x1), False
+        return z, y, y + 1, x, x + 1, True
+
+    def _pieces(self, z, y0, y1, x0, x1):
+        # Yields (key, slices of the block, slices of the box) covering a box
+        size = self.block_size
+        for by in range(y0 // size, (y1 - 1) // size + 1):
+            top, bottom = max(y0, by * size), min(y1, (by + 1) * size)
+            for bx in range(x0 // size, (x1 - 1) // size + 1):
+                left, right = max(x0, bx * size), min(x1, (bx + 1) * size)
+                yield ((z, by, bx),
+                        (slice(top - by * size, bottom - by * size),
+                            slice(left - bx * size, right - bx * size)),
+                        (slice(top - y0, bottom - y0), slice(left - x0, right - x0)))
+
+    def __getitem__(self, index):
+        z, y0, y1, x0, x1, single = self._spans(index)
+        box = np.full((y1 - y0, x1 - x0), self.fill, self.dtype)
+        if y1 > y0 and x1 > x0:
+            for key, inner, outer in self._pieces(z, y0, y1, x0, x1):
+                block = self._block(key)
+                if block is not None:
+                    box[outer] = block[inner]
+        return box[0, 0] if single else box
+
+    def __setitem__(self, index, value):
+        z, y0, y1, x0, x1, _ = self._spans(index)
+        if y1 <= y0 or x1 <= x0:
+            return
+        value = np.asarray(value, self.dtype)
+        if value.shape != (y1 - y0, x1 - x0):
+            value = np.broadcast_to(value, (y1 - y0, x1 - x0))
+        for key, inner, outer in self._pieces(z, y0, y1, x0, x1):
+            part = value[outer]
+            if self._make is None and key not in self._blocks and (part == self.fill).all():
+                continue
+            block = self._block(key, create=True)
+            block[inner] = part
+            if self._make is None and (block == self.fill).all():
+                del self._blocks[key]
+
+    def sum(self):
+        _, height, width = self.shape
+        size = self.block_size
+        total = 0
+        cells = 0
+        for (_, by, bx), block in self._blocks.items():
+            block = block[:height - by * size, :width - bx * size]
+            total += int(block.sum(dtype=np.int64))
+            cells += block.size
+        return total + int(self.fill) * (int(np.prod(self.shape)) - cells)
+
+
+class ChunkedGrid:
+
+    ''' TileGrid-like storage of a LevelMap as lazily loaded chunks
+
+        tiles is a (z, y, x) array of type ids into kinds, typically the
+        memmap of a MapFile, and present the matching array of the cells
+        in the map (None when all of them are). Membership, iteration and
+        level_positions() only read those arrays, item access loads the
+        chunk holding the cell. At most budget bytes of chunks are kept
+        in memory, least recently used chunks are evicted first.
+    '''
+
+    def __init__(self, kinds, tiles, present=None, chunk_size=CHUNK_SIZE, budget=64 << 20):
+        self.kinds = list(kinds)
+        self._kind_ids = {kind: n for n, kind in enumerate(self.kinds)}
+        self.shape = tiles.shape
+        self.chunk_size = chunk_size
+        self._tiles = tiles
+        self._present = present
+        self._chunks = OrderedDict()    # (z, cy, cx) -> TileGrid, oldest first
+        self._spilled = set()           # chunks whose state is on disk
+        self._spill_dir = None
+
+        chunk_bytes = TileGrid(self.kinds, (1, chunk_size, chunk_size)).nbytes
+        self.max_chunks = max(1, budget // chunk_bytes)
+        self.loads = 0
+        self.evictions = 0
+        self.spills = 0
+
+    def info(self):
+        return ChunkInfo(len(self._chunks), self.loads, self.evictions,
+                self.spills, self.max_chunks)
+
+    def chunk(self, key):
+        ''' The TileGrid of chunk key, loading it if it is not resident '''
+
+        try:
+            chunk = self._chunks[key]
+        except KeyError:
+            chunk = self._chunks[key] = self._load(key)
+            while len(self._chunks) > self.max_chunks:
+                self._evict()
+            return chunk
+        self._chunks.move_to_end(key)
+        return chunk
+
+    def resident(self, key):
+        return key in self._chunks
+
+    def _read(self, key):
+        # A fresh chunk from the tile id planes
+        z, cy, cx = key
+        size = self.chunk_size
+        y0, x0 = cy * size, cx * size
+        block = self._tiles[z, y0:y0 + size, x0:x0 + size]
+        height, width = block.shape
+        type_id = np.zeros((1, size, size), block.dtype)
+        type_id[0, :height, :width] = block
+        present = np.zeros((1, size, size), np.bool_)
+        if self._present is None:
+            present[0, :height, :width] = True
+        else:
+            present[0, :height, :width] = self._present[z, y0:y0 + size, x0:x0 + size]
+
+        chunk = TileGrid.from_ids(type_id, self.kinds, present)
+        # Share the kinds, so kinds added through any chunk keep one id
+        chunk.kinds = self.kinds
+        chunk._kind_ids = self._kind_ids
+        return chunk
+
+    def _spill_path(self, key):
+        return os.path.join(self._spill_dir.name, '{}_{}_{}.npz'.format(*key))
+
+    def _load(self, key):
+        self.loads += 1
+        chunk = self._read(key)
+        if key in self._spilled:
+            with np.load(self._spill_path(key)) as saved:
+                for name in STATE_FIELDS:
+                    setattr(chunk, name, saved[name])
+        return chunk
+
+    def _evict(self):
+        key, chunk = self._chunks.popitem(last=False)
+        self.evictions += 1
+        fresh = self._read(key)
+        if all(np.array_equal(getattr(chunk, name), getattr(fresh, name)) for name in STATE_FIELDS):
+            # Nothing to keep, the chunk is read again from the planes
+            self._spilled.discard(key)
+            return
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.TemporaryDirectory(prefix='virtz-chunks-')
+        np.savez(self._spill_path(key), **{name: getattr(chunk, name) for name in STATE_FIELDS})
+        self._spilled.add(key)
+        self.spills += 1
+
+    def tile_ids(self):
+        ''' The (z, y, x) type ids of every cell, the planes with the
+            changes of the chunks resident or spilled since applied
+        '''
+        id_type = self._tiles.dtype if len(self.kinds) <= 1 << 8 else np.uint16
+        tiles = np.array(self._tiles, id_type)
+        size = self.chunk_size
+        for key in set(self._chunks) | self._spilled:
+            if key in self._chunks:
+                type_id = self._chunks[key].type_id
+            else:
+                with np.load(self._spill_path(key)) as saved:
+                    type_id = saved['type_id']
+            z, cy, cx = key
+            block = tiles[z, cy * size:(cy + 1) * size, cx * size:(cx + 1) * size]
+            height, width = block.shape
+            block[...] = type_id[0, :height, :width]
+        return tiles
+
+    def kinds_in_use(self):
+        # Every kind of the palette; finding the ones actually used would
+        # read the whole map
+        return list(self.kinds)
+
+    def level_positions(self, z):
+        ''' Yields the (x, y, z) positions present on a single level '''
+
+        depth, height, width = self.shape
+        if self._present is None:
+            for y in range(height):
+                for x in range(width):
+                    yield x, y, z
+            return
+        ys, xs = np.nonzero(self._present[z])
+        for y, x in zip(ys.tolist(), xs.tolist()):
+            yield x, y, z
+
+    @property
+    def nbytes(self):
+        return sum(chunk.nbytes for chunk in self._chunks.values())
+
+    def __contains__(self, position):
+        try:
+            x, y, z = position
+        except (TypeError, ValueError):
+            return False
+        depth, height, width = self.shape
+        if 0 <= x < width and 0 <= y < height and 0 <= z < depth:
+            return self._present is None or bool(self._present[z, y, x])
+        return False
+
+    def __getitem__(self, position):
+        if position not in self:
+            raise KeyError(position)
+        x, y, z = position
+        size = self.chunk_size
+        chunk = self.chunk((z, y // size, x // size))
+        return ChunkView(chunk, (x % size, y % size, 0), position)
+
+    def __setitem__(self, position, tile):
+        view = self[position]
+        view.kind = tile.kind
+        view.explored = tile.explored
+        view.visited = tile.visited
+        view.blocking = tile.blocking
+        view.movement_cost = tile.movement_cost
+        view.light = tile.light
+
+    def __iter__(self):
+        for z in range(self.shape[0]):
+            yield from self.level_positions(z)
+
+    def __len__(self):
+        if self._present is None:
+            return int(np.prod(self.shape))
+        return int(np.count_nonzero(self._present))
+
+    def values(self):
+        for position in self:
+            yield self[position]
+
+    def close(self):
+        ''' Drop every chunk and the spilled state on disk '''
+
+        self._chunks.clear()
+        self._spilled.clear()
+        if self._spill_dir is not None:
+            self._spill_dir.cleanup()
+            self._spill_dir = None
@@ -1,4 +1,6 @@
 
+from collections import OrderedDict
+
 import pygame
 
 
@@ -18,3 +20,116 @@ class DisplayManager:
         else:
             self._screen = pygame.display.set_mode(resolution)
         pygame.display.set_caption('virtz')
+
+
+class BlitBatch:
+
+    ''' Blits queued for a frame and drawn onto a surface together
+
+        Entries are the (source, dest) or (source, dest, area) tuples
+        Surface.blits() takes and are drawn in the order they were queued,
+        with a single call instead of one Surface.blit() per sprite.
+    '''
+
+    def __init__(self):
+        self._blits = []
+
+    def __len__(self):
+        return len(self._blits)
+
+    def add(self, source, dest, area=None):
+        self._blits.append((source, dest) if area is None else (source, dest, area))
+
+    def extend(self, blits):
+        self._blits.extend(blits)
+
+    def submit(self, target):
+        ''' Draw every queued blit onto target and empty the batch '''
+
+        if self._blits:
+            target.blits(self._blits, doreturn=False)
+            self._blits = []
+
+
+class TextCache:
+
+    ''' Rendered lines of text, kept by (font, text, colour)
+
+        render() renders a line the first time it is asked for and hands
+        back the same Surface after that. At most maxsize lines are kept,
+        the least recently used is dropped first.
+    '''
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._lines = OrderedDict()     # (font, text, colour) -> Surface, oldest first
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._lines)
+
+    def render(self, font, text, colour):
+        key = font, text, colour
+        try:
+            surface = self._lines[key]
+        except KeyError:
+            self.misses += 1
+            surface = self._lines[key] = font.render(text, 1, colour)
+            if len(self._lines) > self.maxsize:
+                self._lines.popitem(last=False)
+            return surface
+        self.hits += 1
+        self._lines.move_to_end(key)
+        return surface
+
+
+class Panel:
+
+    ''' A screen region of text redrawn only when its text changes
+
+        Every frame the lines and boxes of the panel are queued with
+        text() and box(); draw() compares them with what is on screen
+        and only when they differ clears the region and draws them,
+        through the TextCache. Nothing is drawn outside of the region.
+    '''
+
+    def __init__(self, rect, text_cache, background=(0, 0, 0)):
+        self.rect = pygame.Rect(rect)
+        self.text_cache = text_cache
+        self.background = background
+        self._queued = []
+        self._drawn = None
+
+    def text(self, font, text, colour, dest):
+        ''' Queue a line of text at dest, returns its rendered Surface '''
+
+        self._queued.append((font, text, colour, dest))
+        return self.text_cache.render(font, text, colour)
+
+    def box(self, rect, colour, width=0):
+        self._queued.append((colour, pygame.Rect(rect), width))
+
+    def invalidate(self):
+        ''' Redraw the panel on the next draw() whatever is queued '''
+
+        self._drawn = None
+
+    def draw(self, target):
+        ''' Draw the queued lines and boxes onto target if they changed
+            since the last draw, returns True if the panel was redrawn
+        '''
+        queued, self._queued = self._queued, []
+        if queued == self._drawn:
+            return False
+        self._drawn = queued
+        target.set_clip(self.rect)
+        target.fill(self.background, self.rect)
+        for entry in queued:
+            if len(entry) == 4:
+                font, text, colour, dest = entry
+                target.blit(self.text_cache.render(font, text, colour), dest)
+            else:
+                pygame.draw.rect(target, *entry)
+        target.set_clip(None)
+        return True
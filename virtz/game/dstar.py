@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# D* Lite incremental replanning (Koenig & Likhachev). The search runs from
+# the goal back toward the walker, so when cells change only the part of
+# the search tree leading through them is repaired, instead of planning the
+# rest of the route from scratch.
+
+from heapq import heappush, heappop
+from itertools import count
+from math import inf as Infinity
+
+from .graph import NEIGHBOR_OFFSETS
+
+
+class DStarLite:
+
+    ''' A route from start to goal kept consistent with a changing map
+
+        g[node] is the cost from node to the goal found so far and
+        rhs[node] the one-step lookahead of it; nodes where they differ
+        sit in the open heap. The Pathfinder passes every changed cell
+        to changed(), and the search is repaired before the next step.
+
+        Walkers treat it like the reversed position list the Pathfinder
+        returns: pop() yields the start first and then one step toward
+        the goal at a time, and the route is false once the goal is
+        reached or can no longer be reached.
+    '''
+
+    def __init__(self, adjacency, start, goal):
+        self.adjacency = adjacency
+        self.start = adjacency.node(start)
+        self.goal = adjacency.node(goal)
+        self.km = 0
+        self.g = {}
+        self.rhs = {self.goal: 0}
+        self.expansions = 0
+        self._open = []
+        self._keys = {}             # node -> key of its live open heap entry
+        self._tie_breaker = count()
+        self._changed = set()
+        self._last = self.start
+        self._started = False
+        self._insert(self.goal)
+        self._compute()
+
+    def _heuristic(self, a, b):
+        x1, y1, z1 = self.adjacency.position(a)
+        x2, y2, z2 = self.adjacency.position(b)
+        return abs(x1 - x2) + abs(y1 - y2) + abs(z1 - z2)
+
+    def _key(self, node):
+        best = min(self.g.get(node, Infinity), self.rhs.get(node, Infinity))
+        return best + self._heuristic(self.start, node) + self.km, best
+
+    def _insert(self, node):
+        key = self._keys[node] = self._key(node)
+        heappush(self._open, (key, next(self._tie_breaker), node))
+
+    def _top(self):
+        # Drop superseded heap entries and return the live minimum
+        while self._open:
+            key, _, node = self._open[0]
+            if self._keys.get(node) == key:
+                return key, node
+            heappop(self._open)
+        return (Infinity, Infinity), None
+
+    def _update_vertex(self, node):
+        g = self.g
+        if node != self.goal:
+            self.rhs[node] = min((cost + g.get(target, Infinity)
+                for target, cost in self.adjacency.edges(node)), default=Infinity)
+        self._keys.pop(node, None)
+        if g.get(node, Infinity) != self.rhs.get(node, Infinity):
+            self._insert(node)
+
+    def _compute(self):
+        g, rhs = self.g, self.rhs
+        in_edges = self.adjacency.in_edges
+        start = self.start
+        while True:
+            old_key, node = self._top()
+            if node is None:
+                return
+            if old_key >= self._key(start) and \
+                    rhs.get(start, Infinity) == g.get(start, Infinity):
+                return
+            self.expansions += 1
+            new_key = self._key(node)
+            if old_key < new_key:
+                self._insert(node)
+            elif g.get(node, Infinity) > rhs.get(node, Infinity):
+                best = g[node] = rhs[node]
+                del self._keys[node]
+                # Only lower the lookahead of the sources, no need to
+                # rescan all of their edges
+                for source, cost in in_edges(node):
+                    if best + cost < rhs.get(source, Infinity) and source != self.goal:
+                        rhs[source] = best + cost
+                        self._keys.pop(source, None)
+                        if g.get(source, Infinity) != rhs[source]:
+                            self._insert(source)
+            else:
+                g[node] = Infinity
+                self._update_vertex(node)
+                for source, cost in in_edges(node):
+                    self._update_vertex(source)
+
+    def changed(self, position):
+        ''' Note a cell whose passability or movement cost changed '''
+
+        self._changed.add(position)
+
+    def _repair(self):
+        if not self._changed:
+            return
+        self.km += self._heuristic(self._last, self.start)
+        self._last = self.start
+        node = self.adjacency.node
+        changed, self._changed = self._changed, set()
+        # The edges leading into a changed cell come from its neighbours
+        for x, y, z in changed:
+            for dx, dy in NEIGHBOR_OFFSETS:
+                source = node((x + dx, y + dy, z))
+                if source is not None:
+                    self._update_vertex(source)
+        self._compute()
+
+    @property
+    def cost(self):
+        ''' Remaining cost to the goal, inf if it cannot be reached '''
+
+        self._repair()
+        return self.g.get(self.start, Infinity)
+
+    def __bool__(self):
+        if not self._started:
+            return self.g.get(self.start, Infinity) < Infinity
+        return self.start != self.goal and self.cost < Infinity
+
+    def pop(self):
+        if not self._started:
+            self._started = True
+            return self.adjacency.position(self.start)
+        if not self:
+            raise IndexError('pop from exhausted route')
+        g = self.g
+        self.start = min(self.adjacency.edges(self.start),
+                key=lambda edge: edge[1] + g.get(edge[0], Infinity))[0]
+        return self.adjacency.position(self.start)
+
+    def to_list(self):
+        ''' The current best path from the walker's position, reversed like
+            Pathfinder results, without consuming the route
+        '''
+        if self.cost == Infinity:
+            return False
+        g = self.g
+        node = self.start
+        path = [self.adjacency.position(node)]
+        while node != self.goal:
+            node = min(self.adjacency.edges(node),
+                    key=lambda edge: edge[1] + g.get(edge[0], Infinity))[0]
+            path.append(self.adjacency.position(node))
+        return path[::-1]
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Distance fields over LevelMap.adjacency: a reverse Dijkstra from a set of
+# source cells giving, for every cell, the path cost to the nearest source
+# and the next cell to step to on the way there. Edge costs are the ones the
+# Pathfinder uses, so following a field walks a shortest path. A field can
+# be bounded to a box of one level, searching and storing only its cells,
+# so the cost of a field does not grow with the size of the world.
+
+from array import array
+from heapq import heappush, heappop
+
+UNREACHED = 2 ** 31 - 1
+NO_NODE = -1
+
+# Cells around the goal a FlowField covers, in each direction
+FLOW_RADIUS = 128
+
+
+class _Sparse(dict):
+    # Per node storage of a bounded field, default for nodes never reached
+
+    def __init__(self, default):
+        super().__init__()
+        self.default = default
+
+    def __missing__(self, node):
+        return self.default
+
+
+class DistanceField:
+
+    ''' Multi-source distance field over the nodes of a LevelMap adjacency
+
+        distance[node] is the cost of the cheapest path from node to any
+        source, owner[node] the source that path ends at and toward[node]
+        the first step along it, so a walker needs one lookup per step.
+        Adding a source lowers distances outward from it; removing one
+        clears the region it owned and refills it from its border. Any
+        topology change makes the field stale and it is rebuilt on the
+        next sync().
+
+        A field given a (z, x0, y0, x1, y1) box, ends exclusive, only
+        follows paths within the box; cells outside of it are never
+        reached.
+    '''
+
+    def __init__(self, level_map, box=None):
+        self.level_map = level_map
+        self.box = box
+        self.adjacency = None
+        self.topology_version = None
+        self.sources = set()
+        self._members = None    # node ids in the box, None when unbounded
+
+    def _source_nodes(self):
+        raise NotImplementedError
+
+    def _topology_version(self):
+        # Version of the topology the field depends on
+        return self.level_map.topology_version
+
+    @property
+    def stale(self):
+        return self.adjacency is not self.level_map.adjacency or \
+                self.topology_version != self._topology_version()
+
+    def sync(self):
+        if self.stale:
+            self.rebuild()
+
+    def rebuild(self):
+        self.adjacency = self.level_map.adjacency
+        self.topology_version = self._topology_version()
+
+        if self.box is None:
+            size = len(self.adjacency)
+            self.distance = array('i', [UNREACHED]) * size
+            self.owner = array('i', [NO_NODE]) * size
+            self.toward = array('i', [NO_NODE]) * size
+        else:
+            z, x0, y0, x1, y1 = self.box
+            node = self.adjacency.node
+            self._members = {node((x, y, z)) for y in range(y0, y1) for x in range(x0, x1)}
+            self._members.discard(None)
+            self.distance = _Sparse(UNREACHED)
+            self.owner = _Sparse(NO_NODE)
+            self.toward = _Sparse(NO_NODE)
+        self.sources = set()
+        heap = []
+        for node in self._source_nodes():
+            self._seed(node, heap)
+        self._propagate(heap)
+
+    def _seed(self, node, heap):
+        self.sources.add(node)
+        self.distance[node] = 0
+        self.owner[node] = node
+        self.toward[node] = NO_NODE
+        heappush(heap, (0, node))
+
+    def _propagate(self, heap):
+        # Dijkstra over reversed edges: a source's cost is that of the
+        # edge leading out of it, toward the already settled node
+        distance = self.distance
+        owner = self.owner
+        toward = self.toward
+        members = self._members
+        in_edges = self.adjacency.in_edges
+        while heap:
+            cost, node = heappop(heap)
+            if cost > distance[node]:
+                continue
+            for source, edge_cost in in_edges(node):
+                if members is not None and source not in members:
+                    continue
+                new_cost = cost + edge_cost
+                if new_cost < distance[source]:
+                    distance[source] = new_cost
+                    owner[source] = owner[node]
+                    toward[source] = node
+                    heappush(heap, (new_cost, source))
+
+    def _add_source(self, node):
+        heap = []
+        self._seed(node, heap)
+        self._propagate(heap)
+
+    def _remove_source(self, node):
+        self.sources.discard(node)
+        distance = self.distance
+        owner = self.owner
+        toward = self.toward
+        in_edges = self.adjacency.in_edges
+
+        # Every cell whose nearest source was node lies on a shortest-path
+        # tree rooted at it; clear that region
+        distance[node] = UNREACHED
+        owner[node] = NO_NODE
+        region = [node]
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            for source, edge_cost in in_edges(current):
+                if owner[source] == node:
+                    distance[source] = UNREACHED
+                    owner[source] = NO_NODE
+                    toward[source] = NO_NODE
+                    region.append(source)
+                    stack.append(source)
+
+        # Refill it from the settled cells around its border
+        heap = []
+        edges = self.adjacency.edges
+        for current in region:
+            for target, edge_cost in edges(current):
+                new_cost = distance[target] + edge_cost
+                if new_cost < distance[current]:
+                    distance[current] = new_cost
+                    owner[current] = owner[target]
+                    toward[current] = target
+            if distance[current] < UNREACHED:
+                heappush(heap, (distance[current], current))
+        self._propagate(heap)
+
+    def cost(self, position):
+        ''' Path cost from position to the nearest source, None if no
+            source can be reached
+        '''
+        self.sync()
+        node = self.adjacency.node(position)
+        if node is None or self.distance[node] >= UNREACHED:
+            return None
+        return self.distance[node]
+
+    def nearest(self, position):
+        ''' Position of the nearest reachable source, or None '''
+
+        self.sync()
+        node = self.adjacency.node(position)
+        if node is None or self.owner[node] == NO_NODE:
+            return None
+        return self.adjacency.position(self.owner[node])
+
+    def downhill(self, position):
+        ''' The next step from position toward the nearest source, None
+            when already on a source or when none can be reached
+        '''
+        self.sync()
+        node = self.adjacency.node(position)
+        if node is None or self.toward[node] == NO_NODE:
+            return None
+        return self.adjacency.position(self.toward[node])
+
+
+class FlowField(DistanceField):
+
+    ''' Single-goal DistanceField shared by every walker heading to goal,
+        covering the cells within radius of it
+    '''
+
+    def __init__(self, level_map, goal, radius=FLOW_RADIUS):
+        x, y, z = goal
+        width, height, _ = level_map.bounds
+        box = (z, max(0, x - radius), max(0, y - radius),
+                min(width, x + radius + 1), min(height, y + radius + 1))
+        super().__init__(level_map, box)
+        self.goal = goal
+
+    def _source_nodes(self):
+        node = self.adjacency.node(self.goal)
+        return () if node is None else (node,)
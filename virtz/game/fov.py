@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Field of view by recursive shadowcasting. Each octant around a viewer is
+# scanned row by row outward, and a wall casts a shadow, a range of slopes
+# the rows further out skip, so every cell within the sight radius is
+# looked at once at most. What the viewers see is kept in per-level NumPy
+# bitmaps of the cells explored so far and the cells in sight right now.
+
+import numpy as np
+
+from .chunks import BlockArray
+
+# (xx, xy, yx, yy) transforms mapping the first octant onto each of eight
+OCTANTS = ((1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+        (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1))
+
+
+def shadowcast(opaque, width, height, origin, radius):
+    ''' Set of (y * width + x) indexes of the cells visible from origin
+
+        opaque is a flat sequence of the opaque flags of one level, cells
+        outside it are opaque too. Walls themselves are visible, the cells
+        behind them are not. The origin is always visible.
+    '''
+    ox, oy = origin
+    visible = {oy * width + ox}
+    radius_sq = radius * radius
+
+    def cast(row, start, end, xx, xy, yx, yy):
+        # Scan rows row..radius of an octant between slopes start and end
+        if start < end:
+            return
+        new_start = start
+        for distance in range(row, radius + 1):
+            dx, dy = -distance - 1, -distance
+            blocked = False
+            while dx <= 0:
+                dx += 1
+                left = (dx - 0.5) / (dy + 0.5)
+                right = (dx + 0.5) / (dy - 0.5)
+                if start < right:
+                    continue
+                if end > left:
+                    break
+                x = ox + dx * xx + dy * xy
+                y = oy + dx * yx + dy * yy
+                inside = 0 <= x < width and 0 <= y < height
+                if inside and dx * dx + dy * dy <= radius_sq:
+                    visible.add(y * width + x)
+                wall = not inside or opaque[y * width + x]
+                if blocked:
+                    if wall:
+                        new_start = right
+                        continue
+                    blocked = False
+                    start = new_start
+                elif wall and distance < radius:
+                    blocked = True
+                    cast(distance + 1, start, left, xx, xy, yx, yy)
+                    new_start = right
+            if blocked:
+                break
+
+    for xx, xy, yx, yy in OCTANTS:
+        cast(1, 1.0, 0.0, xx, xy, yx, yy)
+    return visible
+
+
+class FieldOfView:
+
+    ''' Explored and visible cells of a LevelMap, (z, y, x) boolean arrays
+
+        update() takes every viewer's position and sight radius and only
+        casts for the viewers that moved, changed radius or had a cell in
+        sight change its opacity since the last update. Visible cells are
+        counted per viewer in sight of them, so a viewer leaving only
+        hides the cells nobody else sees. explored_version is bumped
+        whenever cells are explored for the first time.
+
+        With grid storage explored is the explored array of the TileGrid,
+        and with dict storage newly explored MapCells are flagged too.
+        With chunked storage the arrays are BlockArrays holding blocks only
+        where viewers have been, opaque is read from the chunks a block at
+        a time as sight first reaches it, and chunks are never loaded just
+        to flag them, so these arrays are the only record of what was
+        explored.
+    '''
+
+    def __init__(self, level_map):
+        self.level_map = level_map
+        self.explored = None
+        self.visible = None
+        self.opaque = None
+        self._present = None    # cells in the map, None when all are
+        self._seen = None
+        self._viewers = {}      # key -> (position, radius, flat indexes seen)
+        self._touched = []      # positions whose opacity changed
+        self.explored_version = 0
+        level_map.add_topology_listener(self._topology_changed)
+
+    def clear(self):
+        ''' Forget every viewer and rebuild the arrays from the map '''
+
+        level_map = self.level_map
+        width, height, depth = level_map.bounds
+        shape = depth, height, width
+        chunks = level_map.chunks
+        if chunks is not None:
+            size = chunks.chunk_size
+            self.explored = BlockArray(shape, np.bool_, block_size=size)
+            self.visible = BlockArray(shape, np.bool_, block_size=size)
+            self._seen = BlockArray(shape, np.uint16, block_size=size)
+            self.opaque = BlockArray(shape, np.bool_, True, self._opaque_block, size)
+        else:
+            if level_map.grid is not None:
+                self.explored = level_map.grid.explored
+            else:
+                self.explored = np.zeros(shape, np.bool_)
+            self.visible = np.zeros(shape, np.bool_)
+            self._seen = np.zeros(shape, np.uint16)
+            self.opaque = self._opaque_planes(shape)
+        if level_map.grid is not None:
+            self._present = level_map.grid.present
+        elif chunks is not None:
+            self._present = chunks._present
+        else:
+            self._present = np.zeros(shape, np.bool_)
+            for x, y, z in level_map.world_map:
+                self._present[z, y, x] = True
+        self._viewers = {}
+        self._touched = []
+
+    def _opaque_planes(self, shape):
+        # Walls block sight unless an open door passes through them;
+        # cells outside a ragged map are opaque
+        level_map = self.level_map
+        if level_map.grid is not None:
+            grid = level_map.grid
+            walls = np.array([bool(kind.wall) for kind in grid.kinds], np.bool_)
+            return (walls[grid.type_id] & grid.blocking) | ~grid.present
+        opaque = np.ones(shape, np.bool_)
+        for (x, y, z), tile in level_map.world_map.items():
+            opaque[z, y, x] = bool(tile.wall and tile.blocking)
+        return opaque
+
+    def _opaque_block(self, key):
+        # The opaque cells of a chunk, as a block of the opaque BlockArray
+        chunks = self.level_map.chunks
+        chunk = chunks.chunk(key)
+        walls = np.array([bool(kind.wall) for kind in chunks.kinds], np.bool_)
+        opaque = (walls[chunk.type_id[0]] & chunk.blocking[0]) | ~chunk.present[0]
+        z, cy, cx = key
+        size = chunks.chunk_size
+        for door in self.level_map.item_index.in_box(z, cx * size, cy * size,
+                (cx + 1) * size, (cy + 1) * size):
+            if door.item_type == 'door' and not door.locked:
+                x, y, _ = door.position
+                opaque[y % size, x % size] = False
+        return opaque
+
+    def _topology_changed(self, position):
+        if self.opaque is None:
+            return
+        x, y, z = position
+        tile = self.level_map[position]
+        opaque = bool(tile.wall and tile.blocking)
+        if self.opaque[z, y, x] != opaque:
+            self.opaque[z, y, x] = opaque
+            self._touched.append(position)
+
+    def is_explored(self, position):
+        x, y, z = position
+        return bool(self.explored[z, y, x])
+
+    def is_visible(self, position):
+        x, y, z = position
+        return bool(self.visible[z, y, x])
+
+    def update(self, viewers):
+        ''' Bring the arrays up to date with viewers, a dict of key ->
+            ((x, y, z), sight radius)
+
+            Returns the (z, x0, y0, x1, y1) boxes, ends exclusive, holding
+            every cell whose visibility may have changed.
+        '''
+        touched, self._touched = self._touched, []
+        regions = []
+        for key in list(self._viewers):
+            if key not in viewers:
+                regions.append(self._forget(key))
+
+        for key, (position, radius) in viewers.items():
+            last = self._viewers.get(key)
+            if last is not None and last[0] == position and last[1] == radius and \
+                    not any(self._within(cell, position, radius) for cell in touched):
+                continue
+            if last is not None:
+                regions.append(self._forget(key))
+            regions.append(self._cast(key, position, radius))
+        return regions
+
+    @staticmethod
+    def _within(cell, position, radius):
+        return cell[2] == position[2] and \
+            max(abs(cell[0] - position[0]), abs(cell[1] - position[1])) <= radius
+
+    def _box(self, position, radius):
+        x, y, z = position
+        depth, height, width = self.visible.shape
+        return (z, max(0, x - radius), max(0, y - radius),
+                min(width, x + radius + 1), min(height, y + radius + 1))
+
+    def _forget(self, key):
+        position, radius, (ys, xs) = self._viewers.pop(key)
+        box = z, x0, y0, x1, y1 = self._box(position, radius)
+        seen = self._seen[z, y0:y1, x0:x1]
+        seen[ys, xs] -= 1
+        self._seen[z, y0:y1, x0:x1] = seen
+        visible = self.visible[z, y0:y1, x0:x1]
+        visible[ys, xs] = seen[ys, xs] > 0
+        self.visible[z, y0:y1, x0:x1] = visible
+        return box
+
+    def _cast(self, key, position, radius):
+        # Cast over the box around the viewer only; the cells beyond it
+        # are out of sight anyway. ys and xs index the cells seen in it.
+        x, y, z = position
+        box = z, x0, y0, x1, y1 = self._box(position, radius)
+        width = x1 - x0
+        opaque = np.ascontiguousarray(self.opaque[z, y0:y1, x0:x1]).view(np.uint8)
+        cells = np.fromiter(shadowcast(memoryview(opaque.reshape(-1)), width, y1 - y0,
+                (x - x0, y - y0), radius), np.intp)
+        ys, xs = np.divmod(cells, width)
+        if self._present is not None:
+            inside = self._present[z, y0:y1, x0:x1][ys, xs]
+            ys, xs = ys[inside], xs[inside]
+        self._viewers[key] = position, radius, (ys, xs)
+
+        seen = self._seen[z, y0:y1, x0:x1]
+        seen[ys, xs] += 1
+        self._seen[z, y0:y1, x0:x1] = seen
+        visible = self.visible[z, y0:y1, x0:x1]
+        visible[ys, xs] = True
+        self.visible[z, y0:y1, x0:x1] = visible
+        explored = self.explored[z, y0:y1, x0:x1]
+        fresh = ~explored[ys, xs]
+        if not fresh.any():
+            return box
+        self.explored_version += 1
+        if self.level_map.grid is None and self.level_map.chunks is None:
+            # Flag the MapCells of the newly explored cells
+            for fy, fx in zip(ys[fresh].tolist(), xs[fresh].tolist()):
+                self.level_map[x0 + fx, y0 + fy, z].explored = True
+        explored[ys, xs] = True
+        self.explored[z, y0:y1, x0:x1] = explored
+        return box
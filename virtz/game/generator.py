@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Seeded procedural worlds built with whole-array NumPy operations. The
+# surface is cut from value noise heightmaps into water, sand, grass and
+# dirt with walled buildings on the grass, the levels below it are caves
+# grown by a cellular automaton, stacked stairs join each level to the next
+# and items are sampled over the open ground. No step visits the cells one
+# at a time, so worlds of millions of cells take seconds.
+#
+# Write a world to a map file:  python -m game.generator out.vzm --size 1000x1000x4
+
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from .mapfile import MapPlanes
+
+this = sys.modules[__name__]
+
+# Tile characters of the generated worlds, their ids are the indexes
+PALETTE = ['~', '.', ':', 's', '%', '_', 'd', 'u']
+WATER, GRASS, DIRT, SAND, WALL, FLOOR, DOWN, UP = range(len(PALETTE))
+
+# (item character, share of the open cells it is placed on)
+SURFACE_ITEMS = (('w', 0.0005), ('T', 0.001), ('f', 0.001), ('t', 0.004),
+        ('<', 0.002), ('>', 0.001), ('/', 0.001), ('?', 0.001), ('p', 0.001))
+CAVE_ITEMS = (('w', 0.0005), ('f', 0.0005), ('<', 0.004), ('C', 0.0002))
+
+
+def parse_size(text):
+    ''' (width, height, depth) from a WIDTHxHEIGHT[xDEPTH] string, for
+        argparse
+    '''
+    try:
+        size = tuple(int(part) for part in text.lower().split('x'))
+    except ValueError:
+        size = ()
+    if len(size) == 2:
+        size += (1,)
+    if len(size) != 3 or min(size) < 1:
+        raise argparse.ArgumentTypeError('Invalid size {}, required: WxH or WxHxD, '
+                'i.e. 200x100x2'.format(text))
+    return size
+
+
+def value_noise(rng, height, width, scale, octaves=4, persistence=0.5):
+    ''' A (height, width) float32 array of fractal value noise in [0, 1)
+
+        Each octave is a lattice of random values every scale cells,
+        halving scale per octave, smoothly interpolated between lattice
+        points. Rows and columns are interpolated separately, so an
+        octave costs a few operations per cell.
+    '''
+    total = np.zeros((height, width), np.float32)
+    amplitude = 1.0
+    weight = 0.0
+    for octave in range(octaves):
+        step = max(1.0, scale / 2 ** octave)
+        lattice = rng.random((int(height / step) + 2, int(width / step) + 2), np.float32)
+
+        y = np.arange(height, dtype=np.float32) / step
+        x = np.arange(width, dtype=np.float32) / step
+        y0, x0 = y.astype(np.intp), x.astype(np.intp)
+        # Smoothstep weights hide the lattice grid lines
+        ty, tx = y - y0, x - x0
+        ty = (ty * ty * (3 - 2 * ty))[:, None]
+        tx = tx * tx * (3 - 2 * tx)
+
+        rows = lattice[y0] * (1 - ty) + lattice[y0 + 1] * ty
+        total += amplitude * (rows[:, x0] * (1 - tx) + rows[:, x0 + 1] * tx)
+        weight += amplitude
+        amplitude *= persistence
+    return total / weight
+
+
+def neighbor_count(mask, fill=True):
+    ''' Number of the eight neighbours of every cell set in mask, cells
+        outside the array counting as fill
+    '''
+    padded = np.pad(mask, 1, constant_values=fill).astype(np.uint8)
+    height, width = mask.shape
+    count = np.zeros((height, width), np.uint8)
+    for dy in (0, 1, 2):
+        for dx in (0, 1, 2):
+            if dx != 1 or dy != 1:
+                count += padded[dy:dy + height, dx:dx + width]
+    return count
+
+
+def cave_walls(rng, height, width, fill=0.45, steps=4):
+    ''' Boolean (height, width) wall mask of a cave grown from random fill
+
+        Every step a cell becomes wall with five or more wall neighbours,
+        stays wall with four and opens otherwise, which smooths the noise
+        into rounded passages and chambers.
+    '''
+    walls = rng.random((height, width)) < fill
+    for step in range(steps):
+        count = neighbor_count(walls)
+        walls = (count >= 5) | (walls & (count == 4))
+    walls[[0, -1], :] = True
+    walls[:, [0, -1]] = True
+    return walls
+
+
+def sample_cells(rng, mask, share):
+    ''' Flat indexes of about share of the cells set in mask, chosen
+        without repeats
+    '''
+    cells = np.flatnonzero(mask)
+    count = min(len(cells), rng.binomial(len(cells), share))
+    return rng.choice(cells, count, replace=False, shuffle=False)
+
+
+class MapGenerator:
+
+    ''' A seeded procedural world, passed to a LevelMap as its level_map
+
+        The same seed always generates the same world. generate() returns
+        its MapPlanes, which LevelMap storage is built from directly, and
+        start_point is an open surface cell near the middle of the map,
+        set once the world is generated.
+
+        width, height:  cells per level
+        depth:          levels, the surface and depth - 1 cave levels
+        water:          share of the surface under water
+        sand:           share of the surface on beaches around the water
+        dirt:           share of the surface that is dry dirt
+        buildings:      walled buildings tried on the surface
+                        (default=one per 600 cells)
+        stairs:         stairs between each pair of levels
+                        (default=one per 2000 cells)
+        scale:          cells between the widest noise features
+    '''
+
+    def __init__(self, width, height, depth=1, seed=None, water=0.15, sand=0.05, dirt=0.2,
+            buildings=None, stairs=None, scale=48):
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.seed = seed
+        self.water = water
+        self.sand = sand
+        self.dirt = dirt
+        self.buildings = max(1, width * height // 600) if buildings is None else buildings
+        self.stairs = max(1, width * height // 2000) if stairs is None else stairs
+        self.scale = scale
+        self.start_point = None
+        self._planes = None
+
+    def generate(self):
+        ''' The MapPlanes of the world, generated on the first call '''
+
+        if self._planes is not None:
+            return self._planes
+
+        rng = np.random.default_rng(self.seed)
+        tiles = np.empty((self.depth, self.height, self.width), np.uint8)
+        occupied = np.zeros(tiles.shape, np.bool_)
+        items = {}
+
+        tiles[0] = self._surface(rng)
+        self._build(rng, tiles[0], occupied[0], items)
+        for z in range(1, self.depth):
+            tiles[z] = np.where(cave_walls(rng, self.height, self.width), WALL, DIRT)
+        self._connect(rng, tiles, occupied)
+
+        open_ground = (tiles == GRASS) | (tiles == DIRT) | (tiles == SAND)
+        for z in range(self.depth):
+            self._scatter(rng, z, SURFACE_ITEMS if z == 0 else CAVE_ITEMS,
+                    open_ground[z], occupied[z], items)
+        self.start_point = self._start(open_ground[0] & ~occupied[0])
+
+        self._planes = MapPlanes(PALETTE, tiles, None, items)
+        return self._planes
+
+    def _surface(self, rng):
+        # Low ground floods and the shore turns to sand; dry areas of a
+        # second noise field are dirt instead of grass
+        height_map = value_noise(rng, self.height, self.width, self.scale)
+        moisture = value_noise(rng, self.height, self.width, self.scale / 2)
+        water_line, sand_line = np.quantile(height_map, [self.water, self.water + self.sand])
+
+        level = np.full((self.height, self.width), GRASS, np.uint8)
+        level[moisture < np.quantile(moisture, self.dirt)] = DIRT
+        level[height_map < sand_line] = SAND
+        level[height_map < water_line] = WATER
+        return level
+
+    def _build(self, rng, level, occupied, items):
+        # Candidate sites are drawn all at once; a site is built on when
+        # it and the ring around it are still all grass
+        count = self.buildings
+        widths = rng.integers(5, 11, count)
+        heights = rng.integers(4, 8, count)
+        xs = rng.integers(1, np.maximum(2, self.width - widths - 1))
+        ys = rng.integers(1, np.maximum(2, self.height - heights - 1))
+        doors = rng.integers(1, widths - 1)
+        for x0, y0, w, h, door in zip(xs.tolist(), ys.tolist(), widths.tolist(),
+                heights.tolist(), doors.tolist()):
+            if x0 + w + 1 > self.width or y0 + h + 1 > self.height:
+                continue
+            if not (level[y0 - 1:y0 + h + 1, x0 - 1:x0 + w + 1] == GRASS).all():
+                continue
+            level[y0:y0 + h, x0:x0 + w] = WALL
+            level[y0 + 1:y0 + h - 1, x0 + 1:x0 + w - 1] = FLOOR
+            occupied[y0:y0 + h, x0:x0 + w] = True
+            items[x0 + door, y0 + h - 1, 0] = '@'
+            items[x0 + 1, y0 + 1, 0] = 'b'
+
+    def _connect(self, rng, tiles, occupied):
+        # Stacked stairs on cells open on both levels
+        for z in range(self.depth - 1):
+            upper = ((tiles[z] == GRASS) | (tiles[z] == DIRT)) & ~occupied[z]
+            lower = (tiles[z + 1] == DIRT) & ~occupied[z + 1]
+            cells = np.flatnonzero(upper & lower)
+            chosen = rng.choice(cells, min(len(cells), self.stairs), replace=False, shuffle=False)
+            tiles[z].flat[chosen] = DOWN
+            tiles[z + 1].flat[chosen] = UP
+            occupied[z].flat[chosen] = True
+            occupied[z + 1].flat[chosen] = True
+
+    def _scatter(self, rng, z, table, open_ground, occupied, items):
+        free = open_ground & ~occupied
+        for char, share in table:
+            chosen = sample_cells(rng, free, share)
+            free.flat[chosen] = False
+            occupied.flat[chosen] = True
+            ys, xs = np.divmod(chosen, self.width)
+            items.update(dict.fromkeys(zip(xs.tolist(), ys.tolist(), [z] * len(chosen)), char))
+
+    def _start(self, free):
+        # The free surface cell closest to the middle of the map
+        ys, xs = np.nonzero(free)
+        if not len(xs):
+            return None
+        distance = np.abs(xs - self.width // 2) + np.abs(ys - self.height // 2)
+        nearest = int(np.argmin(distance))
+        return int(xs[nearest]), int(ys[nearest]), 0
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('destination', help='Binary map file to write')
+    parser.add_argument('--size', type=parse_size, default=(200, 200, 2),
+            help='World size in cells, WxH or WxHxD (default=200x200x2)')
+    parser.add_argument('-s', '--seed', type=int, default=None, help='Random seed')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    this.cli_args = cli()
+    generator = MapGenerator(*cli_args.size, seed=cli_args.seed)
+    started = time.perf_counter()
+    planes = generator.generate()
+    elapsed = time.perf_counter() - started
+    planes.save(cli_args.destination)
+    print('[*] Generated {}x{}x{} cells and {} items in {:.2f}s, wrote {}'.format(
+        *reversed(planes.shape), len(planes.items), elapsed, cli_args.destination))
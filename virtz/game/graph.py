@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import heapq
+import weakref
+from array import array
+from itertools import count
+from math import inf as Infinity
+
+import numpy as np
+
+# (dx, dy) offsets of the eight surrounding cells on the same z-level
+NEIGHBOR_OFFSETS = ((1, 0), (-1, 0), (1, 1), (1, -1),
+                    (-1, 1), (-1, -1), (0, 1), (0, -1))
+
+# Each node has room for every possible neighbor so that a row can be
+# rewritten in place when the map changes
+MAX_DEGREE = len(NEIGHBOR_OFFSETS)
+
+
+def step_cost(dx, dy):
+    # Matches heuristic() for a single step: orthogonal moves cost 1,
+    # diagonal moves cost 2
+    return abs(dx) + abs(dy)
+
+
+def heuristic(a, b):
+    x1, y1, z1 = a
+    x2, y2, z2 = b
+    # Each level changed takes at least one step on the stairs
+    return abs(x1-x2) + abs(y1-y2) + abs(z1-z2)
+
+
+def edge_table(width):
+    # Flat index delta and step cost for every bit of a neighbor mask, for
+    # grids width cells wide
+    deltas = [(dy * width + dx, step_cost(dx, dy)) for dx, dy in NEIGHBOR_OFFSETS]
+    return [tuple(deltas[k] for k in range(MAX_DEGREE) if mask >> k & 1)
+            for mask in range(1 << MAX_DEGREE)]
+
+
+def a_star(adjacency, start, goal):
+    ''' Reversed path of positions from start to goal, or False
+
+        adjacency is anything with the node(), position() and edges() of
+        the LevelMap adjacency graphs.
+    '''
+    start_id = adjacency.node(start)
+    goal_id = adjacency.node(goal)
+    if start_id is None or goal_id is None:
+        return False
+
+    # Search over the integer node ids of the adjacency graph
+    position = adjacency.position
+    edges = adjacency.edges
+
+    # Set of evaluated nodes
+    closed_set = set()
+
+    # Binary heap of (f_score, tie_breaker, node) entries. Nodes are
+    # pushed again whenever a better g_score is found instead of being
+    # updated in place; stale entries are skipped when popped.
+    tie_breaker = count()
+    open_heap = [(heuristic(start, goal), next(tie_breaker), start_id)]
+
+    # dict containing path taken from node to node
+    came_from = {}
+
+    # cost of getting from start to a particular node
+    g_score = {start_id: 0}
+
+    while open_heap:
+        _, _, current = heapq.heappop(open_heap)
+        if current in closed_set:
+            continue
+        if current == goal_id:
+            total_path = [goal_id]
+            while current in came_from:
+                current = came_from[current]
+                total_path.append(current)
+            return [position(n) for n in total_path]
+        closed_set.add(current)
+
+        current_score = g_score[current]
+        for point, cost in edges(current):
+            if point in closed_set:
+                continue
+
+            temp_score = current_score + cost
+            if temp_score >= g_score.get(point, Infinity):
+                continue
+
+            came_from[point] = current
+            g_score[point] = temp_score
+            heapq.heappush(open_heap, (temp_score + heuristic(position(point), goal),
+                    next(tie_breaker), point))
+    return False
+
+
+class AdjacencyGraph:
+
+    ''' Compressed sparse row adjacency for the cells of a LevelMap
+
+        Every map position is assigned an integer node id. The edges of
+        node n are stored in targets[offsets[n]:offsets[n] + degree[n]],
+        with the cost of moving along each edge (step cost multiplied by
+        the movement_cost of the target tile) at the same index in costs.
+        Rows are allocated with MAX_DEGREE slots so update() can rebuild
+        the rows around a changed cell without shifting the arrays.
+    '''
+
+    def __init__(self, level_map):
+        self.level_map = level_map
+        self.positions = sorted(level_map.world_map)
+        self.node_ids = {p: n for n, p in enumerate(self.positions)}
+
+        size = len(self.positions)
+        self.offsets = array('l', range(0, (size + 1) * MAX_DEGREE, MAX_DEGREE))
+        self.degree = array('B', bytes(size))
+        self.targets = array('l', [0]) * (size * MAX_DEGREE)
+        self.costs = array('l', [0]) * (size * MAX_DEGREE)
+
+        openings = level_map.openings()
+        traversable = [level_map[p].passable or p in openings for p in self.positions]
+        for node in range(size):
+            self._build_row(node, traversable)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, position):
+        return position in self.node_ids
+
+    def node(self, position):
+        return self.node_ids.get(position)
+
+    def position(self, node):
+        return self.positions[node]
+
+    def _is_traversable(self, position):
+        return self.level_map[position].passable or self.level_map.has_opening(position)
+
+    def passable(self, node):
+        return self._is_traversable(self.positions[node])
+
+    def _build_row(self, node, traversable=None):
+        x, y, z = self.positions[node]
+        node_ids = self.node_ids
+        offset = self.offsets[node]
+        count = 0
+        for dx, dy in NEIGHBOR_OFFSETS:
+            target = node_ids.get((x + dx, y + dy, z))
+            if target is None:
+                continue
+            if traversable is not None:
+                if not traversable[target]:
+                    continue
+            elif not self._is_traversable(self.positions[target]):
+                continue
+            movement_cost = self.level_map[self.positions[target]].movement_cost
+            self.targets[offset + count] = target
+            self.costs[offset + count] = step_cost(dx, dy) * movement_cost
+            count += 1
+        self.degree[node] = count
+
+    def edges(self, node):
+        ''' Returns (target, cost) pairs for the given node id '''
+
+        offset = self.offsets[node]
+        end = offset + self.degree[node]
+        return zip(self.targets[offset:end], self.costs[offset:end])
+
+    def in_edges(self, node):
+        ''' Returns (source, cost) pairs for the edges leading into node
+
+            Every cell around a traversable node can step into it, blocked
+            ones included, since a walker may be standing on one.
+        '''
+        position = self.positions[node]
+        if not self._is_traversable(position):
+            return []
+        x, y, z = position
+        movement_cost = self.level_map[position].movement_cost
+        sources = []
+        for dx, dy in NEIGHBOR_OFFSETS:
+            source = self.node_ids.get((x + dx, y + dy, z))
+            if source is not None:
+                sources.append((source, step_cost(dx, dy) * movement_cost))
+        return sources
+
+    def neighbors(self, position):
+        ''' Returns the traversable positions adjacent to position '''
+
+        node = self.node_ids.get(position)
+        if node is None:
+            return []
+        offset = self.offsets[node]
+        positions = self.positions
+        return [positions[t] for t in self.targets[offset:offset + self.degree[node]]]
+
+    def update(self, position):
+        ''' Rebuild the rows whose edges lead into position
+
+            Called when the blocking flag or movement cost of the tile at
+            position changes, or when a door at position is locked/unlocked.
+        '''
+
+        x, y, z = position
+        for dx, dy in NEIGHBOR_OFFSETS:
+            node = self.node_ids.get((x + dx, y + dy, z))
+            if node is not None:
+                self._build_row(node)
+
+
+def _shift(array, dx, dy, fill=False):
+    # out[:, y, x] = array[:, y + dy, x + dx], filling cells shifted in
+    # from outside the array
+    out = np.full_like(array, fill)
+    height, width = array.shape[1:]
+    dst_y = slice(max(0, -dy), height - max(0, dy))
+    src_y = slice(max(0, dy), height - max(0, -dy))
+    dst_x = slice(max(0, -dx), width - max(0, dx))
+    src_x = slice(max(0, dx), width - max(0, -dx))
+    out[:, dst_y, dst_x] = array[:, src_y, src_x]
+    return out
+
+
+class GridAdjacency:
+
+    ''' Adjacency for LevelMaps stored in a TileGrid
+
+        Node ids are flat indexes into the (z, y, x) grid, and the edges of
+        each node are kept as a bitmask with one bit per NEIGHBOR_OFFSETS
+        entry. Edge costs are read from the grid's movement_cost array, so
+        the whole structure costs one byte per cell and is built with
+        vectorized operations over each level.
+    '''
+
+    def __init__(self, level_map):
+        self.level_map = level_map
+        self.grid = level_map.grid
+        depth, height, width = self.grid.shape
+        self._plane = height * width
+        self._width = width
+
+        self._edge_table = edge_table(width)
+
+        self.traversable = self.grid.present & ~self.grid.blocking
+        for x, y, z in level_map.openings():
+            self.traversable[z, y, x] = self.grid.present[z, y, x]
+
+        self.mask = np.zeros(self.grid.shape, np.uint8)
+        for bit, (dx, dy) in enumerate(NEIGHBOR_OFFSETS):
+            self.mask |= _shift(self.traversable, dx, dy).astype(np.uint8) << bit
+        self.mask[~self.grid.present] = 0
+
+        # Same layout over the cells present at all, for in_edges()
+        self.present_mask = np.zeros(self.grid.shape, np.uint8)
+        for bit, (dx, dy) in enumerate(NEIGHBOR_OFFSETS):
+            self.present_mask |= _shift(self.grid.present, dx, dy).astype(np.uint8) << bit
+
+        # Flat memoryviews share memory with the arrays but index to plain
+        # ints, which is much cheaper than NumPy scalar access in the
+        # pathfinder's inner loop
+        self._flat_mask = memoryview(self.mask.reshape(-1))
+        self._flat_cost = memoryview(self.grid.movement_cost.reshape(-1))
+        self._flat_traversable = memoryview(self.traversable.reshape(-1))
+        self._flat_present_mask = memoryview(self.present_mask.reshape(-1))
+
+    def __len__(self):
+        return self.mask.size
+
+    def __contains__(self, position):
+        return position in self.grid
+
+    def node(self, position):
+        if position not in self.grid:
+            return None
+        x, y, z = position
+        return z * self._plane + y * self._width + x
+
+    def position(self, node):
+        z, rest = divmod(node, self._plane)
+        y, x = divmod(rest, self._width)
+        return x, y, z
+
+    def passable(self, node):
+        return bool(self._flat_traversable[node])
+
+    def edges(self, node):
+        ''' Returns (target, cost) pairs for the given node id '''
+
+        cost = self._flat_cost
+        return [(node + delta, step * cost[node + delta])
+                for delta, step in self._edge_table[self._flat_mask[node]]]
+
+    def in_edges(self, node):
+        ''' Returns (source, cost) pairs for the edges leading into node
+
+            Every cell around a traversable node can step into it, blocked
+            ones included, since a walker may be standing on one.
+        '''
+        if not self._flat_traversable[node]:
+            return []
+        cost = self._flat_cost[node]
+        return [(node + delta, step * cost)
+                for delta, step in self._edge_table[self._flat_present_mask[node]]]
+
+    def neighbors(self, position):
+        ''' Returns the traversable positions adjacent to position '''
+
+        node = self.node(position)
+        if node is None:
+            return []
+        x, y, z = position
+        return [(x + dx, y + dy, z) for bit, (dx, dy) in enumerate(NEIGHBOR_OFFSETS)
+                if self._flat_mask[node] >> bit & 1]
+
+    def update(self, position):
+        ''' Recompute the mask bits that lead into position '''
+
+        x, y, z = position
+        self.traversable[z, y, x] = self.level_map[position].passable or \
+                self.level_map.has_opening(position)
+        for bit, (dx, dy) in enumerate(NEIGHBOR_OFFSETS):
+            source = x - dx, y - dy, z
+            if source in self.grid:
+                if self.traversable[z, y, x]:
+                    self.mask[z, source[1], source[0]] |= 1 << bit
+                else:
+                    self.mask[z, source[1], source[0]] &= ~(1 << bit) & 0xff
+
+
+class ChunkAdjacency:
+
+    ''' Adjacency for LevelMaps stored in a ChunkedGrid
+
+        Node ids are flat indexes into the (z, y, x) extent of the map as
+        with GridAdjacency, but nothing is built for the whole map. The
+        first edge query into a chunk loads it if needed and derives flat
+        traversable, present and cost views of it, kept for as long as
+        the chunk stays resident; update() drops those of a changed cell.
+    '''
+
+    def __init__(self, level_map):
+        self.level_map = level_map
+        self.grid = level_map.chunks
+        depth, height, width = self.grid.shape
+        self._plane = height * width
+        self._width = width
+        self._size = size = self.grid.chunk_size
+        self._states = weakref.WeakKeyDictionary()     # chunk -> flat views
+        # (node delta, delta inside a chunk, step cost) per neighbor
+        self._offsets = [(dy * width + dx, dy * size + dx, step_cost(dx, dy))
+                for dx, dy in NEIGHBOR_OFFSETS]
+
+    def __len__(self):
+        return self.grid.shape[0] * self._plane
+
+    def __contains__(self, position):
+        return position in self.grid
+
+    def node(self, position):
+        if position not in self.grid:
+            return None
+        x, y, z = position
+        return z * self._plane + y * self._width + x
+
+    def position(self, node):
+        z, rest = divmod(node, self._plane)
+        y, x = divmod(rest, self._width)
+        return x, y, z
+
+    def _state(self, key):
+        # (traversable, present, movement_cost) flat views of chunk key
+        chunk = self.grid.chunk(key)
+        try:
+            return self._states[chunk]
+        except KeyError:
+            pass
+        traversable = chunk.present & ~chunk.blocking
+        z, cy, cx = key
+        size = self._size
+        for x, y, level in self.level_map.openings():
+            if level == z and y // size == cy and x // size == cx:
+                traversable[0, y % size, x % size] = chunk.present[0, y % size, x % size]
+        state = self._states[chunk] = (memoryview(traversable.reshape(-1)),
+                memoryview(chunk.present.reshape(-1)), memoryview(chunk.movement_cost.reshape(-1)))
+        return state
+
+    def _cell(self, x, y, z):
+        # (state, index in the state) of a cell, or None outside the map
+        depth, height, width = self.grid.shape
+        if not (0 <= x < width and 0 <= y < height and 0 <= z < depth):
+            return None
+        size = self._size
+        return self._state((z, y // size, x // size)), y % size * size + x % size
+
+    def _interior(self, node):
+        # (state, index) of a node whose neighbors share its chunk, or None
+        x, y, z = self.position(node)
+        size = self._size
+        lx, ly = x % size, y % size
+        if 0 < lx < size - 1 and 0 < ly < size - 1:
+            return self._state((z, y // size, x // size)), ly * size + lx
+        return None
+
+    def passable(self, node):
+        (traversable, _, _), index = self._cell(*self.position(node))
+        return bool(traversable[index])
+
+    def edges(self, node):
+        ''' Returns (target, cost) pairs for the given node id '''
+
+        interior = self._interior(node)
+        if interior is not None:
+            (traversable, _, cost), here = interior
+            return [(node + delta, step * cost[here + local])
+                    for delta, local, step in self._offsets if traversable[here + local]]
+        x, y, z = self.position(node)
+        found = []
+        for dx, dy in NEIGHBOR_OFFSETS:
+            cell = self._cell(x + dx, y + dy, z)
+            if cell is not None:
+                (traversable, _, cost), index = cell
+                if traversable[index]:
+                    found.append((node + dy * self._width + dx, step_cost(dx, dy) * cost[index]))
+        return found
+
+    def in_edges(self, node):
+        ''' Returns (source, cost) pairs for the edges leading into node
+
+            Every cell around a traversable node can step into it, blocked
+            ones included, since a walker may be standing on one.
+        '''
+        x, y, z = self.position(node)
+        (traversable, _, cost), index = self._cell(x, y, z)
+        if not traversable[index]:
+            return []
+        movement_cost = cost[index]
+        interior = self._interior(node)
+        if interior is not None:
+            (_, present, _), here = interior
+            return [(node + delta, step * movement_cost)
+                    for delta, local, step in self._offsets if present[here + local]]
+        sources = []
+        for dx, dy in NEIGHBOR_OFFSETS:
+            cell = self._cell(x + dx, y + dy, z)
+            if cell is not None and cell[0][1][cell[1]]:
+                sources.append((node + dy * self._width + dx, step_cost(dx, dy) * movement_cost))
+        return sources
+
+    def neighbors(self, position):
+        ''' Returns the traversable positions adjacent to position '''
+
+        node = self.node(position)
+        if node is None:
+            return []
+        return [self.position(target) for target, _ in self.edges(node)]
+
+    def update(self, position):
+        ''' Drop the derived views of the chunk holding position '''
+
+        x, y, z = position
+        size = self._size
+        key = z, y // size, x // size
+        if self.grid.resident(key):
+            self._states.pop(self.grid.chunk(key), None)
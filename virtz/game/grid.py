@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from .models import MapCell
+
+
+def _grid_field(name, cast):
+    # Property reading/writing one cell of a TileGrid array
+    def getter(self):
+        return cast(getattr(self.grid, name)[self.index])
+
+    def setter(self, value):
+        getattr(self.grid, name)[self.index] = value
+
+    return property(getter, setter)
+
+
+class TileView(MapCell):
+
+    ''' Lightweight MapCell over a single position of a TileGrid
+
+        Views are created on demand by TileGrid.__getitem__ and hold no
+        state of their own; every read and write goes to the grid arrays.
+    '''
+
+    __slots__ = ('grid', 'index')
+
+    def __init__(self, grid, position):
+        x, y, z = position
+        self.grid = grid
+        self.index = z, y, x
+
+    explored = _grid_field('explored', bool)
+    visited = _grid_field('visited', bool)
+    blocking = _grid_field('blocking', bool)
+    movement_cost = _grid_field('movement_cost', int)
+    light = _grid_field('light', int)
+
+    @property
+    def kind(self):
+        return self.grid.kinds[self.grid.type_id[self.index]]
+
+    @kind.setter
+    def kind(self, kind):
+        self.grid.type_id[self.index] = self.grid.kind_id(kind)
+
+    @property
+    def position(self):
+        z, y, x = self.index
+        return x, y, z
+
+
+class TileGrid:
+
+    ''' Dense NumPy storage for the cells of a LevelMap
+
+        Each per-cell attribute is an array of shape (z, y, x). type_id
+        indexes into kinds, the tuple of TileTypes used by the map, and
+        present marks the cells that exist for maps with ragged rows. The
+        grid behaves like the {(x, y, z): MapCell} dict it replaces:
+        membership, iteration over positions and item access all work,
+        with item access returning a TileView.
+    '''
+
+    def __init__(self, kinds, shape):
+        self.kinds = list(kinds)
+        self._kind_ids = {kind: n for n, kind in enumerate(self.kinds)}
+        self.shape = shape
+        self.type_id = np.zeros(shape, np.uint16)
+        self.present = np.zeros(shape, np.bool_)
+        self.explored = np.zeros(shape, np.bool_)
+        self.visited = np.zeros(shape, np.bool_)
+        self.blocking = np.zeros(shape, np.bool_)
+        self.movement_cost = np.zeros(shape, np.uint8)
+        self.light = np.zeros(shape, np.uint8)
+
+    @classmethod
+    def from_chars(cls, char_map, prototypes):
+        ''' Build a grid from nested lists of tile characters
+
+            prototypes maps each character to its TileType, as loaded by
+            TileFactory.
+        '''
+
+        depth = len(char_map)
+        height = max(len(level) for level in char_map)
+        width = max(len(row) for level in char_map for row in level)
+        grid = cls(prototypes.values(), (depth, height, width))
+
+        # Translate characters to type ids a whole row at a time
+        lookup = np.full(256, -1, np.int32)
+        for char, kind in prototypes.items():
+            lookup[ord(char)] = grid.kind_id(kind)
+        for z, level in enumerate(char_map):
+            for y, row in enumerate(level):
+                ids = lookup[np.frombuffer(row.encode('latin-1'), np.uint8)]
+                if (ids < 0).any():
+                    raise KeyError('Unknown tile character in row {} of level {}'.format(y, z))
+                grid.type_id[z, y, :len(row)] = ids
+                grid.present[z, y, :len(row)] = True
+        grid.reset_state()
+        return grid
+
+    @classmethod
+    def from_ids(cls, type_id, kinds, present=None):
+        ''' Build a grid over an existing (z, y, x) array of type ids, such
+            as the tiles of a MapFile, where kinds[n] is the TileType of id
+            n. present defaults to every cell.
+        '''
+
+        grid = cls(kinds, type_id.shape)
+        grid.type_id = type_id
+        grid.present[...] = True if present is None else present
+        grid.reset_state()
+        return grid
+
+    def kind_id(self, kind):
+        try:
+            kind_id = self._kind_ids[kind]
+        except KeyError:
+            kind_id = self._kind_ids[kind] = len(self.kinds)
+            self.kinds.append(kind)
+        if kind_id > np.iinfo(self.type_id.dtype).max:
+            # Grids over uint8 map file planes widen on demand; chunks
+            # share their kinds, so a kind added through another chunk
+            # may not fit this one yet
+            self.type_id = self.type_id.astype(np.uint16)
+        return kind_id
+
+    def kind_table(self, field, dtype):
+        ''' Per type id array of a TileType field, for use as a lookup table '''
+
+        return np.array([getattr(kind, field) for kind in self.kinds], dtype)
+
+    def reset_state(self):
+        ''' Reset per-cell state to the defaults of each cell's TileType '''
+
+        self.blocking[...] = self.kind_table('blocking', np.bool_)[self.type_id] & self.present
+        self.movement_cost[...] = self.kind_table('movement_cost', np.uint8)[self.type_id]
+        self.explored[...] = False
+        self.visited[...] = False
+        self.light[...] = 0
+
+    def kinds_in_use(self):
+        return [self.kinds[n] for n in np.unique(self.type_id[self.present])]
+
+    def level_positions(self, z):
+        ''' Yields the (x, y, z) positions present on a single level '''
+
+        ys, xs = np.nonzero(self.present[z])
+        for y, x in zip(ys.tolist(), xs.tolist()):
+            yield x, y, z
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.type_id, self.present, self.explored,
+            self.visited, self.blocking, self.movement_cost, self.light))
+
+    def __contains__(self, position):
+        try:
+            x, y, z = position
+        except (TypeError, ValueError):
+            return False
+        depth, height, width = self.shape
+        if 0 <= x < width and 0 <= y < height and 0 <= z < depth:
+            return bool(self.present[z, y, x])
+        return False
+
+    def __getitem__(self, position):
+        if position not in self:
+            raise KeyError(position)
+        return TileView(self, position)
+
+    def __setitem__(self, position, tile):
+        if position not in self:
+            raise KeyError(position)
+        view = TileView(self, position)
+        view.kind = tile.kind
+        view.explored = tile.explored
+        view.visited = tile.visited
+        view.blocking = tile.blocking
+        view.movement_cost = tile.movement_cost
+        view.light = tile.light
+
+    def __iter__(self):
+        for z in range(self.shape[0]):
+            yield from self.level_positions(z)
+
+    def __len__(self):
+        return int(self.present.sum())
+
+    def values(self):
+        for position in self:
+            yield TileView(self, position)
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Hierarchical pathfinding (HPA*) over the LevelMap adjacency. Every z-level
+# is cut into square clusters; the cells where a path can cross from one
+# cluster into the next, or take the stairs to another level, become the
+# entrances of an abstract graph that is searched instead of the map itself.
+
+from heapq import heappush, heappop
+from itertools import count
+from math import inf as Infinity
+
+import numpy as np
+
+from .graph import NEIGHBOR_OFFSETS
+
+CLUSTER_SIZE = 16
+
+# Border runs at least this long get an entrance at each end instead of one
+# in the middle
+LONG_ENTRANCE = 6
+
+
+def is_stairs(tile):
+    # The gray stairs rows are not flagged in the seed data, so also go by
+    # the tile_type derived from the name
+    return bool(tile.stairs) or tile.tile_type == 'stairs'
+
+
+class Route:
+
+    ''' A path found by the HierarchicalPathfinder, refined one abstract
+        segment at a time as it is walked
+
+        Walkers treat it like the reversed position list the Pathfinder
+        returns: pop() yields the start first and then every step up to
+        the goal, and the route is false once exhausted. Once the map's
+        topology changes, a segment touching a cluster that changed after
+        the route was planned, or one stepping onto a cell that is no
+        longer passable, ends the route early, and the walker plans again.
+    '''
+
+    def __init__(self, hpa, waypoints, start_tree, goal_tree):
+        self._hpa = hpa
+        self._waypoints = waypoints
+        self._start_tree = start_tree   # came_from within the start's cluster
+        self._goal_tree = goal_tree     # next step toward the goal within its cluster
+        self._next = 0
+        self._steps = [hpa.adjacency.position(waypoints[0])]
+        self._version = hpa.level_map.topology_version     # when planned
+        self._checked = self._version   # when the refined steps were last checked
+
+    @property
+    def waypoints(self):
+        return [self._hpa.adjacency.position(n) for n in self._waypoints]
+
+    def __bool__(self):
+        return self._ready()
+
+    def pop(self):
+        if not self._ready():
+            raise IndexError('pop from empty route')
+        return self._steps.pop()
+
+    def _ready(self):
+        # Whether a step is left, refining the next segment if need be;
+        # a route that cannot go on is exhausted early
+        version = self._hpa.level_map.topology_version
+        if self._checked != version:
+            # Steps refined before a wall went up may lead into it
+            self._checked = version
+            if not self._passable(self._steps):
+                self._end()
+        while not self._steps:
+            if not self._refine_next():
+                return False
+        return True
+
+    def _end(self):
+        self._steps = []
+        self._next = len(self._waypoints)
+
+    def _refine_next(self):
+        if self._next >= len(self._waypoints) - 1:
+            return False
+        segment = self._segment(self._next)
+        self._next += 1
+        if segment is None:
+            self._end()
+            return False
+        self._steps = segment[::-1]
+        return True
+
+    def _passable(self, positions):
+        adjacency = self._hpa.adjacency
+        return all(adjacency.passable(adjacency.node(p)) for p in positions)
+
+    def _segment(self, index):
+        # Positions after waypoint index up to and including the next one
+        hpa = self._hpa
+        if hpa.level_map.topology_version != self._version:
+            # Drop the cluster data the changes made stale before using
+            # any of it, and give up on segments in changed clusters
+            hpa._refresh()
+        a, b = self._waypoints[index], self._waypoints[index + 1]
+        clusters = hpa.cluster_of(a), hpa.cluster_of(b)
+        if any(hpa.changed_since(cluster, self._version) for cluster in clusters):
+            return None
+        if clusters[0] != clusters[1]:
+            segment = [hpa.adjacency.position(b)]
+        else:
+            if index == 0:
+                nodes = _unwind(self._start_tree, b, a)
+            elif index == len(self._waypoints) - 2:
+                nodes = _follow(self._goal_tree, a, b)
+            else:
+                nodes = _unwind(hpa.intra(a)[1], b, a)
+            if nodes is None:
+                return None
+            segment = [hpa.adjacency.position(n) for n in nodes]
+        if hpa.level_map.topology_version != self._version and not self._passable(segment):
+            return None
+        return segment
+
+    def to_list(self):
+        ''' The whole path, reversed like Pathfinder results, without
+            consuming the route
+        '''
+        path = [self._hpa.adjacency.position(self._waypoints[0])]
+        for index in range(len(self._waypoints) - 1):
+            segment = self._segment(index)
+            if segment is None:
+                return False
+            path.extend(segment)
+        return path[::-1]
+
+
+def _unwind(came_from, node, source):
+    # Nodes from source (exclusive) to node along a came_from tree
+    nodes = []
+    while node != source:
+        nodes.append(node)
+        try:
+            node = came_from[node]
+        except KeyError:
+            return None
+    return nodes[::-1]
+
+
+def _follow(toward, node, target):
+    # Nodes after node up to target along a next-step tree
+    nodes = []
+    while node != target:
+        try:
+            node = toward[node]
+        except KeyError:
+            return None
+        nodes.append(node)
+    return nodes
+
+
+class HierarchicalPathfinder:
+
+    ''' HPA* over the adjacency of a LevelMap
+
+        Crossings between two neighbouring clusters are grouped into runs
+        whose cells touch on both sides, and each run gets one entrance
+        (two at its ends when long). Stacked stairs tiles link entrances
+        on adjacent levels. Clusters are scanned for entrances the first
+        time the abstract search reaches them, and the costs between the
+        entrances of a cluster are found by a Dijkstra bounded to the
+        cluster the first time one is expanded; both are kept until the
+        cluster changes. Topology changes reported by the LevelMap mark
+        their cluster dirty and only dirty clusters are rescanned.
+    '''
+
+    def __init__(self, level_map, cluster_size=CLUSTER_SIZE):
+        self.level_map = level_map
+        self.cluster_size = cluster_size
+        self.adjacency = None
+        self._dirty = set()
+        self._changed = {}          # cluster -> topology_version of its last change
+        self.cluster_rebuilds = 0
+        level_map.add_topology_listener(self._topology_changed)
+
+    def _topology_changed(self, position):
+        cluster = self.cluster(position)
+        self._dirty.add(cluster)
+        self._changed[cluster] = self.level_map.topology_version
+
+    def changed_since(self, cluster, version):
+        ''' Whether the topology of cluster changed after topology_version
+            version
+        '''
+        return self._changed.get(cluster, -1) > version
+
+    def cluster(self, position):
+        x, y, z = position
+        return x // self.cluster_size, y // self.cluster_size, z
+
+    def cluster_of(self, node):
+        return self.cluster(self.adjacency.position(node))
+
+    def build(self):
+        self.adjacency = self.level_map.adjacency
+        self._bounds = self.level_map.bounds
+        self.links = {}             # entrance -> {entrance: cost} across clusters
+        self.entrances = {}         # cluster -> set of entrances
+        self._borders = {}          # (cluster, cluster) -> [(u, v, cost_uv, cost_vu)]
+        self._borders_of = {}       # cluster -> set of border keys
+        self._intra = {}            # entrance -> (costs, came_from) within its cluster
+        self._intra_of = {}         # cluster -> set of entrances in _intra
+        self._scanned = set()
+        self._dirty = set()
+        self._stairs = self._find_stairs()
+
+    def _clusters(self):
+        width, height, depth = self._bounds
+        size = self.cluster_size
+        for z in range(depth):
+            for cy in range(-(-height // size)):
+                for cx in range(-(-width // size)):
+                    yield cx, cy, z
+
+    def _cells(self, cluster, perimeter=False):
+        cx, cy, z = cluster
+        width, height, depth = self._bounds
+        size = self.cluster_size
+        x0, y0 = cx * size, cy * size
+        x1, y1 = min(x0 + size, width), min(y0 + size, height)
+        for y in range(y0, y1):
+            if perimeter and y0 < y < y1 - 1:
+                xs = (x0, x1 - 1) if x1 - 1 > x0 else (x0,)
+            else:
+                xs = range(x0, x1)
+            for x in xs:
+                yield x, y, z
+
+    def _find_stairs(self):
+        level_map = self.level_map
+        grid = level_map.grid
+        if grid is not None:
+            flags = np.array([is_stairs(kind) for kind in grid.kinds], np.bool_)
+            zs, ys, xs = np.nonzero(flags[grid.type_id] & grid.present)
+            positions = zip(xs.tolist(), ys.tolist(), zs.tolist())
+        else:
+            positions = [p for p in level_map.world_map if is_stairs(level_map[p])]
+        stairs = {}
+        for position in positions:
+            stairs.setdefault(self.cluster(position), set()).add(position)
+        return stairs
+
+    def _ensure(self, cluster):
+        if cluster not in self._scanned:
+            self._scan_cluster(cluster)
+            self._scanned.add(cluster)
+
+    def _scan_cluster(self, cluster):
+        # (Re)record every border between cluster and its neighbours; a
+        # border is the same seen from either side
+        adjacency = self.adjacency
+        node = adjacency.node
+        position = adjacency.position
+        found = {}
+        for cell in self._cells(cluster, perimeter=True):
+            u = node(cell)
+            if u is None:
+                continue
+            incoming = adjacency.in_edges(u)
+            if not incoming:
+                continue
+            outgoing = dict(adjacency.edges(u))
+            for v, cost_vu in incoming:
+                other = self.cluster(position(v))
+                if other != cluster and v in outgoing:
+                    found.setdefault(other, []).append((u, v, outgoing[v], cost_vu))
+
+        for cell in self._stairs.get(cluster, ()):
+            u = node(cell)
+            if u is None or not adjacency.passable(u):
+                continue
+            x, y, z = cell
+            for other_cell in ((x, y, z - 1), (x, y, z + 1)):
+                other = self.cluster(other_cell)
+                if other_cell not in self._stairs.get(other, ()):
+                    continue
+                v = node(other_cell)
+                if v is not None and adjacency.passable(v):
+                    found.setdefault(other, []).append((u, v,
+                        self.level_map[other_cell].movement_cost,
+                        self.level_map[cell].movement_cost))
+
+        for other, pairs in found.items():
+            self._set_border(cluster, other, self._pick_entrances(pairs))
+
+    def _pick_entrances(self, pairs):
+        # Crossings whose cells touch on both sides are interchangeable
+        # for reachability; union them into runs and keep one or two
+        position = self.adjacency.position
+        parent = list(range(len(pairs)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        cells = [(position(u), position(v)) for u, v, _, _ in pairs]
+        by_cell = {}
+        for i, (u_cell, v_cell) in enumerate(cells):
+            by_cell.setdefault(u_cell, []).append(i)
+        for i, ((ux, uy, uz), (vx, vy, vz)) in enumerate(cells):
+            for dx, dy in NEIGHBOR_OFFSETS:
+                for j in by_cell.get((ux + dx, uy + dy, uz), ()):
+                    ox, oy, oz = cells[j][1]
+                    if abs(ox - vx) <= 1 and abs(oy - vy) <= 1 and oz == vz:
+                        parent[find(i)] = find(j)
+
+        runs = {}
+        for i in range(len(pairs)):
+            runs.setdefault(find(i), []).append(i)
+        picked = []
+        for run in runs.values():
+            run.sort(key=lambda i: cells[i])
+            if len({cells[i][0] for i in run}) >= LONG_ENTRANCE:
+                picked.extend((pairs[run[0]], pairs[run[-1]]))
+            else:
+                picked.append(pairs[run[len(run) // 2]])
+        return picked
+
+    def _set_border(self, a, b, pairs):
+        key = min(a, b), max(a, b)
+        self._drop_border(key)
+        self._borders[key] = pairs
+        self._borders_of.setdefault(a, set()).add(key)
+        self._borders_of.setdefault(b, set()).add(key)
+        for u, v, cost_uv, cost_vu in pairs:
+            self._link(u, v, cost_uv)
+            self._link(v, u, cost_vu)
+
+    def _drop_border(self, key):
+        pairs = self._borders.pop(key, None)
+        if pairs is None:
+            return
+        for cluster in key:
+            self._borders_of[cluster].discard(key)
+        for u, v, _, _ in pairs:
+            self._unlink(u, v)
+            self._unlink(v, u)
+
+    def _link(self, u, v, cost):
+        self.links.setdefault(u, {})[v] = cost
+        self.entrances.setdefault(self.cluster_of(u), set()).add(u)
+
+    def _unlink(self, u, v):
+        links = self.links.get(u)
+        if links is None:
+            return
+        links.pop(v, None)
+        if not links:
+            del self.links[u]
+            self.entrances[self.cluster_of(u)].discard(u)
+
+    def _refresh(self):
+        if self.adjacency is not self.level_map.adjacency:
+            self.build()
+            return
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        for cluster in dirty:
+            stairs = {p for p in self._cells(cluster) if is_stairs(self.level_map[p])}
+            if stairs:
+                self._stairs[cluster] = stairs
+            else:
+                self._stairs.pop(cluster, None)
+            for node in self._intra_of.pop(cluster, ()):
+                del self._intra[node]
+            for key in list(self._borders_of.get(cluster, ())):
+                self._drop_border(key)
+        for cluster in dirty & self._scanned:
+            self._scan_cluster(cluster)
+            self.cluster_rebuilds += 1
+
+    def _search_cluster(self, source, cluster, reverse=False):
+        # Dijkstra from source bounded to the cells of cluster. Forward
+        # searches return (cost from source, came_from), reverse searches
+        # (cost to source, next step toward it).
+        expand = self.adjacency.in_edges if reverse else self.adjacency.edges
+        node_id = self.adjacency.node
+        members = {node_id(cell) for cell in self._cells(cluster)}
+        costs = {source: 0}
+        tree = {}
+        closed = set()
+        heap = [(0, source)]
+        while heap:
+            cost, node = heappop(heap)
+            if node in closed:
+                continue
+            closed.add(node)
+            for other, edge_cost in expand(node):
+                if other not in members:
+                    continue
+                new_cost = cost + edge_cost
+                if new_cost < costs.get(other, Infinity):
+                    costs[other] = new_cost
+                    tree[other] = node
+                    heappush(heap, (new_cost, other))
+        return costs, tree
+
+    def intra(self, entrance):
+        ''' (costs, came_from) of the paths from entrance to every cell of
+            its cluster
+        '''
+        try:
+            return self._intra[entrance]
+        except KeyError:
+            pass
+        cluster = self.cluster_of(entrance)
+        result = self._intra[entrance] = self._search_cluster(entrance, cluster)
+        self._intra_of.setdefault(cluster, set()).add(entrance)
+        return result
+
+    def find(self, start, goal):
+        ''' Returns a Route from start to goal, or False if there is none '''
+
+        self._refresh()
+        adjacency = self.adjacency
+        source, target = adjacency.node(start), adjacency.node(goal)
+        if source is None or target is None:
+            return False
+        if source == target:
+            return Route(self, [source], {}, {})
+
+        goal_cluster = self.cluster(goal)
+        start_costs, start_tree = self._search_cluster(source, self.cluster(start))
+        goal_costs, goal_tree = self._search_cluster(target, goal_cluster, reverse=True)
+
+        position = adjacency.position
+        gx, gy, gz = goal
+
+        def heuristic(node):
+            x, y, z = position(node)
+            return abs(x - gx) + abs(y - gy) + abs(z - gz)
+
+        def abstract_edges(node):
+            cluster = self.cluster_of(node)
+            self._ensure(cluster)
+            costs = start_costs if node == source else self.intra(node)[0]
+            for entrance in self.entrances.get(cluster, ()):
+                if entrance != node and entrance in costs:
+                    yield entrance, costs[entrance]
+            if node == source and target in start_costs:
+                yield target, start_costs[target]
+            elif cluster == goal_cluster and node in goal_costs:
+                yield target, goal_costs[node]
+            yield from self.links.get(node, {}).items()
+
+        tie_breaker = count()
+        open_heap = [(heuristic(source), next(tie_breaker), source)]
+        came_from = {}
+        g_score = {source: 0}
+        closed_set = set()
+        while open_heap:
+            _, _, current = heappop(open_heap)
+            if current in closed_set:
+                continue
+            if current == target:
+                waypoints = [current]
+                while current in came_from:
+                    current = came_from[current]
+                    waypoints.append(current)
+                return Route(self, waypoints[::-1], start_tree, goal_tree)
+            closed_set.add(current)
+
+            current_score = g_score[current]
+            for node, cost in abstract_edges(current):
+                if node in closed_set:
+                    continue
+                score = current_score + cost
+                if score >= g_score.get(node, Infinity):
+                    continue
+                came_from[node] = current
+                g_score[node] = score
+                heappush(open_heap, (score + heuristic(node), next(tie_breaker), node))
+        return False
+
+    def info(self):
+        return {
+            'clusters': sum(1 for c in self._clusters()),
+            'scanned': len(self._scanned),
+            'entrances': len(self.links),
+            'intra_cached': len(self._intra),
+            'cluster_rebuilds': self.cluster_rebuilds,
+            }
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Side of the square regions of cells items are also filed under
+REGION_SIZE = 16
+
+
+class ItemIndex:
+
+    ''' Hash indexes over the MapItems of a LevelMap
+
+        Items are looked up by position, by item_type, by the container
+        holding them and by the REGION_SIZE square region of a level they
+        are in, so in_box() visits the regions around a box of cells
+        instead of every item. LevelMap keeps the index in step with item_list, and
+        MapItem reports position and container changes through move() and
+        reparent(). Every add, remove or move bumps a per item_type version
+        so derived data like the need maps can tell when to refresh, and
+        revision counts every change of any item. Listeners are told of
+        every item added, removed, moved or reparented as it happens.
+    '''
+
+    def __init__(self, items=()):
+        self._versions = {}
+        self._listeners = []
+        self.revision = 0
+        self.rebuild(items)
+
+    def add_listener(self, callback):
+        ''' Register callback(item), called after an item was added,
+            removed, moved or put in or taken out of a container
+        '''
+        self._listeners.append(callback)
+
+    def _changed(self, item):
+        for callback in self._listeners:
+            callback(item)
+
+    def rebuild(self, items):
+        self.revision += 1
+        self._items = set()
+        self._by_position = {}
+        self._by_region = {}
+        self._by_type = {}
+        self._by_container = {}
+        for item in items:
+            self.add(item)
+
+    def version(self, item_type):
+        return self._versions.get(item_type, 0)
+
+    def _touch(self, item_type):
+        self._versions[item_type] = self._versions.get(item_type, 0) + 1
+        self.revision += 1
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    @staticmethod
+    def _insert(bucket, key, item):
+        try:
+            bucket[key].append(item)
+        except KeyError:
+            bucket[key] = [item]
+
+    @staticmethod
+    def _discard(bucket, key, item):
+        items = bucket.get(key)
+        if items is None:
+            return
+        try:
+            items.remove(item)
+        except ValueError:
+            return
+        if not items:
+            del bucket[key]
+
+    def add(self, item):
+        if item in self._items:
+            return
+        self._items.add(item)
+        self._insert(self._by_position, item.position, item)
+        self._insert(self._by_region, _region(item.position), item)
+        self._insert(self._by_type, item.item_type, item)
+        if item.container is not None:
+            self._insert(self._by_container, item.container, item)
+        self._touch(item.item_type)
+        self._changed(item)
+
+    def remove(self, item):
+        if item not in self._items:
+            return
+        self._items.remove(item)
+        self._discard(self._by_position, item.position, item)
+        self._discard(self._by_region, _region(item.position), item)
+        self._discard(self._by_type, item.item_type, item)
+        if item.container is not None:
+            self._discard(self._by_container, item.container, item)
+        self._touch(item.item_type)
+        self._changed(item)
+
+    def move(self, item, old_position):
+        ''' Re-file an indexed item after its position changed '''
+
+        if item in self._items:
+            self._discard(self._by_position, old_position, item)
+            self._insert(self._by_position, item.position, item)
+            self._discard(self._by_region, _region(old_position), item)
+            self._insert(self._by_region, _region(item.position), item)
+            self._touch(item.item_type)
+            self._changed(item)
+
+    def reparent(self, item, old_container):
+        ''' Re-file an indexed item after its container changed '''
+
+        if item in self._items:
+            self.revision += 1
+            if old_container is not None:
+                self._discard(self._by_container, old_container, item)
+            if item.container is not None:
+                self._insert(self._by_container, item.container, item)
+            self._changed(item)
+
+    def at(self, position):
+        return self._by_position.get(position, ())
+
+    def in_box(self, z, x0, y0, x1, y1):
+        ''' Yields the items on level z inside the (x0, y0, x1, y1) box of
+            cells, ends exclusive
+        '''
+        for ry in range(y0 // REGION_SIZE, (y1 - 1) // REGION_SIZE + 1):
+            for rx in range(x0 // REGION_SIZE, (x1 - 1) // REGION_SIZE + 1):
+                for item in self._by_region.get((z, ry, rx), ()):
+                    x, y, _ = item.position
+                    if x0 <= x < x1 and y0 <= y < y1:
+                        yield item
+
+    def of_type(self, item_type):
+        return self._by_type.get(item_type, ())
+
+    def contents(self, container):
+        return self._by_container.get(container, ())
+
+
+def _region(position):
+    x, y, z = position
+    return z, y // REGION_SIZE, x // REGION_SIZE
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Jump Point Search over a grid-stored LevelMap. Inside regions where every
+# traversable cell costs 1 to enter, runs of cells are skipped by jumping in
+# straight and diagonal lines, and only cells with forced neighbours are
+# pushed on the open list. Cells costing more, and the cells next to them,
+# are expanded one neighbour at a time like weighted A*.
+
+from heapq import heappush, heappop
+from itertools import count
+from math import inf as Infinity
+
+import numpy as np
+
+from .graph import GridAdjacency, NEIGHBOR_OFFSETS, _shift
+
+
+def _sign(n):
+    return (n > 0) - (n < 0)
+
+
+class JumpPointSearch:
+
+    ''' Jump Point Search for the GridAdjacency of a LevelMap
+
+        A cell is uniform when it and every traversable cell around it
+        cost 1 to enter. Jumps only run through uniform cells and stop on
+        the first cell that is not, so the pruning rules, which assume
+        equal costs, never look past a uniform neighbourhood; the cells
+        where they stop are expanded with all their neighbours. Paths
+        have the same cost as those of the Pathfinder's A*.
+
+        For each of the eight directions a byte table marks the cells a
+        jump in that direction has to stop on: blocked, not uniform or
+        with a forced neighbour. Straight jumps are then a bytes.find()
+        along a row (or a column of the transposed table) and diagonal
+        jumps test one table byte per step. The tables are rebuilt with
+        vectorized operations when the topology version changes.
+    '''
+
+    def __init__(self, level_map):
+        self.level_map = level_map
+        self._version = None
+        self._adjacency = None
+
+    def applies(self, start, goal):
+        return isinstance(self.level_map.adjacency, GridAdjacency) and start[2] == goal[2]
+
+    def _refresh(self):
+        level_map = self.level_map
+        adjacency = level_map.adjacency
+        if adjacency is self._adjacency and level_map.topology_version == self._version:
+            return
+        self._adjacency = adjacency
+        self._version = level_map.topology_version
+
+        walk = adjacency.traversable
+        cheap = ~walk | (level_map.grid.movement_cost == 1)
+        uniform = walk & cheap
+        for dx, dy in NEIGHBOR_OFFSETS:
+            uniform &= _shift(cheap, dx, dy, fill=True)
+        self.uniform = uniform
+        self._flat_uniform = memoryview(uniform.reshape(-1))
+
+        def at(dx, dy):
+            return _shift(walk, dx, dy)
+
+        blocked = ~uniform
+        stops = {}
+        for dx, dy in NEIGHBOR_OFFSETS:
+            if dx and dy:
+                forced = (at(-dx, dy) & ~at(-dx, 0)) | (at(dx, -dy) & ~at(0, -dy))
+            elif dx:
+                forced = (at(dx, 1) & ~at(0, 1)) | (at(dx, -1) & ~at(0, -1))
+            else:
+                forced = (at(1, dy) & ~at(1, 0)) | (at(-1, dy) & ~at(-1, 0))
+            stop = (blocked | forced).astype(np.uint8)
+            if not dx:
+                # Columns are searched in a (z, x, y) copy
+                stop = stop.transpose(0, 2, 1)
+            stops[dx, dy] = np.ascontiguousarray(stop).tobytes()
+        self._stops = stops
+
+    def find(self, start, goal):
+        ''' Returns the reversed path from start to goal, or False '''
+
+        self._refresh()
+        adjacency = self._adjacency
+        source, target = adjacency.node(start), adjacency.node(goal)
+        if source is None or target is None:
+            return False
+
+        depth, height, width = adjacency.grid.shape
+        plane = height * width
+        base = start[2] * plane
+        walk = adjacency._flat_traversable
+        uniform = self._flat_uniform
+        cost = adjacency._flat_cost
+        stops = self._stops
+        gx, gy = goal[0], goal[1]
+
+        def walkable(x, y):
+            return 0 <= x < width and 0 <= y < height and walk[base + y * width + x]
+
+        def straight(x, y, dx, dy):
+            # Next jump point from (x, y) along a row or column as
+            # (node, steps taken), or None
+            table = stops[dx, dy]
+            if dx:
+                row = base + y * width
+                here = row + x
+                if dx > 0:
+                    stop = table.find(1, here + 1, row + width)
+                    if gy == y and x < gx and (stop < 0 or row + gx <= stop):
+                        return target, gx - x
+                else:
+                    stop = table.rfind(1, row, here)
+                    if gy == y and gx < x and row + gx >= stop:
+                        return target, x - gx
+                if stop < 0 or not walk[stop]:
+                    return None
+                return stop, abs(stop - here)
+            column = base + x * height
+            here = column + y
+            if dy > 0:
+                stop = table.find(1, here + 1, column + height)
+                if gx == x and y < gy and (stop < 0 or column + gy <= stop):
+                    return target, gy - y
+            else:
+                stop = table.rfind(1, column, here)
+                if gx == x and gy < y and column + gy >= stop:
+                    return target, y - gy
+            if stop < 0:
+                return None
+            node = base + (stop - column) * width + x
+            if not walk[node]:
+                return None
+            return node, abs(stop - here)
+
+        def jump(x, y, dx, dy):
+            # Next jump point from (x, y) in direction (dx, dy) as
+            # (node, steps taken), or None
+            if not (dx and dy):
+                return straight(x, y, dx, dy)
+            table = stops[dx, dy]
+            steps = 0
+            while True:
+                x += dx
+                y += dy
+                steps += 1
+                if not (0 <= x < width and 0 <= y < height):
+                    return None
+                node = base + y * width + x
+                if not walk[node]:
+                    return None
+                if node == target or table[node]:
+                    return node, steps
+                if straight(x, y, dx, 0) or straight(x, y, 0, dy):
+                    return node, steps
+
+        def directions(x, y, dx, dy):
+            # Natural and forced directions after arriving moving (dx, dy)
+            if dx and dy:
+                found = [(dx, dy), (dx, 0), (0, dy)]
+                if not walkable(x - dx, y) and walkable(x - dx, y + dy):
+                    found.append((-dx, dy))
+                if not walkable(x, y - dy) and walkable(x + dx, y - dy):
+                    found.append((dx, -dy))
+            elif dx:
+                found = [(dx, 0)]
+                for side in (1, -1):
+                    if not walkable(x, y + side) and walkable(x + dx, y + side):
+                        found.append((dx, side))
+            else:
+                found = [(0, dy)]
+                for side in (1, -1):
+                    if not walkable(x + side, y) and walkable(x + side, y + dy):
+                        found.append((side, dy))
+            return found
+
+        def successors(node, parent):
+            x, y = node % width, (node - base) // width
+            if not uniform[node]:
+                # Weighted A* step: every neighbour, no pruning
+                return adjacency.edges(node)
+            if parent is None:
+                moves = NEIGHBOR_OFFSETS
+            else:
+                px, py = parent % width, (parent - base) // width
+                moves = directions(x, y, _sign(x - px), _sign(y - py))
+            found = []
+            for dx, dy in moves:
+                result = jump(x, y, dx, dy)
+                if result is not None:
+                    point, steps = result
+                    step = abs(dx) + abs(dy)
+                    found.append((point, (steps - 1) * step + step * cost[point]))
+            return found
+
+        def heuristic(node):
+            return abs(node % width - gx) + abs((node - base) // width - gy)
+
+        tie_breaker = count()
+        open_heap = [(heuristic(source), next(tie_breaker), source)]
+        came_from = {}
+        g_score = {source: 0}
+        closed_set = set()
+        while open_heap:
+            _, _, current = heappop(open_heap)
+            if current in closed_set:
+                continue
+            if current == target:
+                return self._reconstruct(came_from, current, width, start[2])
+            closed_set.add(current)
+
+            current_score = g_score[current]
+            for point, edge_cost in successors(current, came_from.get(current)):
+                if point in closed_set:
+                    continue
+                score = current_score + edge_cost
+                if score >= g_score.get(point, Infinity):
+                    continue
+                came_from[point] = current
+                g_score[point] = score
+                heappush(open_heap, (score + heuristic(point), next(tie_breaker), point))
+        return False
+
+    def _reconstruct(self, came_from, node, width, z):
+        # Fill in the cells between consecutive jump points
+        height = self._adjacency.grid.shape[1]
+        path = []
+        while True:
+            x, y = node % width, node // width % height
+            path.append((x, y, z))
+            parent = came_from.get(node)
+            if parent is None:
+                return path
+            px, py = parent % width, parent // width % height
+            dx, dy = _sign(px - x), _sign(py - y)
+            while (x + dx, y + dy) != (px, py):
+                x += dx
+                y += dy
+                path.append((x, y, z))
+            node = parent
@@ -1,17 +1,31 @@
 #!/usr/bin/env python3
 #-*- coding: utf-8 -*-
 
+import os
 import sys
 import pickle
+import shutil
+import tempfile
 import random
 import pygame
 import argparse
 import copy
+import numpy as np
 #import pdb
 
-from .models import MapTile
+from .models import MapCell
 from .tiles import TileFactory, ItemFactory
 from .load_tilemap import TileCache
+from .graph import AdjacencyGraph, GridAdjacency, ChunkAdjacency
+from .grid import TileGrid
+from .chunks import ChunkedGrid, CHUNK_SIZE
+from .mapfile import MapFile, MapPlanes, is_map_file, char_planes, write_planes
+from .generator import MapGenerator
+from .autotile import EDGE_PIECES, EDGE_LUT, cell_mask, grid_masks
+from .items import ItemIndex
+from .needs import NeedMaps
+from .fov import FieldOfView
+from .lighting import Lighting
 
 this = sys.modules[__name__]
 MAX_X = 60
@@ -37,10 +51,10 @@ def save_test():
         pickle.dump(test_level, outfile)
 
 
-def random_size():
+def random_size(rng=random):
     # return a random x/y dimension pair where:
     # MAX_X/2 < x < MAX_X; MAX_Y/2 < y < MAX_Y
-    return tuple(map(random.choice,
+    return tuple(map(rng.choice,
         [range(int(v-(v/2)),v) for v in [MAX_X, MAX_Y]]))
 
 
@@ -55,14 +69,40 @@ def translate_map(char_map, db_path):
     return out_map
 
 
+def translate_grid(char_map, db_path):
+    return TileGrid.from_chars(char_map, TileFactory(db_path).prototypes)
+
+
+def palette_kinds(palette, db_path):
+    prototypes = TileFactory(db_path).prototypes
+    try:
+        return [prototypes[char] for char in palette]
+    except KeyError as e:
+        raise KeyError('Unknown tile character {} in the map palette'.format(e))
+
+
+def translate_map_file(map_file, db_path):
+    # The grid uses the tile id planes of the file (or of any MapPlanes)
+    # as its type ids
+    kinds = palette_kinds(map_file.palette, db_path)
+    return TileGrid.from_ids(map_file.tiles, kinds, map_file.present)
+
+
 class LevelMap:
     def __init__(self, tile_map, level_map='../data/test_map', **kwargs):
-        ''' The LevelMap class requires a filename and accommodates
-        several keyword arguments for customized tilemap scale and size
+        ''' The LevelMap class requires a filename (or a MapGenerator)
+        and accommodates several keyword arguments for customized
+        tilemap scale and size
 
         width:      tile width in pixels (default=16)
         height:     tile height in pixels (default=16)
         margin:     margin between tiles in pixels (default=1)
+        storage:    'dict' for a MapCell per position, 'grid' for dense
+                    NumPy arrays, 'chunked' for chunks of NumPy arrays
+                    loaded on first use (default='dict')
+        chunk_size: cells per side of a chunk (default=32)
+        chunk_budget: bytes of chunks kept in memory before the least
+                    recently used are evicted (default=64MiB)
         '''
 
         if 'width' not in kwargs:
@@ -72,7 +112,14 @@ class LevelMap:
             kwargs['height'] = 16
         if 'margin' not in kwargs:
             kwargs['margin'] = 1
+        if 'storage' not in kwargs:
+            kwargs['storage'] = 'dict'
+        if 'chunk_size' not in kwargs:
+            kwargs['chunk_size'] = CHUNK_SIZE
+        if 'chunk_budget' not in kwargs:
+            kwargs['chunk_budget'] = 64 << 20
         assert 'db_path' in kwargs
+        assert kwargs['storage'] in ('dict', 'grid', 'chunked')
 
         w = kwargs['width']
         h = kwargs['height']
@@ -86,8 +133,25 @@ class LevelMap:
         self.cache = TileCache(w, h, m)
         self._raw_map = None
         self._real_map = None
+        self.grid = None    # TileGrid when using grid storage
+        self.chunks = None  # ChunkedGrid when using chunked storage
+        self._tile_images = {}
+        self._atlas = []            # Every tile image, edge pieces included
+        self._piece_atlas = {}      # TileType -> atlas index per edge piece
+        self._edge_index = None     # Resolved atlas index per position
         self._trash = []
         self.item_list = []
+        self.item_index = ItemIndex()
+        self.adjacency = None
+        self._listeners = []
+        self._topology_listeners = []
+        self.need_maps = NeedMaps(self)
+        self.fov = FieldOfView(self)
+        self.lighting = Lighting(self)
+
+        # Bumped whenever passability, doors or movement costs change so
+        # cached paths can tell they are stale
+        self.topology_version = 0
 
     def __getitem__(self, position):
         try:
@@ -99,19 +163,100 @@ class LevelMap:
             raise
 
     def __setitem__(self, position, tile):
-        assert isinstance(tile, MapTile), 'tile is not a MapTile instance'
+        assert isinstance(tile, MapCell), 'tile is not a MapCell instance'
         assert hasattr(self, '_real_map'), 'Map is not loaded'
         assert position in self._real_map, 'Position does not exist'
         self._real_map[position] = tile
+        self._add_kind(tile.kind)
+        x, y, z = position
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                if self.in_map((x+dx, y+dy, z)):
+                    self._resolve_cell_edges((x+dx, y+dy, z))
+        self._topology_changed(position)
+        self._changed(position)
+
+    def add_listener(self, callback):
+        ''' Register callback(position), called whenever a tile or
+            map-level item changes
+        '''
+        self._listeners.append(callback)
+
+    def _changed(self, position):
+        for callback in self._listeners:
+            callback(position)
 
-    def _save_map(self):
+    def add_topology_listener(self, callback):
+        ''' Register callback(position), called after the passability or
+            movement cost at position changed and the adjacency was repaired
+        '''
+        self._topology_listeners.append(callback)
+
+    def _topology_changed(self, position):
+        # Repair the adjacency rows leading into position and invalidate
+        # anything derived from the old topology
+        if self.adjacency is not None:
+            self.adjacency.update(position)
+        self.topology_version += 1
+        for callback in self._topology_listeners:
+            callback(position)
+
+    def _save_map(self, path=None):
+        ''' Save the map to path, by default the file it was loaded from
+
+            Maps read from tile id planes, map files and generated worlds,
+            are saved as map files of their current tiles. The new file is
+            written beside path and then moved over it, so a map file this
+            LevelMap still has mapped is never truncated under it.
+        '''
+        if path is None:
+            path = self.level_map
+        if not isinstance(path, (str, bytes, os.PathLike)):
+            raise ValueError('Generated maps have no file, give a path to save them to')
+        if isinstance(self._raw_map, MapPlanes):
+            palette, tiles, present = self._tile_planes()
+            fd, temp_path = tempfile.mkstemp(suffix='.vzm', dir=os.path.dirname(os.path.abspath(path)))
+            os.close(fd)
+            try:
+                if os.path.exists(path):
+                    shutil.copymode(path, temp_path)
+                write_planes(temp_path, palette, tiles, self._raw_map.items, present)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            return
         try:
-            with open(self.level_map, 'wb') as outfile:
+            with open(path, 'wb') as outfile:
                 pickle.dump(self._raw_map, outfile)
         except pickle.PicklingError:
             raise
 
+    def _tile_planes(self):
+        # (palette, tiles, present) of the current tiles, the palette
+        # being the characters of the kinds the tile ids index into
+        if self.grid is not None:
+            grid = self.grid
+            return [kind.char for kind in grid.kinds], grid.type_id, grid.present
+        if self.chunks is not None:
+            chunks = self.chunks
+            return [kind.char for kind in chunks.kinds], chunks.tile_ids(), chunks._present
+        width, height, depth = self.bounds
+        kind_ids = {}
+        tiles = np.zeros((depth, height, width), np.uint16)
+        present = np.zeros((depth, height, width), np.bool_)
+        for (x, y, z), tile in self._real_map.items():
+            tiles[z, y, x] = kind_ids.setdefault(tile.kind, len(kind_ids))
+            present[z, y, x] = True
+        return [kind.char for kind in kind_ids], tiles, present
+
     def _open_map(self):
+        # Generated worlds come as tile id planes, binary map files are
+        # mapped, older maps are pickled dicts
+        if isinstance(self.level_map, MapGenerator):
+            return self.level_map.generate()
+        if is_map_file(self.level_map):
+            return MapFile(self.level_map)
         try:
             with open(self.level_map, 'rb') as infile:
                 return pickle.load(infile)
@@ -127,31 +272,44 @@ class LevelMap:
         return self._neighbors(point)
 
     def _neighbors(self, point):
-        x, y, z = point
-        positions = [(x+1, y, z), (x-1, y, z), (x+1, y+1, z),
-                (x+1, y-1, z), (x-1, y+1, z), (x-1, y-1, z),
-                (x, y+1, z), (x, y-1, z)]
-        base_list = [p for p in positions if self.in_map(p) and self[p].passable]
-        for p in positions:
-            if self.has_opening(p):
-                base_list.append(p)
-        return base_list
+        return self.adjacency.neighbors(point)
 
     def has_opening(self, position):
         # Determine whether a blocked tile has an opening object like
         # a door or tunnel
-        for i in self.item_list:
-            if i.item_type == 'door' and i.position == position:
-                if not i.locked:
-                    return True
+        for i in self.item_index.at(position):
+            if i.item_type == 'door' and not i.locked:
+                return True
         return False
 
-    def explore(self, position_list):
-        #pdb.set_trace()
-        for position in position_list:
-            self[position].explored = True
-            for pos in self._neighbors(position):
-                self[pos].explored = True
+    def openings(self):
+        # Positions of every unlocked door or tunnel on the map
+        return {i.position for i in self.item_index.of_type('door') if not i.locked}
+
+    def set_blocking(self, position, blocking):
+        self[position].blocking = blocking
+        self._topology_changed(position)
+        self._changed(position)
+
+    def set_movement_cost(self, position, movement_cost):
+        self[position].movement_cost = movement_cost
+        self._topology_changed(position)
+        self._changed(position)
+
+    def set_locked(self, item, locked):
+        # Lock or unlock a door/container, keeping the door's tile
+        # passability in step with it
+        item.locked = locked
+        if item.item_type == 'door' and item.container is None:
+            self.set_blocking(item.position, locked)
+
+    def explore(self, viewers):
+        ''' Update the field of view from viewers, a dict of key ->
+            ((x, y, z), sight radius), marking every cell in sight as
+            explored; returns the boxes of cells whose visibility may
+            have changed, see FieldOfView.update()
+        '''
+        return self.fov.update(viewers)
 
     def _load_tiles(self):
         self._tiles = self.cache[self.tile_map]
@@ -159,38 +317,47 @@ class LevelMap:
 
     def _populate_map(self):
         print('[!] Populating the map and items')
-        map_dict = self._open_map()
-        self._raw_map = map_dict['tiles']
-        self._item_map = map_dict['items']
-        self._real_map = translate_map(self._raw_map, self.kwargs['db_path'])
-
-        for position in self._real_map:
-            map_tile = self._real_map[position]
-            if '_' in map_tile.name:
-                map_tile.tile_type = map_tile.name.split('_')[0]
+        map_data = self._open_map()
+        storage = self.kwargs['storage']
+        if storage == 'chunked':
+            # Chunks are cut from the tile id planes, generated, mapped
+            # from a map file or translated from the pickled rows
+            if isinstance(map_data, MapPlanes):
+                palette, tiles, present = map_data.palette, map_data.tiles, map_data.present
+                self._item_map = map_data.items
+            else:
+                palette, tiles, present = char_planes(map_data['tiles'])
+                self._item_map = map_data['items']
+            self._raw_map = map_data
+            self.chunks = ChunkedGrid(palette_kinds(palette, self.kwargs['db_path']),
+                    tiles, present, self.kwargs['chunk_size'], self.kwargs['chunk_budget'])
+            self._real_map = self.chunks
+        elif isinstance(map_data, MapPlanes):
+            self._raw_map = map_data
+            self._item_map = map_data.items
+            if self.kwargs['storage'] == 'grid':
+                self.grid = translate_map_file(map_data, self.kwargs['db_path'])
             else:
-                map_tile.tile_type = map_tile.name
-            y, x = map_tile.tile_row, map_tile.tile_col
-            self._real_map[position].image = self.tile_image(y, x)
-            if map_tile.has_edges:
-                if map_tile.tile_type == 'water':
-                    map_tile.top_right_corner = self.tile_image(y+1, x-3)
-                    map_tile.top_left_corner = self.tile_image(y+1, x-2)
-                    map_tile.bot_right_corner = self.tile_image(y, x-3)
-                    map_tile.bot_left_corner = self.tile_image(y, x-2)
-                else:
-                    map_tile.top_right_corner = self.tile_image(y, x-3)
-                    map_tile.top_left_corner = self.tile_image(y, x-2)
-                    map_tile.bot_right_corner = self.tile_image(y-1, x-3)
-                    map_tile.bot_left_corner = self.tile_image(y-1, x-2)
-                map_tile.top_left_image = self.tile_image(y-1, x-1)
-                map_tile.top_image = self.tile_image(y-1, x)
-                map_tile.top_right_image = self.tile_image(y-1, x+1)
-                map_tile.left_image = self.tile_image(y, x-1)
-                map_tile.right_image = self.tile_image(y, x+1)
-                map_tile.bot_left_image = self.tile_image(y+1, x-1)
-                map_tile.bot_image = self.tile_image(y+1, x)
-                map_tile.bot_right_image = self.tile_image(y+1, x+1)
+                self._real_map = translate_map(map_data.char_map(), self.kwargs['db_path'])
+        else:
+            self._raw_map = map_data['tiles']
+            self._item_map = map_data['items']
+            if self.kwargs['storage'] == 'grid':
+                self.grid = translate_grid(self._raw_map, self.kwargs['db_path'])
+            else:
+                self._real_map = translate_map(self._raw_map, self.kwargs['db_path'])
+        if self.grid is not None:
+            self._real_map = self.grid
+            kinds = self.grid.kinds_in_use()
+        elif self.chunks is not None:
+            kinds = self.chunks.kinds_in_use()
+        else:
+            kinds = {map_tile.kind for map_tile in self._real_map.values()}
+
+        # Tile images are resolved once per TileType and shared by its cells
+        self._tile_images = {}
+        for kind in kinds:
+            self._add_kind(kind)
 
         items = []
         item_factory = ItemFactory(self.kwargs['db_path'])
@@ -214,11 +381,96 @@ class LevelMap:
         self.ready = True
         return items
 
+    def _add_kind(self, kind):
+        # Load the images of a TileType and append its edge pieces to the atlas
+        if kind in self._tile_images:
+            return
+        images = self._kind_images(kind)
+        self._tile_images[kind] = images
+        indexes = []
+        for name in EDGE_PIECES:
+            indexes.append(len(self._atlas))
+            self._atlas.append(images.get(name, images['image']))
+        self._piece_atlas[kind] = indexes
+
+    def _resolve_edges(self):
+        ''' Resolve the edge piece of every tile into an atlas index '''
+
+        if self.chunks is not None:
+            # Resolved when drawn, see get_maptile_image()
+            self._edge_index = None
+            return
+        if self.grid is None:
+            self._edge_index = {}
+            for position in self._real_map:
+                self._resolve_cell_edges(position)
+            return
+
+        grid = self.grid
+        groups = {}
+        group_table = np.array([groups.setdefault(kind.tile_type, len(groups))
+            for kind in grid.kinds], np.int32)
+        pieces = EDGE_LUT[grid_masks(group_table[grid.type_id], grid.present)]
+        pieces[~grid.kind_table('has_edges', np.bool_)[grid.type_id]] = 0
+
+        atlas_table = np.zeros((len(grid.kinds), len(EDGE_PIECES)), np.uint16)
+        for n, kind in enumerate(grid.kinds):
+            if kind in self._piece_atlas:
+                atlas_table[n] = self._piece_atlas[kind]
+        self._edge_index = atlas_table[grid.type_id, pieces]
+
+    def _resolve_cell_edges(self, position):
+        if self.chunks is not None:
+            return
+        tile = self[position]
+        piece = EDGE_LUT[cell_mask(self, position)] if tile.has_edges else 0
+        index = self._piece_atlas[tile.kind][piece]
+        if self.grid is not None:
+            x, y, z = position
+            self._edge_index[z, y, x] = index
+        else:
+            self._edge_index[position] = index
+
+    def _kind_images(self, kind):
+        y, x = kind.tile_row, kind.tile_col
+        images = {'image': self.tile_image(y, x)}
+        if kind.has_edges:
+            if kind.tile_type == 'water':
+                images['top_right_corner'] = self.tile_image(y+1, x-3)
+                images['top_left_corner'] = self.tile_image(y+1, x-2)
+                images['bot_right_corner'] = self.tile_image(y, x-3)
+                images['bot_left_corner'] = self.tile_image(y, x-2)
+            else:
+                images['top_right_corner'] = self.tile_image(y, x-3)
+                images['top_left_corner'] = self.tile_image(y, x-2)
+                images['bot_right_corner'] = self.tile_image(y-1, x-3)
+                images['bot_left_corner'] = self.tile_image(y-1, x-2)
+            images['top_left_image'] = self.tile_image(y-1, x-1)
+            images['top_image'] = self.tile_image(y-1, x)
+            images['top_right_image'] = self.tile_image(y-1, x+1)
+            images['left_image'] = self.tile_image(y, x-1)
+            images['right_image'] = self.tile_image(y, x+1)
+            images['bot_left_image'] = self.tile_image(y+1, x-1)
+            images['bot_image'] = self.tile_image(y+1, x)
+            images['bot_right_image'] = self.tile_image(y+1, x+1)
+        return images
+
     def prepare(self):
         # Load the tile_map, level_map, and make sure all is ready
         try:
             self._load_tiles()
             self.item_list = self._populate_map()
+            self.item_index.rebuild(self.item_list)
+            self._resolve_edges()
+            if self.grid is not None:
+                self.adjacency = GridAdjacency(self)
+            elif self.chunks is not None:
+                self.adjacency = ChunkAdjacency(self)
+            else:
+                self.adjacency = AdjacencyGraph(self)
+            self.need_maps.clear()
+            self.fov.clear()
+            self.lighting.clear()
             self.default_tile = self._tiles[1, 5]
         except:
             if not self.loaded:
@@ -235,95 +487,65 @@ class LevelMap:
     @items.setter
     def items(self, item):
         self.item_list.append(item)
+        self.item_index.add(item)
+        if item.item_type == 'door':
+            self._topology_changed(item.position)
+        self._changed(item.position)
 
     def find_item(self, item_type=None, item_name=None, position=None):
         if position is not None:
-            return [item for item in self.item_list if item.position==position]
-        retval = []
-        for item in self.item_list:
-            if item_name is not None:
-                if item.name == item_name:
-                    retval.append(item)
-            elif item_type is not None:
-                if item.item_type == item_type:
-                    retval.append(item)
-        return retval
+            return list(self.item_index.at(position))
+        if item_name is not None:
+            return [item for item in self.item_list if item.name == item_name]
+        if item_type is not None:
+            return list(self.item_index.of_type(item_type))
+        return []
 
     def trash_item(self, item, store=False):
         if item not in self._trash and store:
             self._trash.append(item)
         self.items.remove(item)
+        self.item_index.remove(item)
+        if item.item_type == 'door':
+            self._topology_changed(item.position)
+        self._changed(item.position)
 
     def get_maptile_image(self, tile):
-        return self._check_edges(tile)
-
-    def _check_edges(self, tile):
-        if not tile.has_edges:
-            return tile.image
+        x, y, z = tile.position
+        if self.chunks is not None:
+            piece = EDGE_LUT[cell_mask(self, tile.position)] if tile.has_edges else 0
+            return self._atlas[self._piece_atlas[tile.kind][piece]]
+        if self.grid is not None:
+            return self._atlas[self._edge_index[z, y, x]]
+        return self._atlas[self._edge_index[x, y, z]]
+
+    def level_tile_blits(self, depth, tile_w, tile_h, box=None, scale=None):
+        ''' (image, (x_px, y_px)) of every tile on a z-level, or in the
+            (x0, y0, x1, y1) box of it, ready for Surface.blits()
+
+            Pixels are counted from the corner of the box. scale, when
+            given, maps each tile image to the one drawn instead.
+        '''
+        width, height, _ = self.bounds
+        x0, y0, x1, y1 = box if box is not None else (0, 0, width, height)
+        if self.grid is not None:
+            # Straight from the resolved atlas indexes, no per-cell lookups
+            atlas = self._atlas if scale is None else [scale(image) for image in self._atlas]
+            ys, xs = np.nonzero(self.grid.present[depth, y0:y1, x0:x1])
+            images = map(atlas.__getitem__, self._edge_index[depth, ys + y0, xs + x0].tolist())
+            return list(zip(images, zip((xs * tile_w).tolist(), (ys * tile_h).tolist())))
+        if box is None:
+            positions = self.level_positions(depth)
         else:
-            x, y, z = tile.position
-
-            # Gather tile types
-            if (x, y-1, z) in self.world_map:
-                tile_top = self[x, y-1, z].tile_type
-            else:
-                tile_top = tile.tile_type
-            if (x+1, y-1, z) in self.world_map:
-                tile_top_right = self[x+1, y-1, z].tile_type
-            else:
-                tile_top_right = tile.tile_type
-            if (x-1, y-1, z) in self.world_map:
-                tile_top_left = self[x-1, y-1, z].tile_type
-            else:
-                tile_top_left = tile.tile_type
-            if (x-1, y, z) in self.world_map:
-                tile_left = self[x-1, y, z].tile_type
-            else:
-                tile_left = tile.tile_type
-            if (x+1, y, z) in self.world_map:
-                tile_right = self[x+1, y, z].tile_type
-            else:
-                tile_right = tile.tile_type
-            if (x, y+1, z) in self.world_map:
-                tile_bot = self[x, y+1, z].tile_type
-            else:
-                tile_bot = tile.tile_type
-            if (x+1, y+1, z) in self.world_map:
-                tile_bot_right = self[x+1, y+1, z].tile_type
-            else:
-                tile_bot_right = tile.tile_type
-            if (x-1, y+1, z) in self.world_map:
-                tile_bot_left = self[x-1, y+1, z].tile_type
-            else:
-                tile_bot_left = tile.tile_type
-
-            # Return appropriate edge tile image
-            if tile.tile_type != tile_top_right and tile.tile_type == tile_top and tile.tile_type == tile_right:
-                return tile.top_right_corner
-            elif tile.tile_type != tile_top_left and tile.tile_type == tile_top and tile.tile_type == tile_left:
-                return tile.top_left_corner
-            elif tile.tile_type != tile_bot_right and tile.tile_type == tile_bot and tile.tile_type == tile_right:
-                return tile.bot_right_corner
-            elif tile.tile_type != tile_bot_left and tile.tile_type == tile_bot and tile.tile_type == tile_left:
-                return tile.bot_left_corner
-            elif tile.tile_type != tile_right and tile.tile_type != tile_top:
-                return tile.top_right_image
-            elif tile.tile_type != tile_right and tile.tile_type != tile_bot:
-                return tile.bot_right_image
-            elif tile.tile_type != tile_left and tile.tile_type != tile_top:
-                return tile.top_left_image
-            elif tile.tile_type != tile_left and tile.tile_type != tile_bot:
-                return tile.bot_left_image
-            elif tile.tile_type != tile_right:
-                return tile.right_image
-            elif tile.tile_type != tile_left:
-                return tile.left_image
-            elif tile.tile_type != tile_top:
-                return tile.top_image
-            elif tile.tile_type != tile_bot:
-                return tile.bot_image
-            else:
-                return tile.image
+            positions = [(x, y, depth) for y in range(y0, y1) for x in range(x0, x1)
+                    if self.in_map((x, y, depth))]
+        blits = []
+        for p in positions:
+            image = self.get_maptile_image(self[p])
+            if scale is not None:
+                image = scale(image)
+            blits.append((image, ((p[0] - x0) * tile_w, (p[1] - y0) * tile_h)))
+        return blits
 
     def tile_image(self, y, x):
         # Note the reversed order
@@ -333,13 +555,33 @@ class LevelMap:
     def world_map(self):
         return self._real_map
 
+    @property
+    def bounds(self):
+        ''' (width, height, depth) of the map in cells '''
+
+        if self.grid is not None or self.chunks is not None:
+            depth, height, width = self._real_map.shape
+            return width, height, depth
+        xs, ys, zs = zip(*self._real_map)
+        return max(xs) + 1, max(ys) + 1, max(zs) + 1
+
+    def level_positions(self, depth):
+        ''' Yields the positions present on a single z-level '''
+
+        if self.grid is not None or self.chunks is not None:
+            yield from self._real_map.level_positions(depth)
+        else:
+            for p in self._real_map:
+                if p[2] == depth:
+                    yield p
+
     @property
     def level(self):
         return self._depth
 
     @level.setter
     def level(self, depth):
-        assert [pt for pt in self._real_map if pt[2] == depth]
+        assert any(True for pt in self.level_positions(depth))
         self._depth = depth
 
 
@@ -368,11 +610,10 @@ if __name__ == '__main__':
             db_path=db_path)
     level_map.prepare()
 
-    for p in level_map.world_map:
-        if p[2] == level_map.level:
-            x_loc = p[0] * cli_args.width
-            y_loc = p[1] * cli_args.height
-            screen.blit(level_map[p].image, (x_loc, y_loc))
+    for p in level_map.level_positions(level_map.level):
+        x_loc = p[0] * cli_args.width
+        y_loc = p[1] * cli_args.height
+        screen.blit(level_map.get_maptile_image(level_map[p]), (x_loc, y_loc))
     pygame.display.flip()
 
     while pygame.event.wait().type != pygame.locals.QUIT:
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Light propagation. Every light source lights the cells it can see within
+# its radius, fading with distance, and walls cast shadows the same way
+# they block sight. The light of a level is the brightest source reaching
+# each cell, kept in a (z, y, x) intensity array; when a source is added,
+# moved, switched off or a wall opens near it, only the box around it is
+# lit again. Daylight is a per-level floor on top of that array, so the sun
+# moving across the sky changes a number instead of every cell.
+
+from collections import namedtuple
+
+import numpy as np
+
+from .chunks import BlockArray
+from .fov import shadowcast
+
+# Full brightness of a cell
+FULL_LIGHT = 255
+
+# Light of the night sky on the surface, between none and FULL_LIGHT
+NIGHT_LIGHT = 40
+
+# Dawn and dusk brighten and darken the sky in this many steps
+TWILIGHT_STEPS = 16
+
+# (radius, intensity) of the light given off by items of these names
+ITEM_LIGHTS = {
+    'torch': (6, 220),
+    'lantern': (8, 255),
+    'campfire': (10, 255),
+    }
+
+LightSource = namedtuple('LightSource', ['position', 'radius', 'intensity', 'box', 'light'])
+
+
+def daylight(hour, minute=0):
+    ''' Light of the surface sky at a time of day, NIGHT_LIGHT from 8pm to
+        5am, rising to FULL_LIGHT by 8am and fading again from 5pm, in
+        TWILIGHT_STEPS steps
+    '''
+    time = hour + minute / 60
+    if 8 <= time < 17:
+        share = 1.0
+    elif 5 <= time < 8:
+        share = (time - 5) / 3
+    elif 17 <= time < 20:
+        share = (20 - time) / 3
+    else:
+        share = 0.0
+    share = round(share * TWILIGHT_STEPS) / TWILIGHT_STEPS
+    return int(NIGHT_LIGHT + share * (FULL_LIGHT - NIGHT_LIGHT))
+
+
+class Lighting:
+
+    ''' Light intensity of every cell of a LevelMap, from its light sources
+
+        Sources are added with set() under any hashable key and taken away
+        with remove(); setting a key again moves or changes that source.
+        Each keeps the light it casts over its box, so when one changes
+        its box is cleared and relit from the sources overlapping it
+        without casting any of them again. Light sources never reach
+        through opaque cells, as told by the map's FieldOfView.
+
+        intensity holds the light of the sources alone and ambient the
+        daylight of each level, only the surface (z=0) is under the sky;
+        brightness() combines the two. With grid storage intensity is the
+        light array of the TileGrid, with chunked storage a BlockArray
+        holding blocks only where light falls. Items named in ITEM_LIGHTS
+        give off light while on the map and out of any container, followed
+        through the ItemIndex as they are moved, picked up or destroyed.
+    '''
+
+    def __init__(self, level_map):
+        self.level_map = level_map
+        self.intensity = None
+        self.ambient = None
+        self._sources = {}      # key -> LightSource
+        self._touched = []      # boxes to relight, from opacity changes
+        self._relit = []        # boxes relit for item changes, for update()
+        level_map.add_topology_listener(self._topology_changed)
+        level_map.item_index.add_listener(self._item_changed)
+
+    def clear(self):
+        ''' Drop every source and light the items of the map again '''
+
+        level_map = self.level_map
+        width, height, depth = level_map.bounds
+        if level_map.grid is not None:
+            self.intensity = level_map.grid.light
+            self.intensity[...] = 0
+        elif level_map.chunks is not None:
+            self.intensity = BlockArray((depth, height, width), np.uint8,
+                    block_size=level_map.chunks.chunk_size)
+        else:
+            self.intensity = np.zeros((depth, height, width), np.uint8)
+        self.ambient = np.zeros(depth, np.uint8)
+        self.ambient[0] = FULL_LIGHT
+        self._sources = {}
+        self._touched = []
+        for item in level_map.items:
+            self._item_changed(item)
+        self._relit = []
+
+    def set_daylight(self, light):
+        ''' Set the light of the sky over the surface, returns True if it
+            changed
+        '''
+        if self.ambient[0] == light:
+            return False
+        self.ambient[0] = light
+        return True
+
+    def brightness(self, z, box=None):
+        ''' Light of the cells of level z, or of the (x0, y0, x1, y1) box
+            of it, with the daylight included
+        '''
+        if box is None:
+            _, height, width = self.intensity.shape
+            box = 0, 0, width, height
+        x0, y0, x1, y1 = box
+        return np.maximum(self.intensity[z, y0:y1, x0:x1], self.ambient[z])
+
+    def __contains__(self, key):
+        return key in self._sources
+
+    def __len__(self):
+        return len(self._sources)
+
+    def set(self, key, position, radius, intensity=FULL_LIGHT):
+        ''' Add or change the source key; returns the boxes relit, as
+            (z, x0, y0, x1, y1) with exclusive ends
+        '''
+        old = self._sources.get(key)
+        if old is not None and old[:3] == (position, radius, intensity):
+            return []
+        source = self._cast(position, radius, intensity)
+        self._sources[key] = source
+        boxes = [source.box] if old is None else [old.box, source.box]
+        for box in boxes:
+            self._relight(box)
+        return boxes
+
+    def remove(self, key):
+        ''' Take away the source key, if any; returns the boxes relit '''
+
+        source = self._sources.pop(key, None)
+        if source is None:
+            return []
+        self._relight(source.box)
+        return [source.box]
+
+    def update(self):
+        ''' Cast the sources again whose light an opacity change reached,
+            returns the boxes relit, along with those relit for items
+            since the last update
+        '''
+        touched, self._touched = self._touched, []
+        boxes, self._relit = self._relit, []
+        for key, source in list(self._sources.items()):
+            if any(_overlaps(source.box, box) for box in touched):
+                self._sources[key] = self._cast(*source[:3])
+                self._relight(source.box)
+                boxes.append(source.box)
+        return boxes
+
+    def _topology_changed(self, position):
+        if self.intensity is not None:
+            x, y, z = position
+            self._touched.append((z, x, y, x + 1, y + 1))
+
+    def _item_changed(self, item):
+        # Light, move or put out the source of an item giving off light
+        if self.intensity is None or item.name not in ITEM_LIGHTS:
+            return
+        key = 'item', id(item)
+        if item in self.level_map.item_index and item.container is None:
+            self._relit += self.set(key, item.position, *ITEM_LIGHTS[item.name])
+        else:
+            self._relit += self.remove(key)
+
+    def _cast(self, position, radius, intensity):
+        # The light of one source over its box, fading to nothing just
+        # past the radius
+        x, y, z = position
+        depth, height, width = self.intensity.shape
+        box = (z, max(0, x - radius), max(0, y - radius),
+                min(width, x + radius + 1), min(height, y + radius + 1))
+        _, x0, y0, x1, y1 = box
+
+        opaque = np.ascontiguousarray(self.level_map.fov.opaque[z, y0:y1, x0:x1]).view(np.uint8)
+        lit = np.zeros((y1 - y0, x1 - x0), np.bool_)
+        cells = np.fromiter(shadowcast(memoryview(opaque.reshape(-1)), x1 - x0, y1 - y0,
+                (x - x0, y - y0), radius), np.intp)
+        lit.reshape(-1)[cells] = True
+
+        ys, xs = np.ogrid[y0 - y:y1 - y, x0 - x:x1 - x]
+        fade = 1 - np.sqrt(xs * xs + ys * ys) / (radius + 1)
+        light = np.where(lit, np.clip(fade, 0, 1) * intensity, 0).astype(np.uint8)
+        return LightSource(position, radius, intensity, box, light)
+
+    def _relight(self, box):
+        # Clear the box and take the brightest source over each cell
+        z, x0, y0, x1, y1 = box
+        region = np.zeros((y1 - y0, x1 - x0), np.uint8)
+        for source in self._sources.values():
+            other = source.box
+            if not _overlaps(box, other):
+                continue
+            ox0, oy0 = max(x0, other[1]), max(y0, other[2])
+            ox1, oy1 = min(x1, other[3]), min(y1, other[4])
+            np.maximum(region[oy0 - y0:oy1 - y0, ox0 - x0:ox1 - x0],
+                    source.light[oy0 - other[2]:oy1 - other[2], ox0 - other[1]:ox1 - other[1]],
+                    out=region[oy0 - y0:oy1 - y0, ox0 - x0:ox1 - x0])
+        self.intensity[z, y0:y1, x0:x1] = region
+
+        level_map = self.level_map
+        if level_map.grid is None and level_map.chunks is None:
+            # Keep the MapCells in step
+            for y in range(y0, y1):
+                for x in range(x0, x1):
+                    tile = level_map[x, y, z]
+                    if tile is not None:
+                        tile.light = int(region[y - y0, x - x0])
+
+
+def _overlaps(a, b):
+    return a[0] == b[0] and a[1] < b[3] and b[1] < a[3] and a[2] < b[4] and b[2] < a[4]
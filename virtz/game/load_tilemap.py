@@ -24,14 +24,19 @@ def cli():
 class TileCache:
     """ Lazily load tilesets into the global cache """
 
+    # Shared by every TileCache, so each sheet is sliced and converted once
+    _cache = {}
+
     def __init__(self, width=16, height=None, margin=1):
         self.width = width
         self.height = height or width
         self.margin = margin
-        self._cache = {}
 
     def __getitem__(self, filename):
-        key = (filename, self.width, self.height)
+        # Tiles loaded before the display existed are not converted, so
+        # they are kept apart from the converted ones
+        converted = pygame.display.get_surface() is not None
+        key = (filename, self.width, self.height, self.margin, converted)
         try:
             return self._cache[key]
         except KeyError:
@@ -43,7 +48,9 @@ class TileCache:
 def load_tile_table(filename, w, h, m):
     ''' w=width(px), h=height(px), m=margin(px) '''
 
-    image = pygame.image.load(filename).convert_alpha()
+    image = pygame.image.load(filename)
+    # Headless runs have no display to convert the tiles for
+    converted = pygame.display.get_surface() is not None
     img_width, img_height = image.get_size()
     sheet_dims = (ceil(img_width / (w + m)),
             ceil(img_height / (h + m)))
@@ -54,7 +61,12 @@ def load_tile_table(filename, w, h, m):
             x_loc = x * (w + m)
             y_loc = y * (h + m)
             rect = (x_loc, y_loc, w, h)
-            tile_table[x,y] = image.subsurface(rect)
+            tile = image.subsurface(rect)
+            if converted:
+                # A standalone copy in the display pixel format blits
+                # faster than a subsurface of the sheet
+                tile = tile.convert_alpha()
+            tile_table[x,y] = tile
     return tile_table
 
 def split_dims(dim_str):
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Versioned binary level map format. A fixed header is followed by the tile
+# palette, the item table and then, at an allocation-granularity boundary,
+# the tile id planes of every z-level (and a presence plane for maps with
+# ragged rows). MapFile maps the planes instead of reading them, so opening
+# a map costs the same whatever its size and pages are read as they are
+# used.
+#
+# Convert a pickled map:  python -m game.mapfile data/test_map data/test_map.vzm
+
+import sys
+import mmap
+import pickle
+import struct
+import argparse
+
+import numpy as np
+
+this = sys.modules[__name__]
+
+MAGIC = b'VIRTZMAP'
+VERSION = 1
+
+# magic, version, bytes per tile id, flags, width, height, depth, palette
+# length in bytes, item count, offset of the first plane
+HEADER = struct.Struct('<8sHBBIIIHIQ')
+
+# Header flag: a presence plane follows the tile id planes
+RAGGED = 1
+
+# One row of the item table
+ITEM = np.dtype([('x', '<u4'), ('y', '<u4'), ('z', '<u4'), ('char', '<U1')])
+
+
+def is_map_file(path):
+    ''' True if path starts with the binary map file magic '''
+
+    try:
+        with open(path, 'rb') as infile:
+            return infile.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def write_planes(path, palette, tiles, items, present=None):
+    ''' Write a map file from an array of tile ids
+
+        palette is the list of tile characters the ids of tiles, shaped
+        (depth, height, width), index into. present marks the cells in
+        the map when not all of them are; items maps positions to item
+        characters.
+    '''
+    id_type = np.uint8 if len(palette) <= 1 << 8 else np.uint16
+    tiles = np.ascontiguousarray(tiles, id_type)
+    depth, height, width = tiles.shape
+    ragged = present is not None and not present.all()
+
+    palette_bytes = ''.join(palette).encode('utf-8')
+    table = np.array([(x, y, z, char) for (x, y, z), char in sorted(items.items())], ITEM)
+    offset = HEADER.size + len(palette_bytes) + table.nbytes
+    granularity = mmap.ALLOCATIONGRANULARITY
+    offset = -(-offset // granularity) * granularity
+
+    with open(path, 'wb') as outfile:
+        outfile.write(HEADER.pack(MAGIC, VERSION, tiles.itemsize, RAGGED if ragged else 0,
+                width, height, depth, len(palette_bytes), len(table), offset))
+        outfile.write(palette_bytes)
+        outfile.write(table.tobytes())
+        outfile.seek(offset)
+        outfile.write(tiles.tobytes())
+        if ragged:
+            outfile.write(np.ascontiguousarray(present, np.bool_).tobytes())
+
+
+def char_planes(char_map):
+    ''' (palette, tiles, present) of a map given as nested lists of row
+        strings, with the layout write_planes() takes
+    '''
+    depth = len(char_map)
+    height = max(len(level) for level in char_map)
+    width = max(len(row) for level in char_map for row in level)
+    palette = sorted({char for level in char_map for row in level for char in row})
+    codes = np.array([ord(char) for char in palette], np.uint32)
+
+    id_type = np.uint8 if len(palette) <= 1 << 8 else np.uint16
+    tiles = np.zeros((depth, height, width), id_type)
+    present = np.zeros((depth, height, width), np.bool_)
+    for z, level in enumerate(char_map):
+        for y, row in enumerate(level):
+            # Code points map to ids by their rank in the sorted palette
+            row_codes = np.frombuffer(row.encode('utf-32-le'), np.uint32)
+            tiles[z, y, :len(row)] = np.searchsorted(codes, row_codes)
+            present[z, y, :len(row)] = True
+    return palette, tiles, present
+
+
+def write_map(path, char_map, items):
+    ''' Write a map given as the nested lists of row strings and the item
+        dict of the pickled format
+    '''
+    palette, tiles, present = char_planes(char_map)
+    write_planes(path, palette, tiles, items, present)
+
+
+class MapPlanes:
+
+    ''' The tile id planes of a map held in memory
+
+        palette is the list of tile characters the ids of tiles, shaped
+        (depth, height, width), index into. present marks the cells in the
+        map, or is None when every cell is. items maps positions to item
+        characters.
+    '''
+
+    def __init__(self, palette, tiles, present=None, items=None):
+        self.palette = list(palette)
+        self.tiles = tiles
+        self.present = present
+        self.items = {} if items is None else items
+        self.shape = tiles.shape
+
+    def char_map(self):
+        ''' The tiles as nested lists of row strings, as in the pickled
+            format
+        '''
+        codes = np.array([ord(char) for char in self.palette], np.uint32)
+        depth, height, width = self.shape
+        char_map = []
+        for z in range(depth):
+            rows = []
+            for y in range(height):
+                length = width if self.present is None else int(self.present[z, y].sum())
+                rows.append(codes[self.tiles[z, y, :length]].tobytes().decode('utf-32-le'))
+            char_map.append(rows)
+        return char_map
+
+    def save(self, path):
+        ''' Write the planes to a map file '''
+
+        write_planes(path, self.palette, self.tiles, self.items, self.present)
+
+
+class MapFile(MapPlanes):
+
+    ''' A binary map file opened for reading
+
+        tiles is a copy-on-write memmap of palette indexes shaped (depth,
+        height, width): cells can be changed in memory but the file is
+        never written. present is a read-only memmap of the cells in the
+        map, or None when every cell is. items maps positions to item
+        characters.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as infile:
+            header = infile.read(HEADER.size)
+            if len(header) < HEADER.size or not header.startswith(MAGIC):
+                raise ValueError('{} is not a virtz map file'.format(path))
+            (_, version, id_bytes, flags, width, height, depth,
+                    palette_size, item_count, offset) = HEADER.unpack(header)
+            if version != VERSION:
+                raise ValueError('Unsupported map file version {} in {}'.format(version, path))
+            if id_bytes not in (1, 2):
+                raise ValueError('Unsupported tile id size {} in {}'.format(id_bytes, path))
+            palette = list(infile.read(palette_size).decode('utf-8'))
+            table = np.frombuffer(infile.read(item_count * ITEM.itemsize), ITEM)
+
+        self.version = version
+        shape = depth, height, width
+        positions = zip(table['x'].tolist(), table['y'].tolist(), table['z'].tolist())
+        items = dict(zip(positions, table['char'].tolist()))
+        id_type = np.uint8 if id_bytes == 1 else np.uint16
+        tiles = np.memmap(path, id_type, 'c', offset, shape)
+        if flags & RAGGED:
+            present = np.memmap(path, np.bool_, 'r', offset + tiles.nbytes, shape)
+        else:
+            present = None
+        super().__init__(palette, tiles, present, items)
+
+
+def convert(source, destination):
+    ''' Convert a pickled {'tiles': ..., 'items': ...} map to a map file '''
+
+    with open(source, 'rb') as infile:
+        map_dict = pickle.load(infile)
+    write_map(destination, map_dict['tiles'], map_dict['items'])
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', help='Pickled level map to convert')
+    parser.add_argument('destination', help='Binary map file to write')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    this.cli_args = cli()
+    convert(cli_args.source, cli_args.destination)
+    map_file = MapFile(cli_args.destination)
+    print('[*] Wrote {}: {}x{}x{} cells, {} tile types, {} items'.format(
+        cli_args.destination, *reversed(map_file.shape), len(map_file.palette), len(map_file.items)))
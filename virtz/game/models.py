@@ -8,10 +8,10 @@ import time
 import pygame
 import random
 import pdb
+from collections import namedtuple
 
 # async imports
-import threading
-from queue import Empty
+from queue import Empty, Full
 
 # Database/ORM imports
 from sqlalchemy import Column, ForeignKey, Integer, String
@@ -20,9 +20,6 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy import create_engine
 
-# Module imports
-from .util import distance_3d
-
 
 Base = declarative_base()
 
@@ -88,6 +85,80 @@ class MapTile(Base):
         self._x_pos, self._y_pos, self._z_pos = position
 
 
+class TileType(namedtuple('TileType', ['id', 'char', 'name', 'tile_type', 'wall',
+        'blocking', 'stairs', 'has_edges', 'tile_row', 'tile_col', 'movement_cost',
+        'required_skill'])):
+
+    ''' Immutable tile definition shared by every MapCell of the same kind '''
+
+    __slots__ = ()
+
+    @classmethod
+    def from_model(cls, tile):
+        if '_' in tile.name:
+            tile_type = tile.name.split('_')[0]
+        else:
+            tile_type = tile.name
+        fields = {f: getattr(tile, f) for f in cls._fields if f != 'tile_type'}
+        return cls(tile_type=tile_type, **fields)
+
+    @property
+    def image_location(self):
+        return self.tile_row, self.tile_col
+
+
+class MapCell:
+
+    ''' A single map position: a shared TileType plus per-cell state
+
+        Attributes not stored on the cell (name, wall, has_edges, ...)
+        are read from the TileType. blocking and movement_cost start out
+        as the TileType values and may be changed per cell.
+    '''
+
+    __slots__ = ('kind', '_x_pos', '_y_pos', '_z_pos', 'explored', 'visited',
+                 'light', 'blocking', 'movement_cost')
+
+    def __init__(self, kind, position):
+        self.kind = kind
+        self._x_pos, self._y_pos, self._z_pos = position
+        self.explored = False
+        self.visited = False
+        self.light = 0
+        self.blocking = kind.blocking
+        self.movement_cost = kind.movement_cost
+
+    def __getattr__(self, name):
+        # Only called for attributes missing from the cell itself; a cell
+        # being copied or unpickled has no kind yet to read them from
+        if name == 'kind' or (name.startswith('__') and name.endswith('__')):
+            raise AttributeError(name)
+        return getattr(self.kind, name)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "<MapCell(name={}, wall={}, blocking={}, position={})>".format(
+                self.name, self.wall, self.blocking, self.position)
+
+    @property
+    def passable(self):
+        return not self.blocking
+
+    @property
+    def position(self):
+        return self._x_pos, self._y_pos, self._z_pos
+
+    @position.setter
+    def position(self, position):
+        self._x_pos, self._y_pos, self._z_pos = position
+
+
 class MapItem(Base):
     __tablename__ = 'map_items'
     id = Column(Integer, primary_key=True)
@@ -136,17 +207,30 @@ class MapItem(Base):
 
     @property
     def contents(self):
-        return [i for i in self.level_map.item_list if i.container is self]
+        return list(self.level_map.item_index.contents(self))
+
+    @property
+    def container(self):
+        return getattr(self, '_container', None)
+
+    @container.setter
+    def container(self, container):
+        old_container = self.container
+        self._container = container
+        level_map = getattr(self, 'level_map', None)
+        if level_map is not None:
+            level_map.item_index.reparent(self, old_container)
 
     def add_item(self, item):
         if self.has_room:
-            self._contents.append(item)
+            item.container = self
         else:
             raise AssertionError('No room in container: {}/{}'.format(
-                len(self._contents, self.container_limit)))
+                len(self.contents), self.container_limit))
 
     def remove_item(self, item):
-        self._contents.remove(item)
+        if item.container is self:
+            item.container = None
 
     @property
     def is_container(self):
@@ -177,7 +261,12 @@ class MapItem(Base):
 
     @position.setter
     def position(self, position):
+        old_position = getattr(self, '_x_pos', None), getattr(self, '_y_pos', None), \
+                getattr(self, '_z_pos', None)
         self._x_pos, self._y_pos, self._z_pos = position
+        level_map = getattr(self, 'level_map', None)
+        if level_map is not None:
+            level_map.item_index.move(self, old_position)
 
     @property
     def sprite(self):
@@ -298,7 +387,7 @@ class Task:
         self._callback = func
         self.callback_args = _args
 
-class Virt(Base, threading.Thread):
+class Virt(Base):
     __tablename__ = 'virtz'
     id = Column(Integer, primary_key=True)
     game_id = Column(Integer, ForeignKey('saves.id'), nullable=True)
@@ -364,7 +453,6 @@ class Virt(Base, threading.Thread):
     fears_dark = Column(Boolean, unique=False, default=False)
 
     def __init__(self, name, queues, pf):
-        threading.Thread.__init__(self)
         self.name = name
         self.current_task = None
         self.pathfinder = pf
@@ -375,7 +463,6 @@ class Virt(Base, threading.Thread):
         self._damage = 0
         self.exit = False
         self._saved_task = None
-        self._clock = pygame.time.Clock()
         self.loop_count = 0
         self._death_notify = False
         self._tired_notify = False
@@ -384,10 +471,16 @@ class Virt(Base, threading.Thread):
         self.alive = True
         self._trash = []
 
+        # Replaced by a seeded generator when added to a Simulation
+        self.random = random.Random()
+
         # cache moves from a*
         self._moves = []
         self._destination = None
 
+        # Goal of the queued task whose flow field this virt holds
+        self._flow_goal = None
+
         # vital statistic decay rates
         self._hunger_rate = self._random_rate(5)
         self._thirst_rate = self._random_rate(5)
@@ -408,6 +501,7 @@ class Virt(Base, threading.Thread):
     def _get_task(self):
         if self._saved_task is not None:
             self.current_task = self._saved_task
+            self._saved_task = None
             return
         try:
             self.q_lock.acquire()
@@ -425,11 +519,16 @@ class Virt(Base, threading.Thread):
         self.q_lock.release()
 
     def pick_up(self, item):
+        # Returns False when the item is no longer on the map, i.e. another
+        # virt got to it first
         if not item.consumable:
-            return
+            return True
+        if item not in self.level_map.item_index:
+            return False
         inventory = self.flat_inventory
         if len(self._inventory) < self._inventory_limit:
             self._inventory.append(item)
+            item.container = None
         else:
             for i in self._inventory:
                 if i is not None:
@@ -442,6 +541,7 @@ class Virt(Base, threading.Thread):
             self.level_map.trash_item(item, False)
 
         print('{} picked up {}'.format(self.name, item))
+        return True
 
     def consume_item(self, target_item):
         assert target_item in self.flat_inventory
@@ -486,7 +586,11 @@ class Virt(Base, threading.Thread):
             return
 
         self.q_lock.acquire()
-        self.log_q.put(msg)
+        try:
+            self.log_q.put_nowait(msg)
+        except Full:
+            # Drop the entry rather than stall the simulation
+            pass
         self.q_lock.release()
 
     def _get_message(self, target=None):
@@ -528,12 +632,16 @@ class Virt(Base, threading.Thread):
         # Try to fetch a task
         if self.current_task is None:
             self._get_task()
+        self._track_flow()
 
         # If a task is assigned, process it
         if self.current_task is not None:
             # Move to task location if not already there
             if self.position != self.current_task.position:
-                return self._move_to, (self.current_task.position,)
+                need_map = self._need_map()
+                if need_map is not None:
+                    return self._follow_need, (need_map,)
+                return self._follow_flow, (self.current_task.position,)
             # Otherwise, do the task
             return self._do_task, None
 
@@ -543,14 +651,18 @@ class Virt(Base, threading.Thread):
         for i in self._inventory:
             if i is not None:
                 if i.is_container:
-                    if target_item in item.contents:
+                    if target_item in i.contents:
                         return True
         return False
 
     def _do_task(self):
         task = self.current_task
         if task.target_item is not None and not self.has_item(task.target_item):
-            self.pick_up(task.target_item)
+            if not self.pick_up(task.target_item):
+                # Target taken by someone else, drop the task
+                self.current_task = None
+                self._destination = None
+                return
         if not task.task_done:
             # Reduce task work remaining
             task.work = getattr(self, task.skill)
@@ -567,32 +679,72 @@ class Virt(Base, threading.Thread):
             self.current_task = None
             self._destination = None
 
-    def _closest_item(self, item_list):
-        positions = [i.position for i in item_list]
-        distances = {p: distance_3d(self.position, p) for p in positions}
-        if distances:
-            closest = min(distances, key=distances.get)
-            for item in item_list:
-                if item.position == closest:
-                    return item
+    def _item_at(self, position, item_type):
+        for item in self.level_map.find_item(position=position):
+            if item.item_type == item_type:
+                return item
 
     def _find_item(self, item_type):
         # Find an item of the specified type.
-        # Locates the closest item by default.
+        # Locates the nearest reachable item by path cost.
         print('{} is looking for {}'.format(self.name, item_type))
-        item_list = self.level_map.find_item(item_type=item_type)
-        if item_list:
-            item = self._closest_item(item_list)
-        else:
+        target = self.level_map.need_maps[item_type].nearest(self.position)
+        item = None if target is None else self._item_at(target, item_type)
+        if item is None:
             print('{} could not find {}'.format(self.name, item_type))
             return
         print('{} found {}'.format(self.name, item.name))
         return item
 
+    def _track_flow(self):
+        # Hold a flow field reference on the goal of the queued task being
+        # worked, which is put aside while a need is covered
+        if self.resting or self.eating or self.drinking:
+            task = self._saved_task
+        else:
+            task = self.current_task
+        goal = None if task is None or not self.alive else task.position
+        if goal != self._flow_goal:
+            if self._flow_goal is not None:
+                self.pathfinder.release_flow(self._flow_goal)
+            if goal is not None:
+                self.pathfinder.acquire_flow(goal)
+            self._flow_goal = goal
+
+    def _follow_flow(self, goal):
+        # Shared flow field toward a popular goal, A* otherwise
+        next_move = self.pathfinder.flow_step(self.position, goal)
+        if next_move is None:
+            return self._move_to(goal)
+        self._move(next_move)
+
+    def _need_map(self):
+        # Need map leading to the current task's target, if it has one
+        target_item = self.current_task.target_item
+        if target_item is None or target_item.item_type not in self.level_map.need_maps:
+            return None
+        return self.level_map.need_maps[target_item.item_type]
+
+    def _follow_need(self, need_map):
+        # Walk downhill toward the nearest target of the task's item_type.
+        # Arriving on a different target than planned (the original was
+        # taken, or a nearer one appeared) retargets the task to it.
+        task = self.current_task
+        if need_map.cost(self.position) == 0:
+            item = self._item_at(self.position, need_map.item_type)
+            if item is not None:
+                task.position = self.position
+                task.target_item = item
+                return
+        next_move = need_map.downhill(self.position)
+        if next_move is None:
+            return self._move_to(task.position)
+        self._move(next_move)
+
     def _idle(self):
         # Wander to random points
         try:
-            choice = random.choice(self.level_map.get_neighbors(self.position))
+            choice = self.random.choice(self.level_map.get_neighbors(self.position))
         except IndexError:
             choice = self.position
         self._move(choice)
@@ -692,7 +844,11 @@ class Virt(Base, threading.Thread):
             self._move(next_move)
         else:
             self._destination = destination
-            path = self.pathfinder[(self.position, destination)]
+            path = self.pathfinder.request(self.position, destination)
+            if path is None:
+                # Queued for the scheduler's batch, wait for it this tick
+                self._moves = []
+                return
             if path:
                 self._moves = path
                 self._move(self._moves.pop())
@@ -773,6 +929,11 @@ class Virt(Base, threading.Thread):
     def position(self, pos):
         self.pos_x, self.pos_y, self.pos_z = pos
 
+    @property
+    def sight_radius(self):
+        # Cells seen in every direction, wiser virtz see further
+        return 5 + self.wisdom
+
     @property
     def destination(self):
         return self._destination
@@ -787,41 +948,24 @@ class Virt(Base, threading.Thread):
             self.sprite = pygame.transform.rotate(self._sprite_image, 90)
         self._death_notify = True
         self.alive = False
+        self._track_flow()
 
-    def run(self):
-        def pre_loop():
-            if self.loop_count >= 1000000:
-                self.loop_count = 0
-
-        def post_loop():
-            self.loop_count += 1
-            self._hunger += self._hunger_rate
-            self._thirst += self._thirst_rate
-            if self._hunger > 10:
-                self._die('hunger')
-            elif self._thirst > 10:
-                self._die('thirst')
-
-        def tick(rate=2):
-            self._clock.tick(rate)
-
-        # Main AI loop here
-        # call using start()
-        self.pause = False
-        while not self.kill_switch.is_set():
-            #pdb.set_trace()
-            try:
-                if not self.alive:
-                    return
-                if not self.pause:
-                    pre_loop()
-                    tick()
-                    self.work()
-                    post_loop()
-                else:
-                    tick()
-            except:
-                raise
+    def step(self):
+
+        ''' Run a single AI tick, called by the Simulation scheduler '''
+
+        if not self.alive:
+            return
+        if self.loop_count >= 1000000:
+            self.loop_count = 0
+        self.work()
+        self.loop_count += 1
+        self._hunger += self._hunger_rate
+        self._thirst += self._thirst_rate
+        if self._hunger > 10:
+            self._die('hunger')
+        elif self._thirst > 10:
+            self._die('thirst')
 
 def create_db(path):
     engine = create_engine(path, echo=True)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Dijkstra "need maps": for every cell, the path cost to the nearest item
+# of one item_type. A virt looking for food reads its nearest reachable
+# target straight from the map and walks downhill to it, so the search is
+# shared by every virt instead of repeated per virt. Each level is cut into
+# square sectors and the field of a sector, bounded to it and a margin
+# around it, is only searched once a virt in the sector asks, so a huge
+# world costs no more than the sectors its virtz are in.
+
+from collections import OrderedDict
+
+from .fields import DistanceField
+from .graph import heuristic
+
+# Item types the LevelMap keeps a need map for
+NEED_TYPES = ('food', 'drink', 'bed', 'door')
+
+# Side of the sectors of a level, and the cells around a sector its field
+# also covers, so targets that far beyond its edge are found
+SECTOR_SIZE = 32
+SECTOR_MARGIN = 32
+
+# Sector fields kept per item_type, the least recently used go first
+MAX_SECTORS = 64
+
+
+class NeedField(DistanceField):
+
+    ''' DistanceField of one sector of a NeedMap, over the sector and the
+        margin around it, whose sources are the positions in that box
+        holding at least one item of the item_type
+
+        The ItemIndex version of the type tells when items were spawned,
+        consumed or moved; only the changed sources are then added or
+        removed, touching just the cells whose nearest target changed.
+        Only topology changes inside the box make the field stale.
+    '''
+
+    def __init__(self, need_map, box):
+        super().__init__(need_map.level_map, box)
+        self.item_type = need_map.item_type
+        self.items_version = None
+        self.changes = 0        # topology changes inside the box
+
+    def _topology_version(self):
+        return self.changes
+
+    def sync(self):
+        ''' Bring the field up to date with the map, if needed '''
+
+        if self.stale:
+            self.rebuild()
+            return
+        version = self.level_map.item_index.version(self.item_type)
+        if version == self.items_version:
+            return
+        sources = self._source_nodes()
+        for node in self.sources - sources:
+            self._remove_source(node)
+        for node in sources - self.sources:
+            self._add_source(node)
+        self.items_version = version
+
+    def rebuild(self):
+        self.items_version = self.level_map.item_index.version(self.item_type)
+        super().rebuild()
+
+    def _source_nodes(self):
+        node = self.adjacency.node
+        nodes = set()
+        for item in self.level_map.item_index.in_box(*self.box):
+            if item.item_type == self.item_type:
+                n = node(item.position)
+                if n is not None:
+                    nodes.add(n)
+        return nodes
+
+
+class NeedMap:
+
+    ''' The need map of one item_type, as NeedFields of the sectors asked
+        about
+
+        cost(), nearest() and downhill() read the field of the sector
+        holding the position, searching it on first use. Targets beyond a
+        sector's margin are not in its field; nearest() then falls back to
+        the closest target on the level as the crow flies, for the
+        Pathfinder to reach.
+    '''
+
+    def __init__(self, level_map, item_type):
+        self.level_map = level_map
+        self.item_type = item_type
+        self._fields = OrderedDict()    # (z, sy, sx) -> NeedField, oldest first
+
+    def _sector(self, position):
+        x, y, z = position
+        return z, y // SECTOR_SIZE, x // SECTOR_SIZE
+
+    def field(self, position):
+        ''' The up to date NeedField of the sector holding position '''
+
+        key = self._sector(position)
+        try:
+            need_field = self._fields[key]
+            self._fields.move_to_end(key)
+        except KeyError:
+            z, sy, sx = key
+            width, height, _ = self.level_map.bounds
+            x0, y0 = sx * SECTOR_SIZE, sy * SECTOR_SIZE
+            box = (z, max(0, x0 - SECTOR_MARGIN), max(0, y0 - SECTOR_MARGIN),
+                    min(width, x0 + SECTOR_SIZE + SECTOR_MARGIN),
+                    min(height, y0 + SECTOR_SIZE + SECTOR_MARGIN))
+            need_field = self._fields[key] = NeedField(self, box)
+            while len(self._fields) > MAX_SECTORS:
+                self._fields.popitem(last=False)
+        need_field.sync()
+        return need_field
+
+    def topology_changed(self, position):
+        # Every sector whose box holds position, within the margin of it
+        x, y, z = position
+        for sy in range((y - SECTOR_MARGIN) // SECTOR_SIZE, (y + SECTOR_MARGIN) // SECTOR_SIZE + 1):
+            for sx in range((x - SECTOR_MARGIN) // SECTOR_SIZE, (x + SECTOR_MARGIN) // SECTOR_SIZE + 1):
+                need_field = self._fields.get((z, sy, sx))
+                if need_field is not None:
+                    need_field.changes += 1
+
+    def cost(self, position):
+        ''' Path cost from position to the nearest source of its sector
+            field, None if none can be reached within it
+        '''
+        return self.field(position).cost(position)
+
+    def nearest(self, position):
+        ''' Position of the nearest reachable target, or of the closest
+            one on the level when none is reachable within the sector
+            field, None when the level has none
+        '''
+        target = self.field(position).nearest(position)
+        if target is not None:
+            return target
+        targets = [item.position for item in self.level_map.item_index.of_type(self.item_type)
+                if item.position[2] == position[2]]
+        if not targets:
+            return None
+        return min(targets, key=lambda target: heuristic(position, target))
+
+    def downhill(self, position):
+        ''' The next step from position toward the nearest target of its
+            sector field, None when already on one or none can be reached
+        '''
+        return self.field(position).downhill(position)
+
+
+class NeedMaps:
+
+    ''' The NeedMaps of a LevelMap, created on first use '''
+
+    def __init__(self, level_map, item_types=NEED_TYPES):
+        self.level_map = level_map
+        self.item_types = tuple(item_types)
+        self._maps = {}
+        level_map.add_topology_listener(self._topology_changed)
+
+    def __contains__(self, item_type):
+        return item_type in self.item_types
+
+    def __getitem__(self, item_type):
+        if item_type not in self.item_types:
+            raise KeyError(item_type)
+        try:
+            return self._maps[item_type]
+        except KeyError:
+            need_map = self._maps[item_type] = NeedMap(self.level_map, item_type)
+            return need_map
+
+    def _topology_changed(self, position):
+        for need_map in self._maps.values():
+            need_map.topology_changed(position)
+
+    def clear(self):
+        self._maps.clear()
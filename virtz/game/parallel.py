@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Batch A* over a pool of worker processes. The passability and movement
+# costs of the map are published to the workers as a compact read-only
+# snapshot in shared memory, one neighbour mask byte and one cost byte per
+# cell, once per topology version; every batch after that only ships the
+# (start, goal) pairs and gets the paths back.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .graph import GridAdjacency, a_star, edge_table
+
+
+def snapshot_planes(level_map):
+    ''' (mask, cost) uint8 arrays over the (z, y, x) cells of level_map
+
+        mask holds the neighbor bits of the GridAdjacency layout and cost
+        the movement_cost of each cell, 0 for cells not in the map. Only
+        grid storage has them at hand; building them for dict or chunked
+        storage would visit, and load, every cell of the world.
+    '''
+    adjacency = level_map.adjacency
+    if not isinstance(adjacency, GridAdjacency):
+        raise ValueError('Path workers need a LevelMap with grid storage')
+    grid = level_map.grid
+    return adjacency.mask.copy(), np.where(grid.present, grid.movement_cost, 0).astype(np.uint8)
+
+
+class MapSnapshot:
+
+    ''' Read-only view of published snapshot planes with the node(),
+        position() and edges() of a GridAdjacency, for a_star()
+    '''
+
+    def __init__(self, shape, buffer):
+        self.shape = shape
+        depth, height, width = shape
+        size = depth * height * width
+        self._plane = height * width
+        self._width = width
+        self._edge_table = edge_table(width)
+        self._flat_mask = buffer[:size]
+        self._flat_cost = buffer[size:2 * size]
+
+    def node(self, position):
+        x, y, z = position
+        depth, height, width = self.shape
+        if not (0 <= x < width and 0 <= y < height and 0 <= z < depth):
+            return None
+        node = z * self._plane + y * width + x
+        # Cells outside the map have no cost
+        return node if self._flat_cost[node] else None
+
+    def position(self, node):
+        z, rest = divmod(node, self._plane)
+        y, x = divmod(rest, self._width)
+        return x, y, z
+
+    def edges(self, node):
+        cost = self._flat_cost
+        return [(node + delta, step * cost[node + delta])
+                for delta, step in self._edge_table[self._flat_mask[node]]]
+
+    def release(self):
+        self._flat_mask.release()
+        self._flat_cost.release()
+
+
+# The snapshot attached in a worker process, as (name, SharedMemory,
+# MapSnapshot)
+_attached = None
+
+
+def _search(handle, queries):
+    # Runs in the worker processes: attach the snapshot named by handle,
+    # unless it is attached already, and search every query on it
+    global _attached
+    name, shape = handle
+    if _attached is None or _attached[0] != name:
+        if _attached is not None:
+            _attached[2].release()
+            _attached[1].close()
+        memory = shared_memory.SharedMemory(name)
+        _attached = name, memory, MapSnapshot(shape, memory.buf)
+    snapshot = _attached[2]
+    return [a_star(snapshot, start, goal) for start, goal in queries]
+
+
+class PathWorkers:
+
+    ''' A ProcessPoolExecutor searching batches of paths on a LevelMap
+
+        The snapshot is published when the map's adjacency or topology
+        version differs from the last batch, and the workers attach it
+        on their first query after that. Paths match the ones A* finds
+        in the main process. The processes are started on the first
+        batch and stopped by close().
+    '''
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count()
+        self.published = 0
+        self._executor = None
+        self._memory = None
+        self._shape = None
+        self._source = None     # (adjacency, topology_version) published
+
+    def _publish(self, level_map):
+        source = level_map.adjacency, level_map.topology_version
+        if self._source is not None and self._source[0] is source[0] and \
+                self._source[1] == source[1]:
+            return
+        mask, cost = snapshot_planes(level_map)
+        memory = shared_memory.SharedMemory(create=True, size=2 * mask.size)
+        planes = np.ndarray((2,) + mask.shape, np.uint8, buffer=memory.buf)
+        planes[0] = mask
+        planes[1] = cost
+        del planes
+        self._release()
+        self._memory = memory
+        self._shape = mask.shape
+        self._source = source
+        self.published += 1
+
+    def _release(self):
+        if self._memory is not None:
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
+            self._source = None
+
+    def find(self, level_map, queries):
+        ''' Reversed paths, or False, for every (start, goal) in queries,
+            in the same order
+        '''
+        queries = list(queries)
+        if not queries:
+            return []
+        self._publish(level_map)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers)
+
+        # A few chunks per worker evens out uneven path lengths
+        size = -(-len(queries) // (self.workers * 4))
+        chunks = [queries[n:n + size] for n in range(0, len(queries), size)]
+        handle = self._memory.name, self._shape
+        paths = []
+        for found in self._executor.map(_search, [handle] * len(chunks), chunks):
+            paths.extend(found)
+        return paths
+
+    def close(self):
+        ''' Stop the worker processes and free the snapshot '''
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._release()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import random
+
+
+class Simulation:
+
+    ''' Steps the AI of every Virt in a single fixed-timestep loop
+
+        Virtz are stepped one after another in the order they were added,
+        each with its own random.Random seeded from the simulation seed,
+        so a run is fully determined by the seed and the player's input.
+        advance() is fed the real time elapsed between rendered frames and
+        runs as many fixed steps as fit, keeping the simulation rate
+        independent of the frame rate.
+
+        Paths the virtz request from pathfinder during a tick are searched
+        in one batch at its end (see Pathfinder.request), and the virtz
+        set off along them on the next tick.
+    '''
+
+    def __init__(self, level_map, rate=2, seed=None, max_steps=4, pathfinder=None):
+        self.level_map = level_map
+        self.pathfinder = pathfinder
+        self.rate = rate                # simulation steps per second
+        self.seed = seed
+        self.max_steps = max_steps      # cap on catch-up steps per advance()
+        self.paused = False
+        self.tick_count = 0
+        self.virtz = []
+        self._random = random.Random(seed)
+        self._accumulator = 0.0
+
+    def add(self, virt):
+        virt.level_map = self.level_map
+        virt.random = random.Random(self._random.getrandbits(64))
+        self.virtz.append(virt)
+
+    @property
+    def step_time(self):
+        return 1 / self.rate
+
+    def step(self):
+        ''' Run one simulation tick for every living virt '''
+
+        for virt in self.virtz:
+            if virt.alive:
+                virt.step()
+        if self.pathfinder is not None:
+            self.pathfinder.resolve()
+        self.tick_count += 1
+
+    def advance(self, elapsed):
+        ''' Run the steps due after elapsed seconds of real time and
+            return how many were run
+        '''
+
+        if self.paused:
+            return 0
+        self._accumulator += elapsed
+        steps = 0
+        while self._accumulator >= self.step_time:
+            self._accumulator -= self.step_time
+            if steps < self.max_steps:
+                self.step()
+                steps += 1
+        return steps
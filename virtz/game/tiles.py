@@ -5,27 +5,28 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 import sys
-import copy
+from types import MappingProxyType
 
-from .models import MapTile, MapItem, Task, Base
+from .models import MapTile, MapItem, MapCell, TileType, Task, Base
 this = sys.modules[__name__]
 
 
 class TileFactory:
-    ''' Factory class to return instantiated MapTiles '''
+    ''' Factory class to return MapCells sharing cached TileType prototypes '''
     def __init__(self, db_path):
         session_init(db_path)
         self.engine = engine
         self.session = session
 
+        # Every tile definition is loaded once and shared by all cells
+        self.prototypes = {tile.char: TileType.from_model(tile)
+                for tile in self.session.query(MapTile)}
+
     def get_tile(self, char, position):
-        ''' Returns a MapTile object matching the passed name.
+        ''' Returns a MapCell for the tile matching the passed character.
             Used in map generation and conversion from saved data.
         '''
-        base_tile = copy.deepcopy(self.session.query(
-                MapTile).filter(MapTile.char == char).one())
-        base_tile.position = position
-        return base_tile
+        return MapCell(self.prototypes[char], position)
 
 class ItemFactory:
     ''' Factory class to return instantiated MapItems '''
@@ -34,13 +35,20 @@ class ItemFactory:
         self.engine = engine
         self.session = session
 
+        # Column values of every item definition, keyed by char and name
+        columns = [c.name for c in MapItem.__table__.columns]
+        self._by_char = {}
+        self._by_name = {}
+        for item in self.session.query(MapItem):
+            values = MappingProxyType({c: getattr(item, c) for c in columns})
+            self._by_char.setdefault(item.char, values)
+            self._by_name.setdefault(item.name, values)
+
     def get_item(self, char, position, name=None):
         if name is not None:
-            base_item = copy.deepcopy(self.session.query(
-                MapItem).filter(MapItem.name == name).one())
+            base_item = MapItem(**self._by_name[name])
         else:
-            base_item = copy.deepcopy(self.session.query(
-                MapItem).filter(MapItem.char == char).one())
+            base_item = MapItem(**self._by_char[char])
         base_item.position = position
         return base_item
 
@@ -1,8 +1,14 @@
 
-import heapq
 import signal
-from collections import defaultdict
-from math import inf as Infinity
+import weakref
+from collections import OrderedDict, namedtuple
+
+from .graph import a_star, heuristic
+from .fields import FlowField
+from .hpa import HierarchicalPathfinder
+from .jps import JumpPointSearch
+from .dstar import DStarLite
+from .parallel import PathWorkers
 #import pdb
 
 def distance_3d(pt1, pt2):
@@ -41,20 +47,292 @@ class InterruptHandler:
         self.released = True
         return True
 
+PathCacheInfo = namedtuple('PathCacheInfo',
+        ['hits', 'suffix_hits', 'misses', 'invalidations', 'size', 'maxsize'])
+
+
+class PathCache:
+
+    ''' Bounded LRU cache of Pathfinder results keyed on (start, goal)
+
+        Paths are stored reversed, as returned by the Pathfinder, so the
+        part of a cached path from any position on it to the goal is itself
+        a shortest path; such suffixes are served for new starts that lie
+        on a cached path. Failed searches are cached as False. Every entry
+        belongs to one LevelMap topology_version and the whole cache is
+        dropped when the version changes.
+    '''
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.suffix_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.version = None
+        self._paths = OrderedDict()     # (start, goal) -> (path, {position: index})
+        self._by_goal = {}              # goal -> {start: None} of cached entries
+
+    def __len__(self):
+        return len(self._paths)
+
+    def clear(self):
+        self._paths.clear()
+        self._by_goal.clear()
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._paths:
+                self.invalidations += 1
+            self.clear()
+            self.version = version
+
+    def get(self, start, goal, version):
+        ''' Returns a cached path tuple, False for a cached failure, or
+            None on a miss
+        '''
+        self._check_version(version)
+        key = start, goal
+        entry = self._paths.get(key)
+        if entry is not None:
+            self._paths.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        for other in self._by_goal.get(goal, ()):
+            path, index = self._paths[other, goal]
+            if path and start in index:
+                self._paths.move_to_end((other, goal))
+                self.suffix_hits += 1
+                return path[:index[start] + 1]
+
+        self.misses += 1
+        return None
+
+    def put(self, start, goal, path, version):
+        if not self.maxsize:
+            return
+        self._check_version(version)
+        key = start, goal
+        if path:
+            path = tuple(path)
+            self._paths[key] = path, {p: n for n, p in enumerate(path)}
+        else:
+            self._paths[key] = False, None
+        self._paths.move_to_end(key)
+        self._by_goal.setdefault(goal, {})[start] = None
+
+        while len(self._paths) > self.maxsize:
+            (old_start, old_goal), _ = self._paths.popitem(last=False)
+            starts = self._by_goal[old_goal]
+            del starts[old_start]
+            if not starts:
+                del self._by_goal[old_goal]
+
+    def info(self):
+        return PathCacheInfo(self.hits, self.suffix_hits, self.misses,
+                self.invalidations, len(self._paths), self.maxsize)
+
+
 class Pathfinder:
+
+    ''' A* over the LevelMap adjacency, with a path cache and flow fields
+
+        In flow-field mode (flow_threshold is not None) walkers announce
+        the goal they are heading to with acquire_flow() and drop it with
+        release_flow(). Once flow_threshold walkers share a goal, one
+        reverse Dijkstra from it gives every cell its next step, and
+        flow_step() serves each walker in O(1) per step. Fields are freed
+        when the last walker releases their goal.
+
+        algorithm selects the search used for other paths: 'astar' runs
+        a cached A* on the map itself, 'jps' a cached Jump Point Search
+        giving paths of the same cost (grid storage only, A* otherwise),
+        'hpa' the HierarchicalPathfinder, which also follows stairs
+        between levels and returns lazily refined Routes, and 'dstar'
+        returns DStarLite routes. The Pathfinder forwards every cell the
+        LevelMap reports as changed to the live DStarLite routes, which
+        repair their search state instead of failing or replanning from
+        scratch.
+
+        With workers set, find_many() searches batches of paths missing
+        from the cache on that many worker processes (see PathWorkers),
+        and request() queues the searches a Simulation tick needs so that
+        the scheduler's resolve() runs them as one batch. Workers always
+        run A*, the paths have the same cost as those of 'jps'. Routes
+        of 'hpa' and 'dstar' hold state and are built in this process.
+        Workers need grid storage; on any other the paths are searched in
+        this process.
+    '''
+
+    ALGORITHMS = ('astar', 'jps', 'hpa', 'dstar')
+
+    # Batches with fewer searches than this are cheaper to run here than
+    # to ship to the worker processes
+    PARALLEL_MIN = 8
+
+    def __init__(self, cache_size=256, flow_threshold=2, algorithm='astar', workers=0):
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError('Unknown pathfinding algorithm: {}'.format(algorithm))
+        self.algorithm = algorithm
+        self.cache = PathCache(cache_size)
+        self.flow_threshold = flow_threshold
+        self._flows = {}    # goal -> [FlowField or None, reference count]
+        self.hierarchy = None
+        self.jump_points = None
+        self._routes = weakref.WeakSet()    # live DStarLite routes
+        self.workers = PathWorkers(workers) if workers else None
+        self._pending = {}      # (start, goal) queued by request()
+        self._resolved = {}     # (start, goal) -> path found by resolve()
+        self._resolved_version = None
+
     def __getitem__(self, points):
         ''' Points should be (start, goal)
 
             Be sure to set graph to a GridWithWeights graph before getting an item
         '''
         if hasattr(self, '_graph'):
-            return self._a_star(*points)
+            start, goal = points
+            if self.hierarchy is not None:
+                return self.hierarchy.find(start, goal) or False
+            if self.algorithm == 'dstar':
+                return self._replanning_route(start, goal)
+            version = self.graph.level_map.topology_version
+            path = self.cache.get(start, goal, version)
+            if path is None:
+                path = self._search(start, goal)
+                self.cache.put(start, goal, path, version)
+            # Callers pop moves off the path, hand out a copy
+            return list(path) if path else False
+
+    def cache_info(self):
+        return self.cache.info()
+
+    def _search(self, start, goal):
+        if self.jump_points is not None and self.jump_points.applies(start, goal):
+            return self.jump_points.find(start, goal)
+        return self._a_star(start, goal)
+
+    @property
+    def _batches(self):
+        # Whether paths can be searched in batches on the workers
+        return self.workers is not None and self.algorithm in ('astar', 'jps') and \
+                self.graph.level_map.grid is not None
+
+    def find_many(self, pairs):
+        ''' Paths for a list of (start, goal) pairs, in the same order
+
+            Cached paths are served directly and the rest are searched in
+            one batch, on the worker processes when there are at least
+            PARALLEL_MIN of them.
+        '''
+        pairs = list(pairs)
+        if not self._batches:
+            return [self[pair] for pair in pairs]
+        version = self.graph.level_map.topology_version
+        paths = {}
+        misses = []
+        for start, goal in pairs:
+            if (start, goal) in paths:
+                continue
+            path = paths[start, goal] = self.cache.get(start, goal, version)
+            if path is None:
+                misses.append((start, goal))
+
+        if len(misses) >= self.PARALLEL_MIN:
+            found = self.workers.find(self.graph.level_map, misses)
+        else:
+            found = [self._search(start, goal) for start, goal in misses]
+        for (start, goal), path in zip(misses, found):
+            self.cache.put(start, goal, path, version)
+            paths[start, goal] = path
+        return [list(paths[pair]) if paths[pair] else False for pair in pairs]
+
+    def request(self, start, goal):
+        ''' The path from start to goal, or None when it was queued
+
+            Without workers this is the same as pathfinder[start, goal].
+            With them, paths that are not cached or found by the last
+            resolve() are queued for the next one and None is returned;
+            the caller asks again after it.
+        '''
+        if not self._batches:
+            return self[start, goal]
+        version = self.graph.level_map.topology_version
+        path = self._resolved.get((start, goal)) \
+                if version == self._resolved_version else None
+        if path is None:
+            path = self.cache.get(start, goal, version)
+        if path is None:
+            self._pending[start, goal] = None
+            return None
+        return list(path) if path else False
+
+    def resolve(self):
+        ''' Search every path queued by request() since the last call '''
+
+        if not self._pending:
+            self._resolved = {}
+            return
+        pending = list(self._pending)
+        self._pending.clear()
+        self._resolved = dict(zip(pending, self.find_many(pending)))
+        self._resolved_version = self.graph.level_map.topology_version
+
+    def close(self):
+        ''' Stop the worker processes, if any '''
+
+        if self.workers is not None:
+            self.workers.close()
+
+    def _replanning_route(self, start, goal):
+        adjacency = self.graph.level_map.adjacency
+        if adjacency.node(start) is None or adjacency.node(goal) is None:
+            return False
+        route = DStarLite(adjacency, start, goal)
+        if not route:
+            return False
+        self._routes.add(route)
+        return route
+
+    def _topology_changed(self, position):
+        for route in list(self._routes):
+            route.changed(position)
+
+    def acquire_flow(self, goal):
+        try:
+            self._flows[goal][1] += 1
+        except KeyError:
+            self._flows[goal] = [None, 1]
+
+    def release_flow(self, goal):
+        entry = self._flows.get(goal)
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._flows[goal]
+
+    @property
+    def flow_fields(self):
+        return {goal: entry[0] for goal, entry in self._flows.items()
+                if entry[0] is not None}
+
+    def flow_step(self, start, goal):
+        ''' Next position from start toward goal along the goal's flow
+            field, or None when the goal is not popular enough for one (or
+            is unreachable) and the caller should fall back to A*
+        '''
+        if self.flow_threshold is None:
+            return None
+        entry = self._flows.get(goal)
+        if entry is None or entry[1] < self.flow_threshold:
+            return None
+        if entry[0] is None:
+            entry[0] = FlowField(self.graph.level_map, goal)
+        return entry[0].downhill(start)
 
     def _heuristic(self, a, b):
-        x1, y1, z1 = a
-        x2, y2, z2 = b
-        # Need to implement 3d distance here
-        return abs(x1-x2) + abs(y1-y2)
+        return heuristic(a, b)
 
     def _reconstruct(self, came_from, current):
         total_path = [current]
@@ -64,49 +342,7 @@ class Pathfinder:
         return total_path
 
     def _a_star(self, start, goal):
-        # Set of evaluated nodes
-        closed_set = []
-
-        # Set of discovered but unevaluated nodes
-        open_set = [start]
-
-        # dict containing path taken from node to node
-        came_from = {}
-
-        # cost of getting from start to a particular node
-        g_score = defaultdict(lambda: Infinity)
-        g_score[start] = 0
-
-        # cost of getting from start to goal using a
-        # particular node (g + h)
-        f_score = defaultdict(lambda: Infinity)
-        f_score[start] = self._heuristic(start, goal)
-
-        while open_set:
-            current = min({pos: f_score[pos] for pos in f_score if pos in open_set}, key=f_score.get)
-            if current == goal:
-                return self._reconstruct(came_from, goal)
-
-            if current in open_set:
-                open_set.remove(current)
-            closed_set.append(current)
-
-            for point in self.graph.level_map.get_neighbors(current):
-                movement_cost = self.graph.level_map[point].movement_cost
-
-                if point in closed_set:
-                    continue
-                elif point not in open_set:
-                    open_set.append(point)
-
-                temp_score = g_score[current] + self._heuristic(current, point) * movement_cost
-                if temp_score > g_score[point]:
-                    continue
-
-                came_from[point] = current
-                g_score[point] = temp_score
-                f_score[point] = g_score[point] + self._heuristic(point, goal)
-        return False
+        return a_star(self.graph.level_map.adjacency, start, goal)
 
     @property
     def graph(self):
@@ -115,6 +351,12 @@ class Pathfinder:
     @graph.setter
     def graph(self, level_map):
         self._graph = GridWithWeights(level_map)
+        if self.algorithm == 'hpa':
+            self.hierarchy = HierarchicalPathfinder(level_map)
+        elif self.algorithm == 'jps':
+            self.jump_points = JumpPointSearch(level_map)
+        elif self.algorithm == 'dstar':
+            level_map.add_topology_listener(self._topology_changed)
 
 
 class GridWithWeights:
@@ -4,17 +4,24 @@
 import sys
 import os
 import queue
+import random
 import threading
 import pygame
 import argparse
+import time
+import numpy as np
 
 from game.characters import CharacterFactory
-from game.levels import LevelMap
-from game.display import DisplayManager
+from game.levels import LevelMap, random_size
+from game.generator import MapGenerator, parse_size
+from game.display import DisplayManager, BlitBatch, TextCache, Panel
+from game.camera import Camera
 from game.util import Pathfinder, InterruptHandler
 from game.load_tilemap import TileCache
+from game.scheduler import Simulation
+from game.lighting import daylight, FULL_LIGHT
 
-from game.models import MapTile, Virt, MapItem
+from game.models import MapCell, Virt, MapItem
 
 this = sys.modules[__name__]
 BASE_PATH = os.getcwd()
@@ -24,7 +31,7 @@ VIRT_OBJ = 1
 MAPITEM_OBJ = 2
 
 def game_item_type(item):
-    if isinstance(item, MapTile):
+    if isinstance(item, MapCell):
         return MAPTILE_OBJ
     elif isinstance(item, Virt):
         return VIRT_OBJ
@@ -40,14 +47,14 @@ class Game:
     tile_map = os.path.join(BASE_PATH, 'resources/world_tilemap.png')
     char_map = os.path.join(BASE_PATH, 'resources/characters.png')
 
-    # game_map will point to a map generator class eventually,
-    # for now using a static test map to build out the mechanics
-    game_map = os.path.join(BASE_PATH, 'data/test_map')  # for testing
+    # game_map is the static test map unless --generate replaces it
+    # with a MapGenerator
+    game_map = os.path.join(BASE_PATH, 'data/test_map.vzm')  # for testing
 
     game_font = os.path.join(BASE_PATH, 'resources/Inconsolata.otf')
 
-    # start_point will point to a generator class eventuall,
-    # for now statically set
+    # start_point is static for the test map, generated worlds pick
+    # their own
     start_point = (2, 2, 0)     # virt starting positions
     tile_w = 16                 # tile width for tile_map/char_map
     tile_h = 16                 # tile height for tile_map/char_map
@@ -58,6 +65,29 @@ class Game:
     TILE_CONTENTS = 1       # Middle window (932, 258) - (1280, 512)
     TILE_META = 2           # Lower left window (932, 515) - (1280, 768)
 
+    # Screen regions redrawn independently of each other, the panels
+    # inside the borders only when their text changes
+    MAP_VIEW = pygame.Rect(0, 0, 928, 433)          # Map viewport
+    SELECTION_PANEL = pygame.Rect(931, 0, 349, 255)     # SELECTION_WINDOW
+    CONTENTS_PANEL = pygame.Rect(931, 258, 349, 253)    # TILE_CONTENTS
+    META_PANEL = pygame.Rect(931, 514, 349, 254)        # TILE_META
+    BOTTOM_PANEL = pygame.Rect(0, 452, 928, 316)    # Date, selection and debug text
+
+    # Fog of war opacity over cells never seen and cells out of sight
+    FOG_UNEXPLORED = 255
+    FOG_EXPLORED = 150
+
+    # Opacity of the shade over a cell without any light
+    MAX_DARKNESS = 230
+
+    # Virtz light a torch where the sky is darker than TORCH_BELOW
+    TORCH_BELOW = 128
+    TORCH_RADIUS = 4
+    TORCH_LIGHT = 200
+
+    # Cells the camera pans per key press
+    PAN_STEP = 4
+
     def __init__(self):
         if cli_args.test:
             self.starting_virtz = 5
@@ -68,11 +98,19 @@ class Game:
 
         self.game_over = False
 
+        # Seeds virt generation and the simulation, making runs repeatable
+        self.seed = cli_args.seed
+        random.seed(self.seed)
+
+        # Headless runs simulate without opening a window or rendering
+        self.headless = cli_args.headless
+
         # Initialize the display manager
         # (offload more of the display functions to this class)
-        self.display = DisplayManager()
-        self.display_mode = (1280, 768), cli_args.fullscreen # Set initial resolution
-        self.display.screen = self.display_mode
+        if not self.headless:
+            self.display = DisplayManager()
+            self.display_mode = (1280, 768), cli_args.fullscreen # Set initial resolution
+            self.display.screen = self.display_mode
 
         # The first read of the TileCache will cache all tiles in the specified file
         self.sprite_cache = TileCache()[self.char_map]
@@ -89,27 +127,73 @@ class Game:
         # List of tuples (Rect, obj) for clickable text items in the side menu
         self.selectable = []
 
+        # The window of the map shown in MAP_VIEW
+        self.camera = Camera(self.MAP_VIEW, self.tile_w, self.tile_h)
+
+        # Pre-rendered terrain and static items of the cells in view, the
+        # (level, camera version) it shows, the map rects drawn over it
+        # last frame, and positions changed since then
+        self._map_view = None
+        self._view_key = None
+        self._sprite_rects = []
+        self._changed_cells = []
+
+        # Blits of the loose items in view, kept until items change, more
+        # of the map is explored or the camera moves
+        self._item_blits = None
+        self._item_blits_key = None
+
+        # Fog of war over the map view, and the cell boxes whose
+        # visibility changed since it was last painted
+        self._fog_view = None
+        self._fog_regions = []
+
+        # The same for the shade darkening unlit cells
+        self._shade_view = None
+        self._light_regions = []
+
         # Initiate the game clock, queues, and thread lock
         self.clock = pygame.time.Clock()
         queues = self._threadmaster()
 
+        # A generated world replaces the test map when --generate is given,
+        # with a random size unless one is
+        if cli_args.generate is not None:
+            width, height, depth = cli_args.generate or random_size() + (2,)
+            self.game_map = MapGenerator(width, height, depth, seed=self.seed)
+
         # Initialize the LevelMap object which manages the world map and provides
         # conveience methods for MapItem instances
-        self.level_map = LevelMap(self.tile_map, level_map=self.game_map, db_path=self.db_path)
+        self.level_map = LevelMap(self.tile_map, level_map=self.game_map,
+                db_path=self.db_path, storage=cli_args.storage)
 
-        # Initialize the A* pathfinder
-        self.pathfinder = Pathfinder()
+        # Initialize the pathfinder (A* or hierarchical)
+        self.pathfinder = Pathfinder(algorithm=cli_args.pathfinder, workers=cli_args.path_workers)
+
+        # The Simulation steps every virt's AI at a fixed rate
+        self.simulation = Simulation(self.level_map, seed=self.seed, pathfinder=self.pathfinder)
 
         # The CharacterFactory is used to generate virtual villagers
         self.virt_factory = CharacterFactory(self.db_path, queues, self.pathfinder, self.sprite_cache)
         self.virt_pool = {}
 
         # Set up the game font renderers
-        pygame.font.init()
-        self.font_size = 15
-        self.small_font_size = 11
-        self.font_renderer = pygame.font.Font(self.game_font, self.font_size)
-        self.small_font_renderer = pygame.font.Font(self.game_font, self.small_font_size)
+        if not self.headless:
+            pygame.font.init()
+            self.font_size = 15
+            self.small_font_size = 11
+            self.font_renderer = pygame.font.Font(self.game_font, self.font_size)
+            self.small_font_renderer = pygame.font.Font(self.game_font, self.small_font_size)
+
+            # Rendered lines of text shared by the panels, and the panels
+            # of each side window and the bottom of the screen
+            self.text_cache = TextCache()
+            self.panels = {
+                self.SELECTION_WINDOW: Panel(self.SELECTION_PANEL, self.text_cache),
+                self.TILE_CONTENTS: Panel(self.CONTENTS_PANEL, self.text_cache),
+                self.TILE_META: Panel(self.META_PANEL, self.text_cache),
+                }
+            self.bottom_panel = Panel(self.BOTTOM_PANEL, self.text_cache)
 
     def _threadmaster(self):
 
@@ -120,17 +204,17 @@ class Game:
         self.task_q = queue.Queue(100)
 
         # The message queue allows the master thread to asynchronously communicate
-        # with virt threads, answering virt requests for game info
+        # with virtz, answering virt requests for game info
         self.msg_q = queue.Queue(100)
 
-        # The log queue receives log entries from virt worker threads to be
+        # The log queue receives log entries from virtz to be
         # handled by the master thread
         self.log_q = queue.Queue(20)
 
         # Threading lock to sync threads
         self.q_lock = threading.Lock()
 
-        # Kill switch for virt threads
+        # Kill switch for worker threads
         self.kill_event = threading.Event()
         self.kill_event.clear()
 
@@ -138,10 +222,35 @@ class Game:
 
     def _explore_tiles(self):
 
-        ''' Detect and mark newly explored tiles each turn '''
+        ''' Update what the living virtz see, only casting for those that
+            moved, and mark newly explored tiles
+        '''
 
-        positions = [self.virt_pool[virt_id].position for virt_id in self.virt_pool]
-        self.level_map.explore(positions)
+        viewers = {virt_id: (virt.position, virt.sight_radius)
+                for virt_id, virt in self.virt_pool.items() if virt.alive}
+        regions = self.level_map.explore(viewers)
+        if not self.headless:
+            self._fog_regions.extend(regions)
+
+    def _light_tiles(self):
+
+        ''' Follow the sun and the virtz' torches, relighting only around
+            the light sources that changed
+        '''
+
+        lighting = self.level_map.lighting
+        regions = lighting.update()
+        if lighting.set_daylight(daylight(*self.time_of_day)):
+            width, height, _ = self.level_map.bounds
+            regions.append((0, 0, 0, width, height))
+        for virt_id, virt in self.virt_pool.items():
+            key = 'torch', virt_id
+            if virt.alive and lighting.ambient[virt.position[2]] < self.TORCH_BELOW:
+                regions += lighting.set(key, virt.position, self.TORCH_RADIUS, self.TORCH_LIGHT)
+            else:
+                regions += lighting.remove(key)
+        if not self.headless:
+            self._light_regions.extend(regions)
 
     def _get_messages(self):
 
@@ -199,6 +308,12 @@ class Game:
         ''' Performs preparatory steps to be completed before the initial game loop '''
 
         self.level_map.prepare()    # Populate MapTiles and MapItems
+        if isinstance(self.game_map, MapGenerator) and self.game_map.start_point:
+            self.start_point = self.game_map.start_point
+        width, height, _ = self.level_map.bounds
+        self.camera.bounds = width, height
+        self.camera.center_on(self.start_point)
+        self.level_map.add_listener(self._changed_cells.append)
         self.pathfinder.graph = self.level_map
         for n in range(self.starting_virtz):
             # Instantiate and save virt list
@@ -207,56 +322,238 @@ class Game:
 
     def _start_virtz(self):
 
-        ''' Start virt worker threads '''
+        ''' Hand the virtz to the simulation scheduler '''
 
         for virt in self.virt_pool:
-            self.virt_pool[virt].level_map = self.level_map
-            self.virt_pool[virt].start()
+            self.simulation.add(self.virt_pool[virt])
+
+    def _is_static(self, item):
+
+        ''' Map-level items which cannot be picked up are baked into the map layer '''
+
+        return item.container is None and not item.can_get
+
+    def _view_px(self, position):
+
+        ''' Pixel (x, y) of a cell on the map view surfaces '''
+
+        x_loc, y_loc, _ = self._cell_to_px(position)
+        return x_loc - self.MAP_VIEW.x, y_loc - self.MAP_VIEW.y
+
+    def _layer_cell_blits(self, position):
+
+        ''' (image, dest) blits of the MapTile and static items at position
+            on the map view
+        '''
+
+        scaled = self.camera.scaled
+        dest = self._view_px(position)
+        tile = self.level_map[position]
+        blits = [(scaled(self.level_map.get_maptile_image(tile)), dest)]
+        for item in self.level_map.find_item(position=position):
+            if self._is_static(item):
+                blits.append((scaled(item.sprite), dest))
+        return blits
 
-    def _print_map(self):
+    def _compose_view(self):
 
-        ''' Blit MapTile images to the screen '''
+        ''' Draw the terrain and static items of the cells in view onto the
+            map view, enumerating those cells only
+        '''
 
-        #self.display.screen.fill((255, 255, 255))
-        for p in self.level_map.world_map:
-            if p[2] == self.level_map.level:
-                x_loc = p[0] * self.tile_w
-                y_loc = p[1] * self.tile_h
-                tile = self.level_map[p]
-                self.display.screen.blit(self.level_map.get_maptile_image(tile),
-                        (x_loc, y_loc))
+        camera = self.camera
+        depth = self.level_map.level
+        box = camera.box()
+        if self._map_view is None:
+            self._map_view = pygame.Surface(self.MAP_VIEW.size).convert()
+        # Past the edges of the map the view stays black
+        self._map_view.fill((0, 0, 0))
+        batch = BlitBatch()
+        batch.extend(self.level_map.level_tile_blits(depth, camera.cell_w, camera.cell_h,
+            box, camera.scaled))
+        for item in self.level_map.item_index.in_box(depth, *box):
+            if self._is_static(item):
+                batch.add(camera.scaled(item.sprite), self._view_px(item.position))
+        batch.submit(self._map_view)
+        return self._map_view
 
-    def _print_items(self):
+    def _fog_alpha(self, depth, x0, y0, x1, y1):
 
-        ''' Blit item sprites '''
+        ''' Fog opacity of each cell of a box, by what the virtz have seen '''
 
-        for item in self.level_map.items:
-            if item.container is None:  # Only interested in map-level items
-                x, y, z = item.position
-                x_loc = x * self.tile_w
-                y_loc = y * self.tile_h
-                if z == self.level_map.level:
-                    self.display.screen.blit(item.sprite, (x_loc, y_loc))
+        fov = self.level_map.fov
+        cells = np.where(fov.explored[depth, y0:y1, x0:x1], self.FOG_EXPLORED, self.FOG_UNEXPLORED)
+        cells[fov.visible[depth, y0:y1, x0:x1]] = 0
+        return cells
 
-    def _print_virtz(self):
+    def _shade_alpha(self, depth, x0, y0, x1, y1):
 
-        ''' Blit virt sprites '''
+        ''' Shade opacity of each cell of a box, by its light '''
 
-        for virt_id in self.virt_pool:
-            virt = self.virt_pool[virt_id]
-            x, y, z = virt.position
-            x_loc = x * self.tile_w
-            y_loc = y * self.tile_h
-            if z == self.level_map.level:
-                self.display.screen.blit(virt.sprite, (x_loc, y_loc))
+        light = self.level_map.lighting.brightness(depth, (x0, y0, x1, y1)).astype(np.uint16)
+        return (FULL_LIGHT - light) * self.MAX_DARKNESS // FULL_LIGHT
+
+    def _paint_overlay(self, overlay, cells, x0, y0):
+
+        ''' Set the opacity of the overlay pixels over a box of cells in
+            view from the (y, x) array of per-cell opacities of the box
+        '''
+
+        cell_w, cell_h = self.camera.cell_w, self.camera.cell_h
+        x_px, y_px = self._view_px((x0, y0, 0))
+        height, width = cells.shape
+        alpha = pygame.surfarray.pixels_alpha(overlay)
+        # surfarray indexes [x, y]; cells on the edge of the view are cut
+        target = alpha[x_px:x_px + width * cell_w, y_px:y_px + height * cell_h]
+        target[...] = np.repeat(np.repeat(cells.T, cell_w, 0), cell_h, 1)[
+                :target.shape[0], :target.shape[1]]
+        del alpha, target   # unlocks the surface
+
+    def _view_overlay(self, overlay, cell_alpha):
+
+        ''' Paint an overlay of the map view from cell_alpha over all the
+            cells in view, creating it on first use
+        '''
+
+        if overlay is None:
+            overlay = pygame.Surface(self.MAP_VIEW.size, pygame.SRCALPHA).convert_alpha()
+        overlay.fill((0, 0, 0, 255))
+        x0, y0, x1, y1 = self.camera.box()
+        if x0 < x1 and y0 < y1:
+            self._paint_overlay(overlay, cell_alpha(self.level_map.level, x0, y0, x1, y1), x0, y0)
+        return overlay
+
+    def _update_overlay(self, overlay, regions, cell_alpha):
+
+        ''' Repaint the overlay over the cells in view of the (z, x0, y0,
+            x1, y1) cell boxes in regions, returning the screen rects
+            affected
+        '''
+
+        vx0, vy0, vx1, vy1 = self.camera.box()
+        rects = []
+        while regions:
+            z, x0, y0, x1, y1 = regions.pop()
+            x0, y0, x1, y1 = max(x0, vx0), max(y0, vy0), min(x1, vx1), min(y1, vy1)
+            if z != self.level_map.level or x0 >= x1 or y0 >= y1:
+                continue
+            self._paint_overlay(overlay, cell_alpha(z, x0, y0, x1, y1), x0, y0)
+            x_loc, y_loc, _ = self._cell_to_px((x0, y0, z))
+            rects.append(pygame.Rect(x_loc, y_loc,
+                (x1 - x0) * self.camera.cell_w, (y1 - y0) * self.camera.cell_h))
+        return rects
+
+    def _update_map_view(self):
+
+        ''' Redraw the cells in view around positions reported by the
+            LevelMap since the last frame, returning the screen rects
+            affected
+        '''
+
+        camera = self.camera
+        rects = []
+        while self._changed_cells:
+            x, y, z = self._changed_cells.pop()
+            if z != self.level_map.level:
+                continue
+            # Edge images depend on neighbouring tiles
+            batch = BlitBatch()
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    position = x+dx, y+dy, z
+                    if camera.contains(position) and self.level_map.in_map(position):
+                        batch.extend(self._layer_cell_blits(position))
+            if batch:
+                batch.submit(self._map_view)
+                x0, y0, _ = self._cell_to_px((x-1, y-1, z))
+                rects.append(pygame.Rect(x0, y0, camera.cell_w * 3, camera.cell_h * 3))
+        return rects
+
+    def _print_map(self, batch):
+
+        ''' Queue the map view restored under everything drawn on the map
+            last frame and return the screen rects which need updating
+        '''
+
+        key = self.level_map.level, self.camera.version
+        if self._view_key != key:
+            # First frame on this level or since the camera moved, compose
+            # and copy the whole view
+            self._view_key = key
+            self._changed_cells.clear()
+            self._light_regions.clear()
+            self._fog_regions.clear()
+            self._compose_view()
+            self._shade_view = self._view_overlay(self._shade_view, self._shade_alpha)
+            self._fog_view = self._view_overlay(self._fog_view, self._fog_alpha)
+            for surface in (self._map_view, self._shade_view, self._fog_view):
+                batch.add(surface, self.MAP_VIEW)
+            return [self.MAP_VIEW]
+
+        changed = self._update_map_view() + \
+                self._update_overlay(self._shade_view, self._light_regions, self._shade_alpha) + \
+                self._update_overlay(self._fog_view, self._fog_regions, self._fog_alpha)
+        # The view is opaque, so restoring it covers whatever was drawn
+        # over the map; nothing is drawn outside of it
+        rects = [r.clip(self.MAP_VIEW) for r in self._sprite_rects + changed]
+        for rect in rects:
+            area = rect.move(-self.MAP_VIEW.x, -self.MAP_VIEW.y)
+            for surface in (self._map_view, self._shade_view, self._fog_view):
+                batch.add(surface, rect, area)
+        return rects
+
+    def _print_items(self, batch):
+
+        ''' Queue the sprites of items in view not baked into the map
+            view, on explored cells only, and return their screen rects
+        '''
+
+        level_map = self.level_map
+        camera = self.camera
+        key = (level_map.level, level_map.item_index.revision, level_map.fov.explored_version,
+                camera.version)
+        if key != self._item_blits_key:
+            explored = level_map.fov.explored
+            blits = []
+            for item in level_map.item_index.in_box(level_map.level, *camera.box()):
+                if item.container is None and not self._is_static(item):
+                    x, y, z = item.position
+                    if explored[z, y, x]:
+                        x_loc, y_loc, _ = self._cell_to_px(item.position)
+                        blits.append((camera.scaled(item.sprite), (x_loc, y_loc)))
+            self._item_blits = blits
+            self._item_blits_key = key
+        batch.extend(self._item_blits)
+        return [pygame.Rect(dest, (camera.cell_w, camera.cell_h)) for _, dest in self._item_blits]
+
+    def _print_virtz(self, batch):
+
+        ''' Queue the sprites of virtz in view and return their screen
+            rects
+        '''
+
+        camera = self.camera
+        x0, y0, x1, y1 = camera.box()
+        size = camera.cell_w, camera.cell_h
+        level = self.level_map.level
+        rects = []
+        for virt in self.virt_pool.values():
+            position = virt.position
+            x, y, z = position
+            if z == level and x0 <= x < x1 and y0 <= y < y1:
+                x_loc, y_loc, _ = camera.cell_to_px(position)
+                batch.add(camera.scaled(virt.sprite), (x_loc, y_loc))
+                rects.append(pygame.Rect((x_loc, y_loc), size))
+        return rects
 
     def tick(self):
 
         ''' If the game is not paused, process the main loop '''
 
         if not self.paused:
-            self.clock.tick(8)
+            elapsed = self.clock.tick(8)
             self._tick_count += 1
+            self.simulation.advance(elapsed / 1000)
 
     @property
     def game_date(self):
@@ -278,57 +575,80 @@ class Game:
         date_str += '{}:{:02} {}'.format(hours_in, mins_in, sep)
         return date_str
 
+    @property
+    def time_of_day(self):
+
+        ''' (hours, minutes) on the game clock '''
+
+        base_count = self._tick_count // 4
+        return base_count // 60 % 24, base_count % 60
+
     @property
     def night(self):
 
         ''' Indicates whether it is daytime (False) or nighttime (True) '''
 
-        d = self.game_date
+        hours, _ = self.time_of_day
         # 12 hour cycles for simplicity for now
-        return d['hours_in'] < 6 or d['hours_in'] >= 6
+        return hours < 6 or hours >= 18
 
     def _pre_loop(self):
 
         ''' Events to run on every iteration BEFORE the main loop '''
 
         self._explore_tiles()
+        self._light_tiles()
         self._print_logs()
-        self.display.screen.fill((0, 0, 0))
+        # Every map, item and virt blit of the frame goes out in one batch
+        batch = BlitBatch()
+        dirty = self._print_map(batch)
+
+        # Map rects drawn over the layer this frame are restored next frame
+        sprites = self._print_items(batch) + self._print_virtz(batch)
+        # Sprites on the edge of the view are cut at it
+        self.display.screen.set_clip(self.MAP_VIEW)
+        batch.submit(self.display.screen)
+        if self._selected is not None and self.camera.contains(self._selected):
+            sprites.append(self._selected_box())
+        if self._selected_object is not None and \
+                self.camera.contains(self._selected_object.position):
+            sprites.append(self._selected_obj_box())
+        self.display.screen.set_clip(None)
+
+        # Panel text is queued, then only the panels whose text changed
+        # are drawn and updated
         self._debug_info()
-        self._print_map()
-        self._render_borders()
-        self._print_items()
-        self._print_virtz()
         if self._selected is not None:
             self._render_selected()
-            self._selected_box()
             self._render_tile_contents(self._selected_tile_contents())
         if self._selected_object is not None:
             # Print item meta in selection window
             self._render_selected_meta(self._selected_object)
-            self._selected_obj_box()
-        pygame.display.flip()
+
+        screen = self.display.screen
+        panels = [panel.rect for panel in list(self.panels.values()) + [self.bottom_panel]
+                if panel.draw(screen)]
+
+        self._sprite_rects = sprites
+        pygame.display.update(dirty + sprites + panels)
 
     def _cell_to_px(self, position):
 
-        ''' Convert cell to px '''
+        ''' Convert cell to screen px, through the camera '''
 
-        x, y, z = position
-        return x * self.tile_w, y * self.tile_h, z
+        return self.camera.cell_to_px(position)
 
     def _px_to_cell(self, position):
 
-        ''' Convert px to cell '''
+        ''' Convert screen px to cell through the camera, None off the map view '''
 
-        x, y, z = position
-        return x // self.tile_w, y // self.tile_h, z
+        return self.camera.px_to_cell(position)
 
     def _selected_box(self):
 
         ''' Prints the box highlighting selected tiles in the game map '''
 
-        x0, y0, _ = self._cell_to_px(self._selected)
-        rect = pygame.Rect(x0, y0, self.tile_w, self.tile_h)
+        rect = self.camera.cell_rect(self._selected)
         mod = self._tick_count % 3
         if mod == 0:
             col = (255, 0, 0)
@@ -336,14 +656,13 @@ class Game:
             col = (255, 70, 0)
         elif mod == 2:
             col = (255, 140, 0)
-        pygame.draw.rect(self.display.screen, col, rect, 1)
+        return pygame.draw.rect(self.display.screen, col, rect, 1)
 
     def _selected_obj_box(self):
 
         ''' Prints a box around selected items or virtz '''
 
-        x0, y0, _ = self._cell_to_px(self._selected_object.position)
-        rect = pygame.Rect(x0, y0, self.tile_w, self.tile_h)
+        rect = self.camera.cell_rect(self._selected_object.position)
         mod = self._tick_count % 3
         if mod == 0:
             col = (0, 0, 255)
@@ -351,36 +670,37 @@ class Game:
             col = (135, 206, 250)
         elif mod == 2:
             col = (224, 255, 255)
-        pygame.draw.rect(self.display.screen, col, rect, 1)
+        return pygame.draw.rect(self.display.screen, col, rect, 1)
 
     def _debug_info(self):
 
         ''' Capture mouse position and render labels '''
 
-        timestamp = self.font_renderer.render(self.game_date, 1, (255, 255, 255))
-        selection = self.font_renderer.render('Selected: {}'.format(self._selected), 1, (255, 255, 255))
-        self.display.screen.blit(timestamp, (3, 732))
-        self.display.screen.blit(selection, (3, 748))
+        panel = self.bottom_panel
+        panel.text(self.font_renderer, self.game_date, (255, 255, 255), (3, 732))
+        panel.text(self.font_renderer, 'Selected: {}'.format(self._selected), (255, 255, 255), (3, 748))
         if self.DEBUG:
             x, y = pygame.mouse.get_pos()
-            x0, y0 = x // self.tile_w, y // self.tile_h
+            x0, y0, _ = self._px_to_cell((x, y, self.level_map.level)) or (None, None, None)
             mouse_str = 'Mouse @ ({}, {}) / ({}, {})'.format(x, y, x0, y0)
-            mouse_loc = self.font_renderer.render(mouse_str, 1, (255, 255, 255))
-            self.display.screen.blit(mouse_loc, (3, 716))
+            panel.text(self.font_renderer, mouse_str, (255, 255, 255), (3, 716))
         if self.paused:
-            pause_msg = self.font_renderer.render('Paused', 1, (0, 255, 50))
-            self.display.screen.blit(pause_msg, (250, 748))
+            panel.text(self.font_renderer, 'Paused', (0, 255, 50), (250, 748))
 
     def _flash_map(self):
 
-        ''' Fill the map with the default tile '''
+        ''' Fill the cells in view with the default tile '''
 
-        for p in self.level_map.world_map:
-            if p[2] == self.level_map.level:
-                x_loc = p[0] * self.tile_w
-                y_loc = p[1] * self.tile_h
-                tile = self.level_map[p]
-                self.display.screen.blit(self.level_map.default_tile, (x_loc, y_loc))
+        tile = self.camera.scaled(self.level_map.default_tile)
+        x0, y0, x1, y1 = self.camera.box()
+        z = self.level_map.level
+        batch = BlitBatch()
+        for y in range(y0, y1):
+            for x in range(x0, x1):
+                if self.level_map.in_map((x, y, z)):
+                    x_loc, y_loc, _ = self._cell_to_px((x, y, z))
+                    batch.add(tile, (x_loc, y_loc))
+        batch.submit(self.display.screen)
 
     def _render_virt_meta(self, virt):
 
@@ -496,7 +816,8 @@ class Game:
         tile_meta += 'Name:           {}\n'.format(tile.name)
         tile_meta += 'Position:       {}\n'.format(tile.position)
         tile_meta += 'Blocked:        {}\n'.format(tile.blocking)
-        tile_meta += 'Explored:       {}\n'.format(tile.explored)
+        tile_meta += 'Explored:       {}\n'.format(self.level_map.fov.is_explored(tile.position))
+        tile_meta += 'Visible:        {}\n'.format(self.level_map.fov.is_visible(tile.position))
         tile_meta += 'Visited:        {}\n'.format(tile.visited)
         if self.DEBUG:
             tile_meta += 'Wall:           {}\n'.format(tile.wall)
@@ -518,7 +839,8 @@ class Game:
             small = False
         else:
             raise ValueError
-        self._multiline_text(meta_string, h_start, v_start=v_start, small=small)
+        self._multiline_text(meta_string, h_start, v_start=v_start, small=small,
+                panel=self.panels[destination])
 
     def _render_tile_contents(self, tile_contents):
         self.selectable = []
@@ -530,29 +852,28 @@ class Game:
         else:
             renderer = self.font_renderer
             step = 18
+        panel = self.panels[self.TILE_CONTENTS]
         for item in tile_contents:
             name, obj = item
-            meta_text = renderer.render(name, 1, (255, 255, 255))
+            meta_text = panel.text(renderer, name, (255, 255, 255), (v_start, h_start))
             meta_rect = meta_text.get_rect()
             meta_rect.move_ip(v_start, h_start)
-            self.display.screen.blit(meta_text, (v_start, h_start))
             meta_rect.inflate_ip(2, 2)
-            pygame.draw.rect(self.display.screen, (0, 10, 225), meta_rect, 2)
+            panel.box(meta_rect, (0, 10, 225), 2)
             self.selectable.append((meta_rect, obj))
             h_start += step
 
-    def _multiline_text(self, text, h_start, v_start=None, small=False):
+    def _multiline_text(self, text, h_start, v_start=None, small=False, panel=None):
+        panel = panel if panel is not None else self.panels[self.SELECTION_WINDOW]
         h_px = h_start
         v_start = v_start if v_start is not None else 935
         for line in text.split('\n'):
             if not small:
                 step = 16
-                meta_text = self.font_renderer.render(line, 1, (255, 255, 255))
+                panel.text(self.font_renderer, line, (255, 255, 255), (v_start, h_px))
             else:
                 step = 10
-                meta_text = self.small_font_renderer.render(line, 1, (255, 255, 255))
-
-            self.display.screen.blit(meta_text, (v_start, h_px))
+                panel.text(self.small_font_renderer, line, (255, 255, 255), (v_start, h_px))
             h_px += step
 
     def _render_borders(self):
@@ -591,7 +912,8 @@ class Game:
 
     def _failsafe(self):
         self.kill_event.set()
-        print(' -  Failsafe triggered, kill signal sent to virtz\n -  Ctrl+C to force quit')
+        self.pathfinder.close()
+        print(' -  Failsafe triggered, kill signal sent to workers\n -  Ctrl+C to force quit')
         pygame.display.quit()
         pygame.quit()
         self.game_over = True
@@ -605,18 +927,73 @@ class Game:
                 return
 
         # If the click didn't correspond to a selectable object, process map selection
-        new_selection = position[0] // self.tile_w, position[1] // self.tile_h, self.level_map.level
-        if self.level_map.in_map(new_selection):
+        new_selection = self._px_to_cell((position[0], position[1], self.level_map.level))
+        if new_selection is not None and self.level_map.in_map(new_selection):
             self._selected = new_selection
             print('[!] Tile Selected: {}'.format(self._selected))
 
     def deselect(self):
         self._selected = None
 
+    def _pan(self, key):
+
+        ''' Pan the camera PAN_STEP cells for an arrow or WASD key '''
+
+        step = self.PAN_STEP
+        moves = {
+            pygame.K_UP: (0, -step), pygame.K_w: (0, -step),
+            pygame.K_DOWN: (0, step), pygame.K_s: (0, step),
+            pygame.K_LEFT: (-step, 0), pygame.K_a: (-step, 0),
+            pygame.K_RIGHT: (step, 0), pygame.K_d: (step, 0),
+            }
+        self.camera.pan(*moves[key])
+
+    def run_headless(self, ticks):
+
+        ''' Run the simulation for a number of ticks as fast as possible,
+            without rendering, then print a summary
+        '''
+
+        self._prepare()
+        self._start_virtz()
+
+        # Keep the game clock in step with the windowed 8 fps render loop
+        frames_per_step = 8 // self.simulation.rate
+        start_time = time.perf_counter()
+        with InterruptHandler() as h:
+            while self.simulation.tick_count < ticks and not h.interrupted:
+                self.simulation.step()
+                self._tick_count += frames_per_step
+                self._explore_tiles()
+                self._light_tiles()
+                self._print_logs()
+        elapsed = time.perf_counter() - start_time
+        self.pathfinder.close()
+        self._print_summary(elapsed)
+
+    def _print_summary(self, elapsed):
+
+        ''' Print timing and state statistics at the end of a headless run '''
+
+        virtz = self.simulation.virtz
+        alive = sum(1 for v in virtz if v.alive)
+        explored = int(self.level_map.fov.explored.sum())
+        ticks = self.simulation.tick_count
+        print('[*] Headless run complete')
+        print(' -  Ticks:          {}'.format(ticks))
+        print(' -  Elapsed:        {:.2f}s'.format(elapsed))
+        print(' -  Ticks/sec:      {:.1f}'.format(ticks / elapsed if elapsed else 0))
+        print(' -  Game date:      {}'.format(self.game_date))
+        print(' -  Virtz alive:    {} / {}'.format(alive, len(virtz)))
+        print(' -  Items on map:   {}'.format(len(self.level_map.items)))
+        print(' -  Tiles explored: {} / {}'.format(explored, len(self.level_map.world_map)))
+
     def game_loop(self):
         self._prepare()
         self._start_virtz()
         self._flash_map()
+        # The borders are drawn once, the panels are redrawn inside them
+        self._render_borders()
         pygame.display.flip()
         self.paused = False
         with InterruptHandler() as h:
@@ -638,8 +1015,7 @@ class Game:
                                 continue
                             elif event.key == pygame.K_SPACE:
                                 self.paused = not self.paused
-                                for v in self.virt_pool:
-                                    self.virt_pool[v].pause = self.paused
+                                self.simulation.paused = self.paused
                             elif event.key == pygame.K_F1:
                                 self.DEBUG = not self.DEBUG
                             elif event.key == pygame.K_ESCAPE:
@@ -658,6 +1034,25 @@ class Game:
                                         move = self._selected[0]+1, self._selected[1], self._selected[2]
                                     if move in self.level_map.world_map:
                                         self._selected = move
+                                        # Keep the selection in view
+                                        if not self.camera.contains(move):
+                                            self.camera.center_on(move)
+                                else:
+                                    self._pan(event.key)
+                            elif event.key in (pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d):
+                                self._pan(event.key)
+                            elif event.key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+                                self.camera.zoom_in()
+                            elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                                self.camera.zoom_out()
+                        elif event.type == pygame.MOUSEWHEEL:
+                            # Zoom about the cell under the mouse
+                            x, y = pygame.mouse.get_pos()
+                            anchor = self._px_to_cell((x, y, self.level_map.level))
+                            if event.y > 0:
+                                self.camera.zoom_in(anchor)
+                            elif event.y < 0:
+                                self.camera.zoom_out(anchor)
                         elif event.type == pygame.MOUSEBUTTONDOWN:
                             button = event.button
                             if button == 1:
@@ -672,9 +1067,31 @@ def cli():
             help='Run the game in fullscreen mode (default=OFF)')
     parser.add_argument('-t', '--test', action='store_true',
             help='Enable test mode (1 virt, DEBUG on)')
-    return parser.parse_args()
+    parser.add_argument('-s', '--seed', type=int, default=None,
+            help='Random seed for virt generation and the simulation')
+    parser.add_argument('--headless', action='store_true',
+            help='Run the simulation without a window, as fast as possible')
+    parser.add_argument('--ticks', type=int, default=1000,
+            help='Number of simulation ticks to run in headless mode (default=1000)')
+    parser.add_argument('--pathfinder', choices=Pathfinder.ALGORITHMS, default='astar',
+            help='Pathfinding algorithm, hpa for large multi-level maps (default=astar)')
+    parser.add_argument('--storage', choices=('grid', 'chunked'), default='grid',
+            help='Map storage, chunked loads chunks on demand for huge maps (default=grid)')
+    parser.add_argument('--generate', nargs='?', const=(), type=parse_size, default=None,
+            metavar='WxHxD', help='Play on a generated world of this size, or of a random '
+            'size if none is given, instead of the test map')
+    parser.add_argument('--path-workers', type=int, default=0,
+            help='Worker processes searching each tick\'s paths in a batch, grid storage '
+            'only (default=0, off)')
+    args = parser.parse_args()
+    if args.path_workers and args.storage != 'grid':
+        parser.error('--path-workers needs --storage grid')
+    return args
 
 if __name__ == '__main__':
     this.cli_args = cli()
     game = Game()
-    game.game_loop()
+    if cli_args.headless:
+        game.run_headless(cli_args.ticks)
+    else:
+        game.game_loop()